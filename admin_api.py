@@ -0,0 +1,38 @@
+# admin_api.py
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response
+
+import profiling
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+
+def require_admin(token: Optional[str]) -> None:
+    if not profiling.ADMIN_TOKEN:
+        raise HTTPException(403, "Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not profiling.is_admin(token):
+        raise HTTPException(403, "Invalid admin token")
+
+
+@router.get("/profiles/{request_id}")
+def get_profile(
+    request_id: str,
+    format: str = Query("json", pattern="^(json|text|pstats)$"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Profile of one request, by its X-Request-ID: JSON summary (wall time,
+    tracemalloc peak, top functions), the pstats listing as text, or the raw
+    pstats file (`python -m pstats file` / snakeviz).
+    """
+    require_admin(x_admin_token)
+    record = profiling.load(request_id)
+    if record is None:
+        raise HTTPException(404, f"No profile for request {request_id}")
+    if format == "text":
+        return PlainTextResponse(profiling.text_report(record))
+    if format == "pstats":
+        return Response(profiling.pstats_bytes(record), media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{request_id}.pstats"'})
+    return {"success": True, **{k: v for k, v in record.items() if k != "pstats"}}
@@ -0,0 +1,178 @@
+# admission.py
+"""
+Admission control for the expensive endpoints (/process-invoice/, /ai/parse).
+
+Every worker runs at most ADMISSION_SLOTS jobs at once and each caller (API
+key, else Origin, else IP) at most CLIENT_MAX_CONCURRENT of them; the rest
+wait in a queue, and a caller with too many waiting jobs gets 429.
+
+Jobs are classified before they queue by a quick text-layer probe: PDFs with
+extractable text are "text" jobs (cost 1), scans are "ocr" jobs (cost = pages).
+Free slots are handed out by weighted fair queueing (stride scheduling)
+between the classes — with the default weights text:4, ocr:1 text jobs keep
+flowing while a 40-page scan is waiting, and scans still get their share.
+Queue wait is returned in X-Queue-Wait-Ms and summed in the metrics.
+"""
+import os
+import io
+import time
+import asyncio
+import hashlib
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+import metrics
+
+ADMISSION_SLOTS = int(os.getenv("ADMISSION_SLOTS", "4"))
+CLIENT_MAX_CONCURRENT = int(os.getenv("CLIENT_MAX_CONCURRENT", "2"))
+CLIENT_MAX_WAITING = int(os.getenv("CLIENT_MAX_WAITING", "20"))
+ADMISSION_WEIGHTS = {
+    name.strip(): float(w)
+    for name, w in (item.split(":") for item in os.getenv("ADMISSION_WEIGHTS", "text:4,ocr:1").split(",") if item.strip())
+}
+OCR_MAX_COST = 20           # a 200-page scan shouldn't block its class forever
+PROBE_MIN_CHARS = 50        # same threshold as extract_text_from_file's OCR fallback
+
+
+def client_id(headers, client_host: Optional[str]) -> str:
+    """Caller identity for the quotas (the API key is hashed, never stored)."""
+    key = headers.get("x-api-key")
+    if key:
+        return "key:" + hashlib.sha256(key.encode()).hexdigest()[:12]
+    origin = headers.get("origin")
+    if origin:
+        return "origin:" + origin
+    return "ip:" + (client_host or "unknown")
+
+
+def classify(data: bytes, filename: str) -> tuple[str, float]:
+    """("text" | "ocr", cost) from the first page's text layer; no OCR, no full parse."""
+    if not filename.lower().endswith(".pdf"):
+        return "text", 1.0
+    from shared_state import cache_get
+    if cache_get("extraction", f"text:{hashlib.sha256(data).hexdigest()}") is not None:
+        return "text", 1.0                  # already extracted (e.g. a dry run came first)
+    try:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(io.BytesIO(data))
+        pages = len(reader.pages)
+        text = (reader.pages[0].extract_text() or "") if pages else ""
+    except Exception:
+        return "text", 1.0                  # unreadable: fails fast downstream
+    if len(text.strip()) > PROBE_MIN_CHARS:
+        return "text", 1.0
+    return "ocr", float(min(max(pages, 1), OCR_MAX_COST))
+
+
+class _Waiter:
+    __slots__ = ("client", "cls", "cost", "future", "queued_at")
+
+    def __init__(self, client: str, cls: str, cost: float):
+        self.client, self.cls, self.cost = client, cls, cost
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+
+
+class Scheduler:
+    """Per-worker slots + per-client quotas + stride scheduling between job classes (event-loop only, no locks)."""
+
+    def __init__(self, slots: int = ADMISSION_SLOTS, per_client: int = CLIENT_MAX_CONCURRENT,
+                 max_waiting: int = CLIENT_MAX_WAITING, weights: Optional[dict] = None):
+        self.slots, self.per_client, self.max_waiting = slots, per_client, max_waiting
+        self.weights = dict(weights or ADMISSION_WEIGHTS)
+        self.active = 0
+        self.active_by_client: Counter = Counter()
+        self.waiting_by_client: Counter = Counter()
+        self.queues: dict[str, deque] = {}
+        self.passes: dict[str, float] = {}
+        self.vtime = 0.0
+
+    def _eligible(self, queue: deque) -> Optional[_Waiter]:
+        return next((w for w in queue if self.active_by_client[w.client] < self.per_client), None)
+
+    def _dispatch(self) -> None:
+        while self.active < self.slots:
+            best = None
+            for cls, queue in self.queues.items():
+                w = self._eligible(queue)
+                if w is not None and (best is None or self.passes[cls] < self.passes[best.cls]):
+                    best = w
+            if best is None:
+                return
+            self.queues[best.cls].remove(best)
+            self.waiting_by_client[best.client] -= 1
+            self.vtime = self.passes[best.cls]
+            self.passes[best.cls] += best.cost / self.weights.get(best.cls, 1.0)
+            self.active += 1
+            self.active_by_client[best.client] += 1
+            best.future.set_result(None)
+
+    async def acquire(self, client: str, cls: str, cost: float) -> float:
+        """Waits for a slot; returns the queue wait in seconds. 429 when the caller already has too many waiting."""
+        if self.waiting_by_client[client] >= self.max_waiting:
+            raise HTTPException(429, f"Too many queued requests for this client (max {self.max_waiting})")
+        queue = self.queues.setdefault(cls, deque())
+        if not queue:
+            # a class that was idle doesn't bank credit: it starts at the current virtual time
+            self.passes[cls] = max(self.passes.get(cls, 0.0), self.vtime)
+        w = _Waiter(client, cls, cost)
+        queue.append(w)
+        self.waiting_by_client[client] += 1
+        self._dispatch()
+        try:
+            await w.future
+        except asyncio.CancelledError:
+            if w.future.done() and not w.future.cancelled():
+                self.release(client)         # got the slot just as the caller went away
+            else:
+                queue.remove(w)
+                self.waiting_by_client[client] -= 1
+            raise
+        return time.perf_counter() - w.queued_at
+
+    def release(self, client: str) -> None:
+        self.active -= 1
+        self.active_by_client[client] -= 1
+        self._dispatch()
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def snapshot(self) -> dict:
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "waiting": {cls: len(q) for cls, q in self.queues.items()},
+            "passes": {cls: round(p, 2) for cls, p in self.passes.items()},
+        }
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
+
+
+@asynccontextmanager
+async def admitted(client: str, cls: str, cost: float) -> AsyncIterator[float]:
+    """Holds one slot for the block; yields the queue wait in ms."""
+    sched = scheduler()
+    try:
+        waited = await sched.acquire(client, cls, cost)
+    except HTTPException:
+        metrics.incr("admission_rejected")
+        raise
+    wait_ms = round(waited * 1000, 1)
+    metrics.incr(f"admission_{cls}_admitted")
+    metrics.incr(f"admission_{cls}_wait_ms", int(wait_ms))
+    try:
+        yield wait_ms
+    finally:
+        sched.release(client)
@@ -1,43 +1,53 @@
 # ai_endpoint.py
+import io
 import os
 import re
 import json
-import tempfile
-from datetime import datetime
+import hashlib
+from datetime import date, datetime
 from typing import Any, Dict, Optional
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Body
+from fastapi import APIRouter, UploadFile, File, HTTPException, Body, Query, Request
+from fastapi.responses import Response, StreamingResponse
 
 from ai_schema import Invoice, run_basic_validation
+import admission
+import feedback_store
+import metrics
+from pdf_tables import extract_table_lines
+from pipeline import to_thread
+import profiling
+import recipient_registry
+import supplier_profiles
+from resilience import breaker
 
 router = APIRouter(prefix="/ai", tags=["AI"])
 
 # ---------------------------
 # Text extraction (PDF → text)
 # ---------------------------
-def _extract_text_pypdf2(path: str) -> str:
+def _extract_text_pypdf2(data: bytes) -> str:
     try:
         import PyPDF2  # type: ignore
         text = []
-        with open(path, "rb") as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                text.append(page.extract_text() or "")
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        for page in reader.pages:
+            text.append(page.extract_text() or "")
         return "\n".join(text).strip()
     except Exception:
         return ""
 
-def _extract_text_pdfminer(path: str) -> str:
+def _extract_text_pdfminer(data: bytes) -> str:
     try:
         from pdfminer.high_level import extract_text  # type: ignore
-        return (extract_text(path) or "").strip()
+        return (extract_text(io.BytesIO(data)) or "").strip()
     except Exception:
         return ""
 
-def extract_text_from_pdf(path: str) -> str:
-    text = _extract_text_pypdf2(path)
+def extract_text_from_pdf(data: bytes) -> str:
+    text = _extract_text_pypdf2(data)
     if not text:
-        text = _extract_text_pdfminer(path)
+        text = _extract_text_pdfminer(data)
     return text
 
 # ---------------------------
@@ -132,6 +142,8 @@ def parse_rule_based(text: str) -> Dict[str, Any]:
 # ---------------------------
 # Optional OpenAI parser
 # ---------------------------
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+
 def parse_with_openai(text: str) -> Dict[str, Any]:
     """
     Uses OpenAI (if configured) to parse invoice into JSON.
@@ -146,7 +158,7 @@ def parse_with_openai(text: str) -> Dict[str, Any]:
     except Exception as e:
         raise RuntimeError("openai package not installed") from e
 
-    client = OpenAI(api_key=api_key)
+    client = OpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT, max_retries=0)
 
     system = (
         "You are an expert invoice parser for Bulgarian/English invoices. "
@@ -160,7 +172,9 @@ def parse_with_openai(text: str) -> Dict[str, Any]:
     user = "Extract an Invoice object from the text below. If unknown, omit or set sensible default.\n\nTEXT:\n" + text[:15000]
 
     try:
-        resp = client.responses.create(
+        # breaker: כש-OpenAI לא זמין נופלים מיד ל-rule-based במקום לחכות ל-timeout בכל חשבונית
+        resp = breaker("openai").call(
+            client.responses.create,
             model=os.getenv("OPENAI_MODEL", "gpt-4.1-mini"),
             temperature=0.2,
             system=system,
@@ -229,27 +243,50 @@ def merge_payloads(primary: Dict[str, Any], secondary: Dict[str, Any]) -> Dict[s
 # Endpoints
 # ---------------------------
 @router.post("/parse", response_model=Invoice)
-async def parse_invoice(file: UploadFile = File(...)):
+async def parse_invoice(request: Request, file: UploadFile = File(...)):
     if file.content_type not in ("application/pdf", "application/octet-stream"):
         raise HTTPException(400, "Only PDF files are supported")
 
-    # Save temp PDF
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-
-    try:
-        text = extract_text_from_pdf(tmp_path)
-        if not text:
-            raise HTTPException(422, "Could not extract text from PDF")
+    # The whole pipeline works on the in-memory upload (no temp file)
+    data = await file.read()
+    # Admission: per-caller quota + fair share between text PDFs and scans;
+    # the parse itself is blocking (PDF, OpenAI), so it runs off the event loop
+    client = admission.client_id(request.headers, request.client.host if request.client else None)
+    cls, cost = await to_thread(admission.classify, data, file.filename or "upload.pdf")
+    async with admission.admitted(client, cls, cost) as wait_ms:
+        response = await to_thread(profiling.run, _parse_invoice, data, file.filename)
+    response.headers["X-Queue-Wait-Ms"] = str(wait_ms)
+    return response
 
-        # Always build a rule-based baseline
-        rule_payload: Dict[str, Any] = parse_rule_based(text)
 
+def _parse_invoice(data: bytes, filename: Optional[str]) -> Response:
+    text = extract_text_from_pdf(data)
+    if not text:
+        raise HTTPException(422, "Could not extract text from PDF")
+
+    # keep the text by hash: corrections sent to /ai/feedback are learned against it
+    source_hash = hashlib.sha256(data).hexdigest()
+    feedback_store.save_source(source_hash, text)
+
+    # Always build a rule-based baseline (line table from the PDF's glyph positions)
+    rule_payload: Dict[str, Any] = parse_rule_based(text)
+    rule_payload["service_lines"] = [
+        {"description": it["description"], "quantity": it["quantity"],
+         "unit_price": it["unit_price"], "currency": it["currency"]}
+        for it in extract_table_lines(io.BytesIO(data), default_currency=rule_payload["currency"])
+    ]
+
+    # Known supplier layout → deterministic extraction, no model call
+    profile_payload = supplier_profiles.apply(text)
+    metrics.incr("profile_hit" if profile_payload else "profile_miss")
+
+    if profile_payload:
+        payload: Dict[str, Any] = merge_payloads(profile_payload, rule_payload)
+    else:
         # Try AI; if weak or missing, merge with baseline (hybrid)
         try:
             ai_payload: Dict[str, Any] = parse_with_openai(text)
-            payload: Dict[str, Any] = ai_payload
+            payload = ai_payload
             if needs_fallback(ai_payload, THRESH):
                 payload = merge_payloads(ai_payload, rule_payload)
                 payload["extractor"] = "hybrid"
@@ -260,46 +297,43 @@ async def parse_invoice(file: UploadFile = File(...)):
             # If AI call fails or not configured — use rule-based only
             payload = rule_payload
 
-        # Ensure required blocks exist
-        payload.setdefault("supplier", {"name": ""})
-        payload.setdefault("recipient", {"name": ""})
-        payload.setdefault("service_lines", [])
-        payload.setdefault("totals", {
-            "subtotal": 0.0, "tax_total": 0.0, "grand_total": 0.0,
-            "currency": payload.get("currency", "EUR")
-        })
-        payload.setdefault("currency", (payload.get("totals") or {}).get("currency", "EUR"))
-        payload["source_file"] = file.filename
-
-        # Validate & adjust confidence
-        model = Invoice(**payload)
-        errs, warns = run_basic_validation(model)
-        model.validation_errors = errs
-        model.validation_warnings = warns
-
-        # If rule-only and some key fields found → small bump
-        if payload.get("extractor") == "rule":
-            filled = sum(1 for v in [model.invoice_number, model.issue_date, model.currency] if v)
-            model.extraction_confidence = min(0.6, 0.25 + 0.15 * filled)
-
-        # If hybrid and no critical errors → boost a bit
-        if payload.get("extractor") == "hybrid" and not model.validation_errors:
-            model.extraction_confidence = min(0.85, max(model.extraction_confidence, 0.7))
-
-        return model
-
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+    # Ensure required blocks exist
+    payload.setdefault("supplier", {"name": ""})
+    payload.setdefault("recipient", {"name": ""})
+    payload.setdefault("service_lines", [])
+    payload.setdefault("totals", {
+        "subtotal": 0.0, "tax_total": 0.0, "grand_total": 0.0,
+        "currency": payload.get("currency", "EUR")
+    })
+    payload.setdefault("currency", (payload.get("totals") or {}).get("currency", "EUR"))
+    payload["source_file"] = filename
+    payload["source_hash"] = source_hash
+
+    # Validate & adjust confidence (one validated construction, then a cheap copy)
+    model = Invoice.model_validate(payload)
+    errs, warns = run_basic_validation(model)
+    updates: Dict[str, Any] = {"validation_errors": errs, "validation_warnings": warns}
+
+    # If rule-only and some key fields found → small bump
+    if payload.get("extractor") == "rule":
+        filled = sum(1 for v in [model.invoice_number, model.issue_date, model.currency] if v)
+        updates["extraction_confidence"] = min(0.6, 0.25 + 0.15 * filled)
+
+    # If hybrid and no critical errors → boost a bit
+    if payload.get("extractor") == "hybrid" and not errs:
+        updates["extraction_confidence"] = min(0.85, max(model.extraction_confidence, 0.7))
+
+    # Profile without a line table can't be cross-checked against the totals
+    if payload.get("extractor") == "profile" and errs:
+        updates["extraction_confidence"] = 0.7
+
+    # already validated: serialise once with the model's compiled serializer
+    # instead of letting FastAPI re-validate it against response_model
+    return Response(model.model_copy(update=updates).model_dump_json(), media_type="application/json")
 
 # ---------------------------
-# Feedback endpoint (save corrections)
+# Feedback endpoints (corrections store)
 # ---------------------------
-FEEDBACK_DIR = os.getenv("FEEDBACK_DIR", "/app/data/feedback")
-os.makedirs(FEEDBACK_DIR, exist_ok=True)
-
 @router.post("/feedback")
 async def save_feedback(
     payload: Dict[str, Any] = Body(..., description="Corrected Invoice JSON (schema-compatible)")
@@ -308,20 +342,58 @@ async def save_feedback(
     שומר JSON מתוקן להפעלה עתידית/בדיקות/RAG.
     קלט: כל האובייקט כפי שמחזיר /ai/parse, לאחר תיקונים ידניים בפרונט.
     """
-    # sanity: must include source_file for traceability
-    src = payload.get("source_file") or "unknown"
-    ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-    safe_src = re.sub(r"[^A-Za-z0-9_.-]+", "_", src)
-    out = os.path.join(FEEDBACK_DIR, f"{ts}__{safe_src}.json")
-
     # validate loosely (try to instantiate; don't fail hard)
     try:
-        _ = Invoice(**payload)
+        Invoice.model_validate(payload)
     except Exception:
         # keep anyway; but mark invalid
         payload.setdefault("_meta", {})["_invalid_schema"] = True
 
-    with open(out, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    fid = feedback_store.add_feedback(payload)
+    if not (payload.get("_meta") or {}).get("_invalid_schema"):
+        recipient = payload.get("recipient") or {}
+        recipient_registry.record(recipient.get("name"), vat=recipient.get("vat_id"), address=recipient.get("address"))
+
+    # re-learn this supplier's layout profile with the new correction
+    profile = None
+    vat = (payload.get("supplier") or {}).get("vat_id")
+    if vat:
+        profile = supplier_profiles.learn(vat)
+    return {"success": True, "saved": fid, "profile_updated": profile is not None}
+
+@router.get("/feedback")
+def list_feedback(
+    supplier_vat: Optional[str] = None,
+    source_hash: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    items = feedback_store.query_feedback(supplier_vat, source_hash, date_from, date_to, limit, offset)
+    return {"success": True, "count": len(items), "items": items}
+
+@router.get("/feedback/export")
+def export_feedback(
+    supplier_vat: Optional[str] = None,
+    source_hash: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """Bulk export as JSON Lines (one correction per line), streamed."""
+    return StreamingResponse(
+        feedback_store.iter_export(supplier_vat, source_hash, date_from, date_to),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="feedback.jsonl"'},
+    )
+
+@router.get("/feedback/validation")
+def validate_feedback(limit: int = Query(100, ge=1, le=1000)):
+    """Re-checks the arithmetic of the whole corrections corpus (e.g. after a rule change), in batches."""
+    return {"success": True, **feedback_store.revalidate(limit)}
 
-    return {"success": True, "saved": os.path.basename(out)}
+@router.get("/profiles")
+def list_profiles():
+    """Learned supplier layout profiles (what /ai/parse uses before calling the model)."""
+    items = feedback_store.load_profiles()
+    return {"success": True, "count": len(items), "items": items}
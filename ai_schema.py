@@ -1,7 +1,7 @@
 # ai_schema.py
 from __future__ import annotations
 from typing import List, Optional
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, model_validator
 from datetime import date
 
 class Party(BaseModel):
@@ -22,23 +22,18 @@ class ServiceLine(BaseModel):
     tax_amount: Optional[float] = None
     line_total: Optional[float] = None  # with tax, in original currency
 
-    @validator("tax_amount", always=True)
-    def _calc_tax_amount(cls, v, values):
-        if v is not None:
-            return round(v, 2)
-        qty = float(values.get("quantity") or 0.0)
-        price = float(values.get("unit_price") or 0.0)
-        rate = float(values.get("tax_rate") or 0.0)
-        return round(qty * price * (rate / 100.0), 2)
-
-    @validator("line_total", always=True)
-    def _calc_line_total(cls, v, values):
-        if v is not None:
-            return round(v, 2)
-        qty = float(values.get("quantity") or 0.0)
-        price = float(values.get("unit_price") or 0.0)
-        tax = float(values.get("tax_amount") or 0.0)
-        return round(qty * price + tax, 2)
+    @model_validator(mode="after")
+    def _fill_amounts(self):
+        # writes straight into __dict__: BaseModel.__setattr__ costs more than the math
+        d = self.__dict__
+        qty = d["quantity"] or 0.0
+        price = d["unit_price"] or 0.0
+        tax = d["tax_amount"]
+        tax = round(tax, 2) if tax is not None else round(qty * price * ((d["tax_rate"] or 0.0) / 100.0), 2)
+        total = d["line_total"]
+        d["tax_amount"] = tax
+        d["line_total"] = round(total, 2) if total is not None else round(qty * price + tax, 2)
+        return self
 
 class Totals(BaseModel):
     subtotal: float = 0.0     # before tax (original currency)
@@ -48,6 +43,7 @@ class Totals(BaseModel):
 
 class Invoice(BaseModel):
     source_file: Optional[str] = None
+    source_hash: Optional[str] = None    # sha256 of the uploaded file
 
     supplier: Party = Field(default_factory=Party)
     recipient: Party = Field(default_factory=Party)
@@ -63,44 +59,21 @@ class Invoice(BaseModel):
     service_lines: List[ServiceLine] = Field(default_factory=list)
     totals: Totals = Field(default_factory=Totals)
 
-    extractor: str = "hybrid"            # "rule" | "ai" | "hybrid"
+    extractor: str = "hybrid"            # "rule" | "ai" | "hybrid" | "profile"
     extraction_confidence: float = 0.0   # 0..1
     validation_errors: List[str] = Field(default_factory=list)
     validation_warnings: List[str] = Field(default_factory=list)
     template_hint: Optional[str] = None
 
-    @validator("totals")
-    def _totals_currency_match(cls, v, values):
-        inv_cur = (values.get("currency") or "").upper()
-        if (v.currency or "").upper() != inv_cur:
-            raise ValueError("Totals.currency must match invoice currency")
-        return v
+    @model_validator(mode="after")
+    def _totals_currency_match(self):
+        # only when totals were given explicitly (defaults are never checked)
+        if "totals" in self.model_fields_set:
+            if (self.totals.currency or "").upper() != (self.currency or "").upper():
+                raise ValueError("Totals.currency must match invoice currency")
+        return self
 
 def run_basic_validation(model: Invoice) -> tuple[list[str], list[str]]:
-    errors: list[str] = []
-    warnings: list[str] = []
-
-    if not model.invoice_number:
-        warnings.append("Missing invoice_number")
-    if not model.supplier.name:
-        warnings.append("Missing supplier.name")
-    if not model.recipient.name:
-        warnings.append("Missing recipient.name")
-
-    subtotal = round(sum(round(sl.quantity * sl.unit_price, 2) for sl in model.service_lines), 2)
-    tax_total = round(sum(round(sl.tax_amount or 0.0, 2) for sl in model.service_lines), 2)
-    grand = round(subtotal + tax_total, 2)
-
-    if round(model.totals.subtotal, 2) != subtotal:
-        warnings.append(f"Subtotal mismatch: model={model.totals.subtotal} computed={subtotal}")
-    if round(model.totals.tax_total, 2) != tax_total:
-        warnings.append(f"Tax total mismatch: model={model.totals.tax_total} computed={tax_total}")
-    if round(model.totals.grand_total, 2) != grand:
-        errors.append(f"Grand total mismatch: model={model.totals.grand_total} computed={grand}")
-
-    # simple IBAN sanity
-    for pfx, party in (("supplier", model.supplier), ("recipient", model.recipient)):
-        if party.iban and len(party.iban.replace(" ", "")) < 12:
-            warnings.append(f"{pfx}.iban looks too short")
-
-    return errors, warnings
+    # same rules as the batch validator (decimal-safe cents), so single and batch results never diverge
+    from batch_validation import validate_invoice
+    return validate_invoice(model)
@@ -0,0 +1,160 @@
+# batch_validation.py
+"""
+Vectorised invoice arithmetic. All amounts are rounded to integer cents with
+decimal half-up semantics (1.005 -> 1.01, as on paper) and summed as integers,
+so a batch of thousands of invoices (imports, feedback-corpus revalidation)
+is validated in one NumPy pass without float drift between line, subtotal and
+grand-total rounding. A single parsed invoice goes through validate_invoice,
+the same arithmetic in plain Python — NumPy is only imported for batches.
+"""
+from __future__ import annotations
+
+import math
+from typing import TYPE_CHECKING, Any, Iterable
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def to_cents(x) -> np.ndarray:
+    """Decimal-safe rounding to cents: strips binary noise first, then rounds half away from zero."""
+    import numpy as np
+    a = np.round(np.asarray(x, dtype=np.float64) * 100.0, 6)
+    return (np.sign(a) * np.floor(np.abs(a) + 0.5)).astype(np.int64)
+
+
+def cents(x) -> int:
+    """to_cents for one value, with the same float operations (np.round(a, 6) is rint(a * 1e6) / 1e6)."""
+    a = round(float(x) * 100.0 * 1e6) / 1e6
+    return int(math.copysign(math.floor(abs(a) + 0.5), a))
+
+
+def _get(obj: Any, name: str, default=None):
+    if isinstance(obj, dict):
+        v = obj.get(name, default)
+        return default if v is None else v
+    v = getattr(obj, name, default)
+    return default if v is None else v
+
+
+def _line_values(sl: Any) -> tuple[float, float, float]:
+    q = float(_get(sl, "quantity", 1.0))
+    p = float(_get(sl, "unit_price", 0.0))
+    t = _get(sl, "tax_amount")
+    if t is None:
+        # כמו ServiceLine: מס מחושב מהשיעור אם לא נמסר
+        t = q * p * float(_get(sl, "tax_rate", 0.0)) / 100.0
+    return q, p, float(t)
+
+
+def _line_arrays(invoices: list) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    import numpy as np
+    counts, qty, price, tax = [], [], [], []
+    for inv in invoices:
+        lines = _get(inv, "service_lines", []) or []
+        counts.append(len(lines))
+        for sl in lines:
+            q, p, t = _line_values(sl)
+            qty.append(q)
+            price.append(p)
+            tax.append(t)
+    return (np.asarray(counts, dtype=np.int64), np.asarray(qty, dtype=np.float64),
+            np.asarray(price, dtype=np.float64), np.asarray(tax, dtype=np.float64))
+
+
+def _per_invoice_sum(cents: np.ndarray, inv_idx: np.ndarray, n: int) -> np.ndarray:
+    import numpy as np
+    # bincount על float64 מדויק לשלמים עד 2^53
+    return np.bincount(inv_idx, weights=cents, minlength=n).round().astype(np.int64)
+
+
+def compute_totals(invoices: Iterable[Any]) -> dict[str, np.ndarray]:
+    """Per-invoice subtotal / tax_total / grand_total in cents (int64 arrays)."""
+    import numpy as np
+    invoices = list(invoices)
+    n = len(invoices)
+    counts, qty, price, tax = _line_arrays(invoices)
+    inv_idx = np.repeat(np.arange(n), counts)
+    subtotal = _per_invoice_sum(to_cents(qty * price), inv_idx, n)
+    tax_total = _per_invoice_sum(to_cents(tax), inv_idx, n)
+    return {"subtotal": subtotal, "tax_total": tax_total, "grand_total": subtotal + tax_total}
+
+
+def _messages(inv: Any, declared: dict[str, float], computed: dict[str, int],
+              mismatch: dict[str, bool]) -> tuple[list[str], list[str]]:
+    errors: list[str] = []
+    warnings: list[str] = []
+    if not _get(inv, "invoice_number", ""):
+        warnings.append("Missing invoice_number")
+    if not _get(_get(inv, "supplier", {}), "name", ""):
+        warnings.append("Missing supplier.name")
+    if not _get(_get(inv, "recipient", {}), "name", ""):
+        warnings.append("Missing recipient.name")
+
+    if mismatch["subtotal"]:
+        warnings.append(f"Subtotal mismatch: model={declared['subtotal']} computed={computed['subtotal'] / 100}")
+    if mismatch["tax_total"]:
+        warnings.append(f"Tax total mismatch: model={declared['tax_total']} computed={computed['tax_total'] / 100}")
+    if mismatch["grand_total"]:
+        errors.append(f"Grand total mismatch: model={declared['grand_total']} computed={computed['grand_total'] / 100}")
+
+    # simple IBAN sanity
+    for pfx in ("supplier", "recipient"):
+        iban = _get(_get(inv, pfx, {}), "iban")
+        if iban and len(iban.replace(" ", "")) < 12:
+            warnings.append(f"{pfx}.iban looks too short")
+    return errors, warnings
+
+
+def _declared(inv: Any) -> dict[str, float]:
+    totals = _get(inv, "totals", {}) or {}
+    return {k: float(_get(totals, k, 0.0)) for k in ("subtotal", "tax_total", "grand_total")}
+
+
+def validate_invoice(inv: Any) -> tuple[list[str], list[str]]:
+    """
+    Same checks and messages as ai_schema.run_basic_validation, for one
+    invoice (Invoice model or schema-compatible dict): validate_batch([inv])[0]
+    without NumPy.
+    """
+    subtotal = tax_total = 0
+    for sl in _get(inv, "service_lines", []) or []:
+        q, p, t = _line_values(sl)
+        subtotal += cents(q * p)
+        tax_total += cents(t)
+    computed = {"subtotal": subtotal, "tax_total": tax_total, "grand_total": subtotal + tax_total}
+    declared = _declared(inv)
+    return _messages(inv, declared, computed, {k: cents(v) != computed[k] for k, v in declared.items()})
+
+
+def validate_batch(invoices: Iterable[Any]) -> list[tuple[list[str], list[str]]]:
+    """validate_invoice for many invoices at once; returns one (errors, warnings) pair per invoice."""
+    import numpy as np
+    invoices = list(invoices)
+    computed = compute_totals(invoices)
+    declared_rows = [_declared(inv) for inv in invoices]
+    declared = {k: np.asarray([d[k] for d in declared_rows], dtype=np.float64) for k in computed}
+    mismatch = {k: to_cents(declared[k]) != computed[k] for k in computed}
+    return [
+        _messages(inv, declared_rows[i], {k: int(computed[k][i]) for k in computed},
+                  {k: bool(mismatch[k][i]) for k in computed})
+        for i, inv in enumerate(invoices)
+    ]
+
+
+def bgn_amounts(line_totals: Iterable[float], exchange_rate: float, vat_percent: float) -> dict:
+    """
+    BGN amounts for one invoice: per-line BGN, base, VAT and total, each
+    rounded to cents once, with total == base + vat exactly.
+    """
+    import numpy as np
+    lines = np.asarray(list(line_totals), dtype=np.float64)
+    line_c = to_cents(lines * exchange_rate)
+    base_c = int(to_cents(lines.sum() * exchange_rate))
+    vat_c = int(to_cents(base_c / 100.0 * vat_percent / 100.0))
+    return {
+        "lines": (line_c / 100.0).tolist(),
+        "base": base_c / 100.0,
+        "vat": vat_c / 100.0,
+        "total": (base_c + vat_c) / 100.0,
+    }
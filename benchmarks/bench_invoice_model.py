@@ -0,0 +1,56 @@
+# benchmarks/bench_invoice_model.py
+"""
+Construction / serialisation cost of ai_schema.Invoice per invoice.
+
+    python benchmarks/bench_invoice_model.py [repeats]
+"""
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_schema import Invoice  # noqa: E402
+
+
+def make_payload(n_lines: int) -> dict:
+    return {
+        "source_file": "bench.pdf",
+        "supplier": {"name": "Alpha EOOD", "vat_id": "BG203504721", "iban": "BG43STSA93000022594884"},
+        "recipient": {"name": "Beta Ltd", "vat_id": "GB123456789"},
+        "invoice_number": "INV-2025-0001",
+        "issue_date": "2025-01-31",
+        "currency": "EUR",
+        "service_lines": [
+            {"description": f"Service {i}", "quantity": 1 + i % 3, "unit_price": 10.5 + i, "tax_rate": 20}
+            for i in range(n_lines)
+        ],
+        "totals": {"subtotal": 0.0, "tax_total": 0.0, "grand_total": 0.0, "currency": "EUR"},
+        "extractor": "ai",
+        "extraction_confidence": 0.8,
+    }
+
+
+def per_call_us(fn, repeats: int) -> float:
+    number = max(1, repeats)
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return best / number * 1e6
+
+
+def main(repeats: int = 200) -> None:
+    print(f"{'lines':>6} {'validate':>12} {'dump_json':>12} {'dump+json':>12} {'bytes':>8}")
+    for n in (1, 50, 500):
+        payload = make_payload(n)
+        model = Invoice.model_validate(payload)
+        reps = max(1, repeats // max(1, n // 10))
+        validate = per_call_us(lambda: Invoice.model_validate(payload), reps)
+        dump = per_call_us(model.model_dump_json, reps)
+        # the old path: dict dump + stdlib json (what a generic encoder does)
+        generic = per_call_us(lambda: json.dumps(model.model_dump(mode="json")), reps)
+        size = len(model.model_dump_json())
+        print(f"{n:>6} {validate:>10.1f}us {dump:>10.1f}us {generic:>10.1f}us {size:>8}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,92 @@
+# benchmarks/bench_ocr.py
+"""
+OCR time and accuracy: the old call (full colour page, `--psm 6`, default
+language) against ocr.py (binarise + crop + adaptive DPI, `bul+eng`), cold
+and from the page cache.
+
+    python benchmarks/bench_ocr.py [scan.pdf expected.txt]
+
+Without arguments a synthetic 300-dpi invoice page (Bulgarian + English) is
+rendered, so the expected text is known. Needs the tesseract binary with the
+bul and eng language packs (and poppler for a PDF argument).
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+LINES = [
+    "ФАКТУРА № 0000004250",
+    "Дата на издаване: 07.04.2025",
+    "Доставчик: Алфа ЕООД, ЕИК 203504721",
+    "Получател: Queste Ltd, VAT BG203743737",
+    "Описание            Кол.   Ед. цена     Сума",
+    "Транспортни услуги     2     150.00    300.00",
+    "Consulting services    1     250.50    250.50",
+    "Данъчна основа: 550.50 EUR",
+    "ДДС 20%: 110.10 EUR",
+    "Общо за плащане: 660.60 EUR",
+]
+
+
+def synthetic_page() -> tuple[Image.Image, str]:
+    # A4 @ 300 dpi, slightly off-white scan background, 12 pt text
+    img = Image.new("RGB", (2480, 3508), (246, 244, 236))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.truetype(FONT, 50) if os.path.exists(FONT) else ImageFont.load_default(size=50)
+    for i, line in enumerate(LINES):
+        draw.text((250, 300 + i * 90), line, fill=(30, 30, 40), font=font)
+    return img, "\n".join(LINES)
+
+
+def accuracy(got: str, expected: str) -> float:
+    norm = lambda s: " ".join(s.split())
+    return SequenceMatcher(None, norm(got), norm(expected)).ratio()
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t0) * 1000
+
+
+def main(argv: list[str]) -> None:
+    if not shutil.which("tesseract"):
+        print("tesseract binary not found — install tesseract-ocr (+ -bul, -eng) to run this benchmark")
+        return
+
+    import pytesseract
+    import shared_state
+
+    shared_state.STATE_DB = os.path.join(tempfile.mkdtemp(), "state.db")
+    import ocr
+
+    if len(argv) >= 2:
+        from pdf2image import convert_from_path
+        colour = convert_from_path(argv[0], dpi=300)
+        gray = convert_from_path(argv[0], dpi=ocr.OCR_DPI, grayscale=True)
+        with open(argv[1], encoding="utf-8") as f:
+            expected = f.read()
+    else:
+        page, expected = synthetic_page()
+        colour, gray = [page], [page.convert("L")]
+
+    old, t_old = timed(lambda: "\n".join(pytesseract.image_to_string(p, config="--psm 6") for p in colour))
+    new, t_new = timed(lambda: "\n".join(ocr.ocr_page(p) for p in gray))
+    _, t_hit = timed(lambda: "\n".join(ocr.ocr_page(p) for p in gray))
+
+    print(f"{'variant':<28} {'ms':>9} {'accuracy':>9}")
+    print(f"{'old (colour, psm 6)':<28} {t_old:>9.0f} {accuracy(old, expected):>9.3f}")
+    print(f"{'new (preprocessed, bul+eng)':<28} {t_new:>9.0f} {accuracy(new, expected):>9.3f}")
+    print(f"{'new, cached':<28} {t_hit:>9.1f} {'':>9}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
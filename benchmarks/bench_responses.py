@@ -0,0 +1,77 @@
+# benchmarks/bench_responses.py
+"""
+Serialisation time and bytes on the wire for typical and large API payloads:
+stdlib JSONResponse (what FastAPI used before) vs FastJSONResponse (orjson),
+the supplier preview via to_dict + encoder vs DataFrame.to_json, and the
+size after gzip / brotli at the middleware's settings.
+
+    python benchmarks/bench_responses.py [repeats]
+"""
+import os
+import sys
+import gzip
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from ai_schema import Invoice  # noqa: E402
+from benchmarks.bench_invoice_model import make_payload  # noqa: E402
+from responses import BROTLI_QUALITY, GZIP_LEVEL, FastJSONResponse, brotli, json_with_raw  # noqa: E402
+
+
+def suppliers_frame(n: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "SupplierCompanyID": [str(200000000 + i) for i in range(n)],
+        "SupplierName": [f"Доставчик {i} ЕООД" for i in range(n)],
+        "SupplierCompanyVAT": [f"BG{200000000 + i}" for i in range(n)],
+        "SupplierAddress": [f"ul. Vitosha {i % 150}, Sofia" for i in range(n)],
+        "IBAN": [f"BG43STSA9300{i:010d}" for i in range(n)],
+        "Last invoice number": pd.Series(range(n), dtype="int64"),
+    })
+
+
+def per_call_ms(fn, repeats: int) -> float:
+    number = max(1, repeats)
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1000
+
+
+def wire(body: bytes) -> str:
+    gz = len(gzip.compress(body, GZIP_LEVEL))
+    br = len(brotli.compress(body, quality=BROTLI_QUALITY)) if brotli else None
+    return f"{len(body):>9} {gz:>9} {br if br is not None else '-':>9}"
+
+
+def main(repeats: int = 50) -> None:
+    print(f"{'payload':<26} {'stdlib':>10} {'orjson':>10} {'raw B':>9} {'gzip B':>9} {'br B':>9}")
+
+    for name, n in (("invoice, 5 lines", 5), ("invoice, 500 lines", 500)):
+        content = Invoice.model_validate(make_payload(n)).model_dump(mode="json")
+        old = per_call_ms(lambda: JSONResponse(jsonable_encoder(content)), repeats)
+        new = per_call_ms(lambda: FastJSONResponse(content), repeats)
+        print(f"{name:<26} {old:>8.3f}ms {new:>8.3f}ms {wire(FastJSONResponse(content).body)}")
+
+    for name, n in (("suppliers/preview 200", 200), ("suppliers/preview 5000", 5000)):
+        df = suppliers_frame(n)
+        envelope = {"success": True, "version": "suppliers_v1.xlsx", "offset": 0, "limit": n,
+                    "columns": list(df.columns), "rows": n, "matched": n, "has_more": False}
+        # before: per-row dicts through FastAPI's encoder and json.dumps
+        old = per_call_ms(lambda: JSONResponse(jsonable_encoder({**envelope, "data": df.to_dict(orient="records")})),
+                          repeats)
+        new = per_call_ms(lambda: json_with_raw(envelope, "data",
+                                                df.to_json(orient="records", force_ascii=False).encode()), repeats)
+        body = json_with_raw(envelope, "data", df.to_json(orient="records", force_ascii=False).encode()).body
+        print(f"{name:<26} {old:>8.3f}ms {new:>8.3f}ms {wire(body)}")
+
+    # batch-sized response: a list of parsed invoices
+    batch = [Invoice.model_validate(make_payload(5)).model_dump(mode="json") for _ in range(200)]
+    old = per_call_ms(lambda: JSONResponse(jsonable_encoder({"items": batch})), max(1, repeats // 5))
+    new = per_call_ms(lambda: FastJSONResponse({"items": batch}), max(1, repeats // 5))
+    print(f"{'batch 200 invoices':<26} {old:>8.3f}ms {new:>8.3f}ms {wire(FastJSONResponse({'items': batch}).body)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
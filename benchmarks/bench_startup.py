@@ -0,0 +1,65 @@
+# benchmarks/bench_startup.py
+"""
+Cold-start cost of the API process: time to import main, time to the first
+/ping answer, which heavy libraries are loaded by then, and how long the
+background warm-up steps take afterwards.
+
+    python benchmarks/bench_startup.py [runs]
+
+Every run is a fresh interpreter (like a new container / worker).
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("pandas", "numpy", "openpyxl", "docxtpl", "PyPDF2", "googleapiclient", "pytesseract", "pdf2image", "requests")
+
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import main
+t_import = time.perf_counter() - t0
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+client.get("/ping")
+t_ping = time.perf_counter() - t0
+loaded = [m for m in HEAVY if m in sys.modules]
+import warmup
+steps = warmup.run()
+print(json.dumps({"import": t_import, "ping": t_ping, "loaded": loaded,
+                  "warmup": {k: v["ms"] for k, v in steps.items()}}))
+"""
+
+
+def one_run(env: dict) -> dict:
+    code = f"HEAVY = {HEAVY!r}\n" + PROBE
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(runs: int = 5) -> None:
+    tmp = tempfile.mkdtemp()
+    env = {**os.environ, "STATE_DB": os.path.join(tmp, "state.db"), "SUPPLIERS_DIR": os.path.join(tmp, "suppliers"),
+           "FEEDBACK_DIR": os.path.join(tmp, "feedback"), "ARCHIVE_DIR": os.path.join(tmp, "invoices"),
+           "RECIPIENT_DB": os.path.join(tmp, "recipients.db"), "WARMUP_ON_START": "0"}
+    try:
+        results = [one_run(env) for _ in range(runs)]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    med = lambda key: statistics.median(r[key] for r in results) * 1000
+    print(f"runs: {runs}")
+    print(f"import main        {med('import'):8.0f} ms (median)")
+    print(f"first /ping        {med('ping'):8.0f} ms (median, incl. import)")
+    print(f"heavy libs loaded  {', '.join(results[-1]['loaded']) or '-'}")
+    for step, ms in results[-1]["warmup"].items():
+        print(f"warm-up {step:<10} {ms:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
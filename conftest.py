@@ -0,0 +1,11 @@
+import pytest
+
+import shared_state
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    """Shared SQLite state (cache, counters, idempotency, breakers) in tmp_path; returns its path."""
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(shared_state, "STATE_DB", path)
+    return path
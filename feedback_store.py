@@ -0,0 +1,268 @@
+# feedback_store.py
+"""
+Append-only store for /ai/feedback corrections, indexed by supplier VAT,
+source file hash and issue date. Replaces one pretty-printed JSON file per
+correction; legacy files in FEEDBACK_DIR are imported once on first use.
+Also keeps the extracted text of parsed files (by hash) and the supplier
+profiles learned from both (see supplier_profiles.py).
+"""
+import os
+import re
+import json
+import glob
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, Optional
+
+from shared_state import STATE_PURGE_SEC, connect, transaction
+
+FEEDBACK_DIR = os.getenv("FEEDBACK_DIR", "/app/data/feedback")
+FEEDBACK_DB = os.getenv("FEEDBACK_DB", os.path.join(FEEDBACK_DIR, "feedback.db"))
+# טקסטים של קבצים שאף תיקון לא מפנה אליהם נמחקים אחרי N ימים
+SOURCES_TTL_DAYS = float(os.getenv("SOURCES_TTL_DAYS", "30"))
+os.makedirs(os.path.dirname(os.path.abspath(FEEDBACK_DB)), exist_ok=True)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    created      TEXT NOT NULL,          -- UTC, ISO 8601
+    supplier_vat TEXT,
+    source_hash  TEXT,
+    source_file  TEXT,
+    issue_date   TEXT,                   -- YYYY-MM-DD
+    invalid      INTEGER NOT NULL DEFAULT 0,
+    payload      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_feedback_supplier ON feedback (supplier_vat, created);
+CREATE INDEX IF NOT EXISTS ix_feedback_source ON feedback (source_hash);
+CREATE INDEX IF NOT EXISTS ix_feedback_issue_date ON feedback (issue_date);
+CREATE TABLE IF NOT EXISTS sources (
+    source_hash TEXT PRIMARY KEY,        -- sha256 of the uploaded file
+    text        TEXT NOT NULL,           -- extracted text, as seen by /ai/parse
+    created     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_sources_created ON sources (created);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    supplier_vat TEXT PRIMARY KEY,
+    keys         TEXT NOT NULL,          -- JSON list of identifiers matched in the text (VAT, IBAN)
+    profile      TEXT NOT NULL,
+    samples      INTEGER NOT NULL,
+    updated      TEXT NOT NULL
+);
+"""
+
+_migrated = False
+_last_purge = 0.0
+
+
+def normalize_vat(vat: Optional[str]) -> Optional[str]:
+    return re.sub(r"[\s\-.]", "", vat).upper() if vat else None
+
+
+def _db():
+    global _migrated
+    conn = connect(FEEDBACK_DB, _SCHEMA)
+    if not _migrated:
+        # the marker row and the imported rows commit together, so the import
+        # runs once per database no matter how many workers start at the same time
+        with transaction(conn):
+            if conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('legacy_import', ?)",
+                (datetime.utcnow().isoformat(timespec="seconds"),),
+            ).rowcount and conn.execute("SELECT 1 FROM feedback LIMIT 1").fetchone() is None:
+                _import_legacy_files(conn)
+        _migrated = True
+    return conn
+
+
+def _row_values(payload: Dict[str, Any], created: str) -> tuple:
+    supplier = payload.get("supplier") or {}
+    return (
+        created,
+        normalize_vat(supplier.get("vat_id")),
+        payload.get("source_hash"),
+        payload.get("source_file"),
+        str(payload.get("issue_date") or "")[:10] or None,
+        1 if (payload.get("_meta") or {}).get("_invalid_schema") else 0,
+        json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+    )
+
+
+_INSERT = (
+    "INSERT INTO feedback (created, supplier_vat, source_hash, source_file, issue_date, invalid, payload) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _import_legacy_files(conn) -> int:
+    rows = []
+    for path in sorted(glob.glob(os.path.join(FEEDBACK_DIR, "*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # שם הקובץ הישן: <YYYYmmdd-HHMMSS>__<source>.json
+        stamp = os.path.basename(path).split("__", 1)[0]
+        try:
+            created = datetime.strptime(stamp, "%Y%m%d-%H%M%S").isoformat()
+        except ValueError:
+            created = datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat()
+        rows.append(_row_values(payload, created))
+    if rows:
+        conn.executemany(_INSERT, rows)
+    return len(rows)
+
+
+def add_feedback(payload: Dict[str, Any]) -> int:
+    created = datetime.utcnow().isoformat(timespec="seconds")
+    cur = _db().execute(_INSERT, _row_values(payload, created))
+    return cur.lastrowid
+
+
+def _where(supplier_vat, source_hash, date_from, date_to) -> tuple[str, list]:
+    clauses, args = [], []
+    if supplier_vat:
+        clauses.append("supplier_vat = ?")
+        args.append(normalize_vat(supplier_vat))
+    if source_hash:
+        clauses.append("source_hash = ?")
+        args.append(source_hash)
+    if date_from:
+        clauses.append("issue_date >= ?")
+        args.append(str(date_from))
+    if date_to:
+        clauses.append("issue_date <= ?")
+        args.append(str(date_to))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+
+def query_feedback(supplier_vat: Optional[str] = None, source_hash: Optional[str] = None,
+                   date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   limit: int = 50, offset: int = 0) -> list[Dict[str, Any]]:
+    """Newest first."""
+    where, args = _where(supplier_vat, source_hash, date_from, date_to)
+    rows = _db().execute(
+        "SELECT id, created, supplier_vat, source_hash, source_file, issue_date, invalid, payload "
+        f"FROM feedback{where} ORDER BY id DESC LIMIT ? OFFSET ?",
+        (*args, limit, offset),
+    ).fetchall()
+    return [
+        {"id": r[0], "created": r[1], "supplier_vat": r[2], "source_hash": r[3], "source_file": r[4],
+         "issue_date": r[5], "invalid": bool(r[6]), "payload": json.loads(r[7])}
+        for r in rows
+    ]
+
+
+def iter_export(supplier_vat: Optional[str] = None, source_hash: Optional[str] = None,
+                date_from: Optional[str] = None, date_to: Optional[str] = None) -> Iterator[str]:
+    """JSON Lines, oldest first, streamed straight from the cursor (payloads are stored compact)."""
+    where, args = _where(supplier_vat, source_hash, date_from, date_to)
+    _db()
+    # חיבור ייעודי: ה-generator ממשיך לרוץ מ-threads שונים של ה-threadpool
+    conn = sqlite3.connect(FEEDBACK_DB, check_same_thread=False)
+    try:
+        for fid, created, payload in conn.execute(f"SELECT id, created, payload FROM feedback{where} ORDER BY id", args):
+            yield f'{{"id":{fid},"created":"{created}","payload":{payload}}}\n'
+    finally:
+        conn.close()
+
+
+def revalidate(limit: int = 100, chunk: int = 2000) -> Dict[str, Any]:
+    """
+    Re-runs the invoice arithmetic checks over every schema-valid correction,
+    `chunk` payloads per vectorised validate_batch call. Returns the counts and
+    the first `limit` corrections that now have errors.
+    """
+    from batch_validation import validate_batch
+    conn = _db()
+    checked = with_warnings = with_errors = 0
+    failing: list[Dict[str, Any]] = []
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, payload FROM feedback WHERE invalid = 0 AND id > ? ORDER BY id LIMIT ?", (last_id, chunk)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for (fid, _), (errors, warnings) in zip(rows, validate_batch(json.loads(p) for _, p in rows)):
+            checked += 1
+            with_warnings += bool(warnings)
+            if errors:
+                with_errors += 1
+                if len(failing) < limit:
+                    failing.append({"id": fid, "errors": errors, "warnings": warnings})
+    return {"checked": checked, "with_errors": with_errors, "with_warnings": with_warnings, "failing": failing}
+
+
+# ---------------------------
+# Source texts & supplier profiles
+# ---------------------------
+MAX_SOURCE_CHARS = 50000
+
+
+def save_source(source_hash: str, text: str) -> None:
+    _db().execute(
+        "INSERT OR IGNORE INTO sources (source_hash, text, created) VALUES (?, ?, ?)",
+        (source_hash, text[:MAX_SOURCE_CHARS], datetime.utcnow().isoformat(timespec="seconds")),
+    )
+    maybe_purge_sources()
+
+
+def purge_sources(now: Optional[datetime] = None) -> int:
+    """Deletes source texts older than SOURCES_TTL_DAYS that no correction points at; returns how many."""
+    cutoff = ((now or datetime.utcnow()) - timedelta(days=SOURCES_TTL_DAYS)).isoformat(timespec="seconds")
+    return _db().execute(
+        "DELETE FROM sources WHERE created < ? "
+        "AND NOT EXISTS (SELECT 1 FROM feedback f WHERE f.source_hash = sources.source_hash)",
+        (cutoff,),
+    ).rowcount
+
+
+def maybe_purge_sources() -> None:
+    """purge_sources at most every STATE_PURGE_SEC per worker (called from save_source)."""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge >= STATE_PURGE_SEC:
+        _last_purge = now
+        purge_sources()
+
+
+def training_samples(supplier_vat: str, limit: int = 20) -> list[tuple[Dict[str, Any], str]]:
+    """Newest valid corrections of one supplier whose source text is known, as (payload, text)."""
+    rows = _db().execute(
+        "SELECT f.payload, s.text FROM feedback f JOIN sources s ON s.source_hash = f.source_hash "
+        "WHERE f.supplier_vat = ? AND f.invalid = 0 ORDER BY f.id DESC LIMIT ?",
+        (normalize_vat(supplier_vat), limit),
+    ).fetchall()
+    return [(json.loads(p), t) for p, t in rows]
+
+
+def save_profile(supplier_vat: str, keys: list[str], profile: Dict[str, Any], samples: int) -> None:
+    _db().execute(
+        "INSERT OR REPLACE INTO profiles (supplier_vat, keys, profile, samples, updated) VALUES (?, ?, ?, ?, ?)",
+        (normalize_vat(supplier_vat), json.dumps(keys), json.dumps(profile, ensure_ascii=False), samples,
+         datetime.utcnow().isoformat(timespec="microseconds")),
+    )
+
+
+def delete_profile(supplier_vat: str) -> None:
+    _db().execute("DELETE FROM profiles WHERE supplier_vat = ?", (normalize_vat(supplier_vat),))
+
+
+def profiles_signature() -> tuple:
+    return tuple(_db().execute("SELECT count(*), max(updated) FROM profiles").fetchone())
+
+
+def load_profiles() -> list[Dict[str, Any]]:
+    rows = _db().execute("SELECT supplier_vat, keys, profile, samples, updated FROM profiles").fetchall()
+    return [
+        {"supplier_vat": r[0], "keys": json.loads(r[1]), "profile": json.loads(r[2]), "samples": r[3], "updated": r[4]}
+        for r in rows
+    ]
@@ -0,0 +1,174 @@
+# idempotency.py
+import os
+import json
+import time
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Optional
+
+import shared_state
+from pipeline import to_thread
+from shared_state import connect, transaction
+
+# כמה זמן תוצאה שהושלמה נשמרת לשליחה חוזרת
+IDEMPOTENCY_TTL_SEC = int(os.getenv("IDEMPOTENCY_TTL_SEC", str(24 * 3600)))
+# רשומת 'running' ישנה מזה נחשבת נטושה (worker שקרס)
+IDEMPOTENCY_STALE_SEC = int(os.getenv("IDEMPOTENCY_STALE_SEC", "600"))
+# כמה זמן בקשה כפולה מחכה ל-worker אחר שמריץ את אותו מפתח
+IDEMPOTENCY_WAIT_SEC = float(os.getenv("IDEMPOTENCY_WAIT_SEC", "120"))
+POLL_SEC = 0.5
+
+Result = tuple[int, dict]
+
+_inflight: dict[str, tuple[str, asyncio.Future]] = {}    # key -> (fingerprint, future)
+# the key whose fn() is running — seen by its stage threads (reserve_number)
+_current_key: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("idempotency_key", default=None)
+
+
+class IdempotencyConflict(Exception):
+    """Same key, different request — or still running elsewhere after the wait budget."""
+
+
+def purge_expired(now: Optional[float] = None) -> int:
+    """Deletes finished / failed records past IDEMPOTENCY_TTL_SEC and abandoned 'running' ones; returns how many."""
+    now = now or time.time()
+    return connect().execute(
+        "DELETE FROM idempotency WHERE (status IN ('done', 'failed') AND updated < ?) "
+        "OR (status = 'running' AND updated < ?)",
+        (now - IDEMPOTENCY_TTL_SEC, now - IDEMPOTENCY_STALE_SEC),
+    ).rowcount
+
+
+_last_purge = 0.0
+
+
+def _maybe_purge() -> None:
+    global _last_purge
+    now = time.time()
+    if now - _last_purge >= shared_state.STATE_PURGE_SEC:
+        _last_purge = now
+        purge_expired(now)
+
+
+def _claim(key: str, fingerprint: str) -> tuple[str, Optional[Result]]:
+    """Returns ('claimed', None), ('done', result) or ('running', None)."""
+    now = time.time()
+    with transaction(connect()) as conn:
+        row = conn.execute(
+            "SELECT fingerprint, status, http_status, body, updated FROM idempotency WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            fp, status, http_status, body, updated = row
+            expired = (status == "done" and now - updated > IDEMPOTENCY_TTL_SEC) or \
+                      (status == "running" and now - updated > IDEMPOTENCY_STALE_SEC)
+            if not expired and status != "failed":
+                if fp != fingerprint:
+                    raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+                if status == "done":
+                    return "done", (http_status, json.loads(body))
+                return "running", None
+            if fp == fingerprint and status != "done":
+                # retry of a failed / abandoned attempt: keeps the invoice number it reserved
+                conn.execute("UPDATE idempotency SET status = 'running', updated = ? WHERE key = ?", (now, key))
+                return "claimed", None
+        conn.execute(
+            "INSERT OR REPLACE INTO idempotency (key, fingerprint, status, http_status, body, updated, reserved) "
+            "VALUES (?, ?, 'running', NULL, NULL, ?, NULL)",
+            (key, fingerprint, now),
+        )
+    return "claimed", None
+
+
+def _finish(key: str, result: Result) -> None:
+    status, body = result
+    _maybe_purge()
+    if status < 400:
+        connect().execute(
+            "UPDATE idempotency SET status = 'done', http_status = ?, body = ?, updated = ? WHERE key = ?",
+            (status, json.dumps(body, ensure_ascii=False), time.time(), key),
+        )
+    else:
+        _fail(key)
+
+
+def _fail(key: str) -> None:
+    """
+    A failure is not replayed — a retry runs again. The record is only kept
+    (as 'failed') when the attempt reserved an invoice number, so the retry
+    reuses it instead of leaving a gap in the numbering.
+    """
+    conn = connect()
+    conn.execute("DELETE FROM idempotency WHERE key = ? AND reserved IS NULL", (key,))
+    conn.execute("UPDATE idempotency SET status = 'failed', updated = ? WHERE key = ?", (time.time(), key))
+
+
+def reserve_number(allocate: Callable[[], int]) -> int:
+    """
+    The invoice number for the running idempotent request: the one an earlier
+    failed attempt with this key already allocated, else allocate() (stored
+    with the key). Without an idempotency key, just allocate().
+    """
+    key = _current_key.get()
+    if key is None:
+        return allocate()
+    conn = connect()
+    row = conn.execute("SELECT reserved FROM idempotency WHERE key = ?", (key,)).fetchone()
+    if row is not None and row[0] is not None:
+        return row[0]
+    number = allocate()
+    conn.execute("UPDATE idempotency SET reserved = ? WHERE key = ?", (number, key))
+    return number
+
+
+def unreserve_number() -> None:
+    """The reserved number went back to the counter (release_counter) — a retry must allocate again."""
+    key = _current_key.get()
+    if key is not None:
+        connect().execute("UPDATE idempotency SET reserved = NULL WHERE key = ?", (key,))
+
+
+async def run_once(key: str, fingerprint: str, fn: Callable[[], Awaitable[Result]]) -> tuple[Result, bool]:
+    """
+    Runs `fn` at most once per key across all workers. Concurrent duplicates
+    in this process await the same future; duplicates in other workers poll the
+    shared record. Returns (result, replayed). The shared-state calls run in
+    the thread pool: BEGIN IMMEDIATE may wait up to 30 s for another worker.
+    """
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        running_fp, fut = inflight
+        if running_fp != fingerprint:
+            raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+        return await asyncio.shield(fut), True
+
+    # registered before the first await, so duplicates in this process always find it
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = (fingerprint, fut)
+    claimed = False
+    token = _current_key.set(key)
+    try:
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SEC
+        while not claimed:
+            state, stored = await to_thread(_claim, key, fingerprint)
+            if state == "done":
+                fut.set_result(stored)
+                return stored, True
+            claimed = state == "claimed"
+            if not claimed:
+                if time.monotonic() > deadline:
+                    raise IdempotencyConflict("A request with this Idempotency-Key is still in progress")
+                await asyncio.sleep(POLL_SEC)
+        result = await fn()
+        await to_thread(_finish, key, result)
+    except BaseException as e:
+        if claimed:
+            _fail(key)      # inline: the task may be cancelled, this must not be skipped
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved; waiters re-raise it themselves
+        raise
+    else:
+        fut.set_result(result)
+        return result, False
+    finally:
+        _current_key.reset(token)
+        _inflight.pop(key, None)
@@ -0,0 +1,162 @@
+# invoice_store.py
+"""
+Local archive of generated invoices. The DOCX/PDF files are stored once by
+content hash (ARCHIVE_DIR/blobs/ab/abcd...), and every generated invoice gets
+a row in an indexed register (number, supplier, recipient, date, BGN totals,
+FX rate), so listing and re-downloading never go to Google Drive.
+"""
+import os
+import hashlib
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from shared_state import connect
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/app/data/invoices")
+INVOICE_DB = os.getenv("INVOICE_DB", os.path.join(ARCHIVE_DIR, "invoices.db"))
+os.makedirs(os.path.dirname(os.path.abspath(INVOICE_DB)), exist_ok=True)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    supplier_id     TEXT NOT NULL,       -- SupplierCompanyID (numbers are counted per supplier)
+    number          TEXT NOT NULL,
+    created         TEXT NOT NULL,       -- UTC, ISO 8601
+    issue_date      TEXT,                -- YYYY-MM-DD
+    supplier_name   TEXT,
+    supplier_vat    TEXT,
+    recipient_name  TEXT,
+    recipient_id    TEXT,
+    recipient_vat   TEXT,
+    currency        TEXT,
+    amount          REAL,                -- original currency, without VAT
+    exchange_rate   REAL,
+    base_bgn        REAL,
+    vat_bgn         REAL,
+    total_bgn       REAL,
+    source_file     TEXT,
+    docx_sha        TEXT,
+    pdf_sha         TEXT,
+    docx_link       TEXT,
+    pdf_link        TEXT,
+    PRIMARY KEY (supplier_id, number)
+);
+CREATE INDEX IF NOT EXISTS ix_invoices_number ON invoices (number);
+CREATE INDEX IF NOT EXISTS ix_invoices_issue_date ON invoices (issue_date);
+CREATE INDEX IF NOT EXISTS ix_invoices_supplier_date ON invoices (supplier_id, issue_date);
+CREATE INDEX IF NOT EXISTS ix_invoices_recipient ON invoices (recipient_vat);
+"""
+
+COLUMNS = ("supplier_id", "number", "created", "issue_date", "supplier_name", "supplier_vat",
+           "recipient_name", "recipient_id", "recipient_vat", "currency", "amount", "exchange_rate",
+           "base_bgn", "vat_bgn", "total_bgn", "source_file", "docx_sha", "pdf_sha", "docx_link", "pdf_link")
+# עמודות שמותר לעדכן אחרי הרישום (קישורי Drive וה-PDF מגיעים אחרי הרינדור)
+UPDATABLE = ("pdf_sha", "docx_link", "pdf_link")
+
+
+def _db():
+    return connect(INVOICE_DB, _SCHEMA)
+
+
+# ---------------------------
+# Content-addressed files
+# ---------------------------
+def blob_path(sha: str) -> str:
+    return os.path.join(ARCHIVE_DIR, "blobs", sha[:2], sha)
+
+
+def save_blob(data: bytes) -> str:
+    """Stores the bytes once (identical files share one blob) and returns their sha256."""
+    sha = hashlib.sha256(data).hexdigest()
+    path = blob_path(sha)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # כתיבה לקובץ זמני באותה תיקייה ו-rename: קורא מקביל לא רואה קובץ חלקי
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return sha
+
+
+# ---------------------------
+# Register
+# ---------------------------
+def record_invoice(row: Dict[str, Any]) -> None:
+    values = {c: row.get(c) for c in COLUMNS}
+    values["created"] = values["created"] or datetime.utcnow().isoformat(timespec="seconds")
+    _db().execute(
+        f"INSERT OR REPLACE INTO invoices ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+        tuple(values.values()),
+    )
+
+
+def update_invoice(supplier_id: str, number: str, **fields) -> None:
+    unknown = set(fields) - set(UPDATABLE)
+    if unknown:
+        raise ValueError(f"Cannot update {sorted(unknown)}")
+    if fields:
+        _db().execute(
+            f"UPDATE invoices SET {', '.join(f'{k} = ?' for k in fields)} WHERE supplier_id = ? AND number = ?",
+            (*fields.values(), str(supplier_id), number),
+        )
+
+
+def _where(supplier: Optional[str], recipient: Optional[str], date_from, date_to) -> tuple[str, list]:
+    clauses, args = [], []
+    if supplier:
+        clauses.append("(supplier_id = ? OR supplier_vat = ?)")
+        args += [supplier, supplier]
+    if recipient:
+        clauses.append("(recipient_vat = ? OR recipient_id = ?)")
+        args += [recipient, recipient]
+    if date_from:
+        clauses.append("issue_date >= ?")
+        args.append(str(date_from))
+    if date_to:
+        clauses.append("issue_date <= ?")
+        args.append(str(date_to))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+
+def query_invoices(supplier: Optional[str] = None, recipient: Optional[str] = None,
+                   date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+    """One page, newest issue date first, plus the total number of matches."""
+    where, args = _where(supplier, recipient, date_from, date_to)
+    conn = _db()
+    total = conn.execute(f"SELECT count(*) FROM invoices{where}", args).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM invoices{where} "
+        "ORDER BY issue_date DESC, created DESC LIMIT ? OFFSET ?",
+        (*args, limit, offset),
+    ).fetchall()
+    return {"total": total, "items": [dict(zip(COLUMNS, r)) for r in rows]}
+
+
+def find_invoices(number: str, supplier: Optional[str] = None) -> list[Dict[str, Any]]:
+    """All register rows with this number (the same number can exist for several suppliers)."""
+    sql, args = f"SELECT {', '.join(COLUMNS)} FROM invoices WHERE number = ?", [number]
+    if supplier:
+        sql += " AND (supplier_id = ? OR supplier_vat = ?)"
+        args += [supplier, supplier]
+    return [dict(zip(COLUMNS, r)) for r in _db().execute(sql, args).fetchall()]
+
+
+def iter_register(columns: tuple[str, ...], date_from: Optional[str] = None, date_to: Optional[str] = None,
+                  supplier: Optional[str] = None) -> Iterator[tuple]:
+    """Rows in register order (date, supplier, number), streamed from the cursor — nothing is buffered."""
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns {sorted(unknown)}")
+    where, args = _where(supplier, None, date_from, date_to)
+    _db()
+    # חיבור ייעודי: ה-generator ממשיך לרוץ מ-threads שונים של ה-threadpool
+    conn = sqlite3.connect(INVOICE_DB, check_same_thread=False)
+    try:
+        yield from conn.execute(
+            f"SELECT {', '.join(columns)} FROM invoices{where} ORDER BY issue_date, supplier_id, number", args
+        )
+    finally:
+        conn.close()
@@ -0,0 +1,51 @@
+# invoices_api.py
+import os
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse
+
+import invoice_store
+
+router = APIRouter(prefix="/invoices", tags=["Invoices"])
+
+MEDIA_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf": "application/pdf",
+}
+
+
+def _normalize_number(number: str) -> str:
+    # "3958" ו-"0000003958" הם אותה חשבונית
+    return number.zfill(10) if number.isdigit() else number
+
+
+@router.get("")
+def list_invoices(
+    supplier: Optional[str] = Query(None, description="SupplierCompanyID or VAT"),
+    recipient: Optional[str] = Query(None, description="Recipient VAT or company ID"),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    page = invoice_store.query_invoices(supplier, recipient, date_from, date_to, limit, offset)
+    return {"success": True, "offset": offset, "limit": limit, **page}
+
+
+@router.get("/{number}/download")
+def download_invoice(number: str, format: str = Query("docx", pattern="^(docx|pdf)$"),
+                     supplier: Optional[str] = None):
+    matches = invoice_store.find_invoices(_normalize_number(number), supplier)
+    if not matches:
+        raise HTTPException(404, f"Invoice {number} not found")
+    if len(matches) > 1:
+        raise HTTPException(409, f"Invoice number {number} exists for several suppliers — pass ?supplier=")
+    inv = matches[0]
+    sha = inv[f"{format}_sha"]
+    path = invoice_store.blob_path(sha) if sha else None
+    if not path or not os.path.exists(path):
+        raise HTTPException(404, f"No archived {format.upper()} for invoice {number}")
+    # FileResponse שולח מהדיסק ב-chunks (sendfile כשהשרת תומך) בלי לטעון לזיכרון
+    return FileResponse(path, media_type=MEDIA_TYPES[format],
+                        filename=f"bulgarian_invoice_{inv['number']}.{format}")
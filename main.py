@@ -1,15 +1,32 @@
 # main.py
 import os
 import uuid
-from fastapi import FastAPI, UploadFile, Form, Request, HTTPException
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, UploadFile, Form, Request, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 
 from process import process_invoice_upload
+import admission
+import metrics
+import pipeline
+import profiling
+from responses import CompressionMiddleware, FastJSONResponse
+import warmup
 from suppliers_api import router as suppliers_router
 from ai_endpoint import router as ai_router
+from invoices_api import router as invoices_router
+from reports_api import router as reports_router
+from admin_api import router as admin_router
 
-app = FastAPI(title="BulTrans API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # חימום ברקע: השרת כבר מקבל בקשות, הספריות/ספקים/טמפלטים נטענים במקביל
+    if warmup.WARMUP_ON_START:
+        warmup.start_background()
+    yield
+
+app = FastAPI(title="BulTrans API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # --- CORS (ENV or defaults to Base44 + localhost) ---
 origins_env = os.getenv(
@@ -29,14 +46,23 @@ app.add_middleware(
 @app.middleware("http")
 async def add_request_id(request: Request, call_next):
     request.state.request_id = str(uuid.uuid4())
-    response = await call_next(request)
+    # פרופיל לבקשה: X-Profile + X-Admin-Token, או דגימה לפי PROFILE_SAMPLE_RATE
+    if profiling.should_profile(request.url.path, request.headers.get("X-Profile"), request.headers.get("X-Admin-Token")):
+        with profiling.profiled(request.state.request_id, request.url.path):
+            response = await call_next(request)
+        response.headers["X-Profile-Id"] = request.state.request_id
+    else:
+        response = await call_next(request)
     response.headers["X-Request-ID"] = request.state.request_id
     return response
 
+# --- compression (gzip / br) — added last so it wraps everything above ---
+app.add_middleware(CompressionMiddleware)
+
 # --- error handlers ---
 @app.exception_handler(HTTPException)
 async def http_exc_handler(request: Request, exc: HTTPException):
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=exc.status_code,
         content={
             "success": False,
@@ -49,7 +75,7 @@ async def http_exc_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def unhandled_exc_handler(request: Request, exc: Exception):
     debug = os.getenv("DEBUG", "0") == "1"
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content={
             "success": False,
@@ -63,15 +89,48 @@ async def unhandled_exc_handler(request: Request, exc: Exception):
 # --- routers ---
 app.include_router(suppliers_router)
 app.include_router(ai_router)
+app.include_router(invoices_router)
+app.include_router(reports_router)
+app.include_router(admin_router)
 
 # --- existing endpoints ---
 @app.get("/ping")
 async def ping():
     return {"success": True, "message": "API is alive!"}
 
+@app.get("/metrics")
+def get_metrics():
+    # counters of all workers (shared state DB); breakers are per worker
+    import resilience
+    return {"success": True, "metrics": metrics.snapshot(), "breakers": resilience.snapshot(),
+            "admission": admission.scheduler().snapshot()}
+
 @app.post("/process-invoice/")
-async def process_invoice(supplier_id: str = Form(...), file: UploadFile = Form(...)):
-    return await process_invoice_upload(supplier_id, file)
+async def process_invoice(
+    request: Request,
+    supplier_id: str = Form(...),
+    file: UploadFile = Form(...),
+    dry_run: bool = Form(False),
+    include_docx: bool = Form(False),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    # dry_run=true: תצוגה מקדימה (הקשר מלא + סכומים) בלי מספר חשבונית, בלי PDF ובלי Drive
+    client = admission.client_id(request.headers, request.client.host if request.client else None)
+    return await process_invoice_upload(supplier_id, file, idempotency_key=idempotency_key,
+                                        dry_run=dry_run, include_docx=include_docx, client=client)
+
+@app.get("/ready")
+async def ready(warm: bool = False):
+    """
+    Readiness for the load balancer: 200 only when every configured subsystem
+    is warm (see warmup.report), 503 otherwise. ?warm=true starts a
+    background warm-up of whatever isn't ready yet.
+    """
+    # the invoice backlog: requests queued for an admission slot + stage calls waiting for a thread
+    report = warmup.report(executor={**pipeline.executor_stats(), "queued": admission.scheduler().queued()})
+    if warm and not report["ready"]:
+        report["warming"] = warmup.start_background(warmup.not_ready_steps(report)) or warmup.running()
+    return FastJSONResponse({"success": report["ready"], **report}, status_code=200 if report["ready"] else 503)
 
 @app.get("/")
 def root():
@@ -0,0 +1,30 @@
+# metrics.py
+"""
+Process-wide counters kept in the shared state DB (counters table, "metric:"
+prefix), so /metrics reports the totals of all workers, not just the one
+that happens to answer.
+"""
+from shared_state import connect
+
+PREFIX = "metric:"
+
+
+def incr(name: str, n: int = 1) -> None:
+    connect().execute(
+        "INSERT INTO counters (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (PREFIX + name, int(n)),
+    )
+
+
+def snapshot() -> dict:
+    """All counters, plus `<x>_hit_rate` for every `<x>_hit` / `<x>_miss` pair."""
+    rows = connect().execute(
+        "SELECT name, value FROM counters WHERE name LIKE ? ORDER BY name", (PREFIX + "%",)
+    ).fetchall()
+    out = {name[len(PREFIX):]: value for name, value in rows}
+    bases = {k.rsplit("_", 1)[0] for k in out if k.endswith(("_hit", "_miss"))}
+    for base in sorted(bases):
+        hits, total = out.get(base + "_hit", 0), out.get(base + "_hit", 0) + out.get(base + "_miss", 0)
+        out[base + "_hit_rate"] = round(hits / total, 4) if total else None
+    return out
@@ -0,0 +1,105 @@
+# ocr.py
+"""
+OCR stage for scanned PDFs.
+
+Pages are rendered in grayscale, binarised (Otsu), cropped to the inked area
+and, when the text is much larger than tesseract needs, downsampled to an
+adaptive resolution before being passed to tesseract with an explicit
+language set. Results are cached in the shared state DB by the hash of the
+rendered page, so re-uploads and retries skip tesseract entirely.
+"""
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pytesseract
+from pdf2image import convert_from_bytes, convert_from_path
+from PIL import Image
+
+from shared_state import cache_get, cache_set
+
+OCR_LANG = os.getenv("OCR_LANG", "bul+eng")
+OCR_PSM = os.getenv("OCR_PSM", "6")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_ADAPTIVE_DPI = os.getenv("OCR_ADAPTIVE_DPI", "1") == "1"
+# גובה שורה (בפיקסלים) שמספיק ל-tesseract; מעל פי 1.5 ממנו מקטינים
+OCR_TARGET_LINE_PX = int(os.getenv("OCR_TARGET_LINE_PX", "40"))
+OCR_MIN_SCALE = 0.5
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL_SEC", str(30 * 24 * 3600)))
+CROP_MARGIN_PX = 20
+PIPELINE_VERSION = "1"      # part of the cache key: bump when preprocessing changes
+
+if OCR_WORKERS > 1:
+    # several tesseract processes side by side: one core each instead of oversubscribing
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def _otsu_threshold(a: np.ndarray) -> int:
+    hist = np.bincount(a.ravel(), minlength=256).astype(np.float64)
+    w0 = np.cumsum(hist)
+    w1 = a.size - w0
+    s0 = np.cumsum(hist * np.arange(256))
+    m0 = s0 / np.where(w0 == 0, 1, w0)
+    m1 = (s0[-1] - s0) / np.where(w1 == 0, 1, w1)
+    return int(np.argmax(w0 * w1 * (m0 - m1) ** 2))
+
+
+def _line_height(ink: np.ndarray) -> Optional[float]:
+    """Median height of the horizontal ink bands (≈ text line height in px)."""
+    rows = ink.any(axis=1).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows, [0]))))
+    runs = edges[1::2] - edges[::2]
+    runs = runs[runs > 2]          # specks and table rules
+    return float(np.median(runs)) if runs.size else None
+
+
+def preprocess(img: Image.Image) -> Optional[Image.Image]:
+    """Grayscale → binary → crop blank margins → adaptive downsample. None for a blank page."""
+    a = np.asarray(img.convert("L"))
+    ink = a <= _otsu_threshold(a)
+    ys = np.flatnonzero(ink.any(axis=1))
+    if ys.size == 0 or ink.mean() > 0.5:
+        return None
+    xs = np.flatnonzero(ink.any(axis=0))
+    h, w = ink.shape
+    y0, y1 = max(ys[0] - CROP_MARGIN_PX, 0), min(ys[-1] + CROP_MARGIN_PX + 1, h)
+    x0, x1 = max(xs[0] - CROP_MARGIN_PX, 0), min(xs[-1] + CROP_MARGIN_PX + 1, w)
+    ink = ink[y0:y1, x0:x1]
+    out = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), mode="L")
+
+    if OCR_ADAPTIVE_DPI:
+        lh = _line_height(ink)
+        if lh and lh > 1.5 * OCR_TARGET_LINE_PX:
+            scale = max(OCR_MIN_SCALE, OCR_TARGET_LINE_PX / lh)
+            out = out.resize((max(1, round(out.width * scale)), max(1, round(out.height * scale))),
+                             Image.Resampling.LANCZOS)
+    return out
+
+
+def page_key(img: Image.Image) -> str:
+    digest = hashlib.sha256(img.tobytes()).hexdigest()
+    return f"{PIPELINE_VERSION}:{OCR_LANG}:{OCR_PSM}:{img.mode}:{img.width}x{img.height}:{digest}"
+
+
+def ocr_page(img: Image.Image) -> str:
+    key = page_key(img)
+    text = cache_get("ocr", key)
+    if text is not None:
+        return text
+    pre = preprocess(img)
+    text = "" if pre is None else pytesseract.image_to_string(pre, lang=OCR_LANG, config=f"--psm {OCR_PSM}")
+    cache_set("ocr", key, text, ttl=OCR_CACHE_TTL)
+    return text
+
+
+def ocr_pdf(source) -> str:
+    """OCR text of every page of a PDF path or PDF bytes (pages in parallel: each tesseract call is its own process)."""
+    convert = convert_from_bytes if isinstance(source, (bytes, bytearray)) else convert_from_path
+    pages = convert(source, dpi=OCR_DPI, grayscale=True, thread_count=OCR_WORKERS)
+    if len(pages) <= 1 or OCR_WORKERS <= 1:
+        return "\n".join(ocr_page(p) for p in pages)
+    with ThreadPoolExecutor(max_workers=OCR_WORKERS) as pool:
+        return "\n".join(pool.map(ocr_page, pages))
@@ -0,0 +1,228 @@
+# pdf_tables.py
+"""
+Line-table extraction from the character boxes of digital PDFs (pdfminer).
+
+Flattened text loses the columns: "Consulting 2 500.00 1000.00" can't be told
+apart from a description that ends in numbers, and multi-line descriptions
+break the row regexes. Here every page is interpreted once without pdfminer's
+layout analysis (we only need raw glyph boxes), glyphs are grouped into rows
+by baseline and into cells by horizontal gaps, and the header row gives the
+column positions. Pages are processed one at a time (nothing but the found
+rows is kept), and a page that is too large or too slow is skipped.
+"""
+import os
+import re
+import time
+from statistics import median
+from typing import Any, Dict, Iterator, Optional
+
+TABLE_MAX_PAGES = int(os.getenv("TABLE_MAX_PAGES", "10"))
+TABLE_MAX_CHARS_PER_PAGE = int(os.getenv("TABLE_MAX_CHARS_PER_PAGE", "20000"))
+TABLE_PAGE_BUDGET_MS = float(os.getenv("TABLE_PAGE_BUDGET_MS", "300"))
+
+# סדר הבדיקה חשוב: "Total price" היא עמודת סכום, "Unit price" — מחיר יחידה
+HEADER_WORDS = (
+    ("quantity", ("qty", "quantity", "кол", "бр.")),
+    ("line_total", ("total", "amount", "sum", "стойност", "сума", "общо")),
+    ("unit_price", ("unit", "price", "rate", "цена")),
+    ("description", ("description", "service", "item", "details", "описание", "наименование", "услуга")),
+)
+STOP_RE = re.compile(r"(?i)(sub-?total|\btotal\b|\bvat\b|данъчна основа|\bддс\b|общо|всичко)")
+CURRENCY_SYMBOLS = {"€": "EUR", "$": "USD", "₪": "ILS", "ЛВ": "BGN", "ЛВ.": "BGN"}
+CURRENCY_RE = re.compile(r"(?i)\b(EUR|USD|BGN|ILS|GBP|JPY|CHF|CAD|AUD)\b|(€|\$|₪|лв\.?)")
+NUMBER_RE = re.compile(r"-?\d[\d\s.,]*\d|\d")
+
+
+def to_float(raw: str) -> Optional[float]:
+    """'1 234,56' / '1,234.56' / '1.234,56' / '120.00' -> float (last separator is the decimal one)."""
+    s = re.sub(r"\s", "", raw or "")
+    if "," in s and "." in s:
+        dec = max(s.rfind(","), s.rfind("."))
+        s = re.sub(r"[.,]", "", s[:dec]) + "." + s[dec + 1:]
+    elif "," in s:
+        head, _, tail = s.rpartition(",")
+        s = head.replace(",", "") + ("." + tail if len(tail) != 3 else tail)
+    elif s.count(".") > 1:
+        head, _, tail = s.rpartition(".")
+        s = head.replace(".", "") + ("." + tail if len(tail) != 3 else tail)
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _currency(text: str) -> Optional[str]:
+    m = CURRENCY_RE.search(text)
+    if not m:
+        return None
+    return m.group(1).upper() if m.group(1) else CURRENCY_SYMBOLS.get(m.group(2).upper())
+
+
+# ---------------------------
+# Glyphs → rows → cells
+# ---------------------------
+def _iter_pages(source, maxpages: int) -> Iterator[tuple[Any, float]]:
+    """(LTPage, seconds spent interpreting it). No LAParams: raw LTChar boxes only, no layout analysis."""
+    from pdfminer.converter import PDFPageAggregator
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.utils import open_filename
+
+    with open_filename(source, "rb") as fp:
+        rsrc = PDFResourceManager(caching=True)
+        device = PDFPageAggregator(rsrc, laparams=None)
+        interpreter = PDFPageInterpreter(rsrc, device)
+        for page in PDFPage.get_pages(fp, maxpages=maxpages):
+            t0 = time.perf_counter()
+            interpreter.process_page(page)
+            yield device.get_result(), time.perf_counter() - t0
+
+
+def _glyphs(layout, limit: int) -> Optional[list[tuple[float, float, float, float, str]]]:
+    """(x0, x1, y0, y1, text) of every visible glyph; None when the page has more than `limit`."""
+    from pdfminer.layout import LTChar, LTContainer
+
+    out = []
+    stack = [layout]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, LTChar):
+            if obj.get_text().strip():
+                out.append((obj.x0, obj.x1, obj.y0, obj.y1, obj.get_text()))
+                if len(out) > limit:
+                    return None
+        elif isinstance(obj, LTContainer):
+            stack.extend(obj)
+    return out
+
+
+def _rows(glyphs: list) -> list[list[tuple[float, float, str]]]:
+    """Top-to-bottom rows of (x0, x1, text) cells."""
+    if not glyphs:
+        return []
+    size = median(g[3] - g[2] for g in glyphs) or 1.0
+    glyphs.sort(key=lambda g: (-(g[2] + g[3]) / 2, g[0]))
+
+    lines, current, center = [], [], None
+    for g in glyphs:
+        c = (g[2] + g[3]) / 2
+        if center is not None and abs(c - center) > size / 2:
+            lines.append(current)
+            current = []
+        if not current:
+            center = c
+        current.append(g)
+    lines.append(current)
+
+    rows = []
+    for line in lines:
+        line.sort(key=lambda g: g[0])
+        cells = []
+        x0, x1, text = line[0][0], line[0][1], line[0][4]
+        for g in line[1:]:
+            gap = g[0] - x1
+            if gap > 0.8 * size:                 # column gap
+                cells.append((x0, x1, text))
+                x0, text = g[0], g[4]
+            else:
+                text += (" " if gap > 0.15 * size else "") + g[4]
+            x1 = max(x1, g[1])
+        cells.append((x0, x1, text))
+        rows.append(cells)
+    return rows
+
+
+def _header_columns(cells: list) -> Optional[list[tuple[float, float, str]]]:
+    """(x0, x1, kind) per recognised header cell, if the row looks like a line-table header."""
+    cols = []
+    for x0, x1, text in cells:
+        t = text.lower()
+        kind = next((k for k, words in HEADER_WORDS if any(w in t for w in words)), None)
+        if kind:
+            cols.append((x0, x1, kind))
+    kinds = {k for _, _, k in cols}
+    if len(cells) >= 3 and "description" in kinds and kinds & {"line_total", "unit_price"}:
+        return cols
+    return None
+
+
+def _column_of(cell: tuple, columns: list) -> str:
+    x0, x1, _ = cell
+
+    def distance(col):
+        return max(col[0] - x1, x0 - col[1], 0.0)   # 0 when the spans overlap
+
+    # ties (several overlaps) → the column whose centre is closest
+    return min(columns, key=lambda col: (distance(col), abs((col[0] + col[1]) - (x0 + x1))))[2]
+
+
+def _row_item(cells: list, columns: list) -> tuple[str, Dict[str, Optional[float]], Optional[str]]:
+    desc, values, currency = [], {}, None
+    for cell in cells:
+        kind, text = _column_of(cell, columns), cell[2]
+        currency = currency or _currency(text)
+        if kind == "description":
+            desc.append(text)
+            continue
+        m = NUMBER_RE.search(text)
+        values[kind] = to_float(m.group()) if m else None
+    return " ".join(desc).strip(), values, currency
+
+
+# ---------------------------
+# Public API
+# ---------------------------
+def extract_table_lines(source, default_currency: Optional[str] = None,
+                        max_pages: int = TABLE_MAX_PAGES,
+                        max_chars: int = TABLE_MAX_CHARS_PER_PAGE,
+                        budget_ms: float = TABLE_PAGE_BUDGET_MS) -> list[Dict[str, Any]]:
+    """
+    Service lines in the format of process.extract_service_lines. `source` is
+    a path or a binary file object. Returns [] when no table header is found
+    (scanned PDFs, free-form invoices) so the caller can fall back.
+    """
+    items: list[Dict[str, Any]] = []
+    columns = None          # carried over when a table continues on the next page
+    in_table = False
+    try:
+        for layout, spent in _iter_pages(source, max_pages):
+            glyphs = _glyphs(layout, max_chars)
+            if glyphs is None or spent * 1000 > budget_ms:
+                continue
+            rows = _rows(glyphs)
+            if in_table:
+                # המשך טבלה: אם העמוד חוזר על הכותרת — מתחילים ממנה, לא מכותרת העמוד
+                start = next((i for i, cells in enumerate(rows) if _header_columns(cells)), None)
+                if start is not None:
+                    columns, rows = _header_columns(rows[start]), rows[start + 1:]
+            page_items = 0
+            for cells in rows:
+                if not in_table:
+                    header = _header_columns(cells)
+                    if header:
+                        columns, in_table = header, True
+                    continue
+                if STOP_RE.search(" ".join(c[2] for c in cells)):
+                    in_table = False
+                    continue
+                desc, values, currency = _row_item(cells, columns)
+                if not any(v is not None for v in values.values()):
+                    if desc and page_items:
+                        items[-1]["description"] += " " + desc     # wrapped description
+                    continue
+                qty = values.get("quantity") or 1
+                price, total = values.get("unit_price"), values.get("line_total")
+                if price is None and total is None:
+                    continue
+                items.append({
+                    "description": desc,
+                    "quantity": int(qty) if float(qty).is_integer() else qty,
+                    "unit_price": price if price is not None else round(total / qty, 2),
+                    "line_total": total if total is not None else round(price * qty, 2),
+                    "currency": currency or default_currency or "EUR",
+                    "service_date": None,
+                })
+                page_items += 1
+    except Exception:
+        return []
+    return items
@@ -0,0 +1,83 @@
+# pipeline.py
+"""
+A very small stage graph for the invoice pipeline. Every stage names the
+stages it depends on and receives their results as keyword arguments; a
+stage starts as soon as its dependencies are done, so independent stages
+(FX lookup, translations, template loading, ...) overlap and the critical
+path is the longest chain instead of the sum of all stages. Plain functions
+run in the worker thread pool (under cProfile when the request is being
+profiled, see profiling.py), coroutines on the loop.
+"""
+import time
+import asyncio
+import inspect
+import functools
+from typing import Any, Callable, Optional
+
+import anyio.to_thread
+
+import profiling
+
+Stages = dict[str, tuple[tuple[str, ...], Callable[..., Any]]]
+
+
+async def to_thread(fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+    """
+    asyncio.to_thread on AnyIO's worker pool — the one Starlette runs sync
+    endpoints in and /ready reports on (executor_stats), so all blocking work
+    of a request is in one measured queue. Context variables are copied and a
+    cancelled caller does not wait for the thread, as with asyncio.to_thread.
+    """
+    return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), abandon_on_cancel=True)
+
+
+def executor_stats() -> dict:
+    """Threads in use / allowed and calls waiting for one (call from the event loop)."""
+    stats = anyio.to_thread.current_default_thread_limiter().statistics()
+    return {"busy": stats.borrowed_tokens, "limit": stats.total_tokens, "waiting": stats.tasks_waiting}
+
+
+async def run_stages(stages: Stages, timings: Optional[dict] = None) -> dict[str, Any]:
+    """
+    Runs the graph and returns {stage: result}. Stages must be listed after
+    their dependencies (which also rules out cycles). The first failing stage
+    cancels the rest and its exception propagates unchanged.
+    """
+    seen: set[str] = set()
+    for name, (deps, _) in stages.items():
+        unknown = [d for d in deps if d not in seen]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on {unknown}, which are not defined before it")
+        seen.add(name)
+
+    t0 = time.perf_counter()
+    results: dict[str, Any] = {}
+    tasks: dict[str, asyncio.Future] = {}
+
+    async def run(name: str):
+        deps, fn = stages[name]
+        if deps:
+            await asyncio.gather(*(tasks[d] for d in deps))
+        kwargs = {d: results[d] for d in deps}
+        start = time.perf_counter()
+        if inspect.iscoroutinefunction(fn):
+            value = await fn(**kwargs)
+        else:
+            value = await to_thread(profiling.run, fn, **kwargs)
+        results[name] = value
+        if timings is not None:
+            timings[name] = {"start_ms": round((start - t0) * 1000, 1),
+                             "ms": round((time.perf_counter() - start) * 1000, 1)}
+        return value
+
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(run(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for t in tasks.values():
+            t.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return results
+
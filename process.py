@@ -1,52 +1,54 @@
 import os, json
 import os
+import io
 import re
 import datetime
-import pandas as pd
-import requests
-import pytesseract
 import traceback
+import hashlib
+from functools import lru_cache
 import time
-from pdf2image import convert_from_path
 from fastapi import UploadFile, APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from docxtpl import DocxTemplate
-from PyPDF2 import PdfReader
+from responses import FastJSONResponse
 from xml.etree import ElementTree as ET
-from docx import Document
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from tempfile import NamedTemporaryFile
-from rates import rate_to_bgn
+import tempfile
+from version_store import current_path as current_suppliers_path
+from shared_state import cache_get, cache_set, next_counter, release_counter
+from idempotency import run_once, IdempotencyConflict, reserve_number, unreserve_number
+from pdf_tables import extract_table_lines
+from pipeline import run_stages, to_thread
+from resilience import CircuitOpen, breaker, collect, degraded
+import invoice_store
+import recipient_registry
+import metrics
 import subprocess, shlex, os
+import threading
 from pathlib import Path
+from typing import Optional, TYPE_CHECKING
 
+# ספריות כבדות (pandas, docxtpl, PyPDF2, Google client, OCR) נטענות רק בשלב שמשתמש בהן,
+# כך ש-/ping ו-/suppliers/versions עולים בלי לשלם עליהן
+if TYPE_CHECKING:
+    import pandas as pd
 
-# --- Configuration ---
-SUPPLIERS_PATH = os.getenv("SUPPLIERS_PATH", "suppliers.xlsx")
-SUPPLIERS_DIR = os.getenv("SUPPLIERS_DIR", "/app/data/suppliers")
-POINTER_FILE = os.path.join(SUPPLIERS_DIR, "current.json")
-os.makedirs(SUPPLIERS_DIR, exist_ok=True)
-
-def get_suppliers_current_path():
-    try:
-        if os.path.exists(POINTER_FILE):
-            with open(POINTER_FILE, "r", encoding="utf-8") as f:
-                p = json.load(f).get("current")
-                if p and os.path.exists(p):
-                    return p
-    except Exception:
-        pass
-    # fallback: הנתיב הקיים בקוד שלך
-    return SUPPLIERS_PATH
 
+# --- Configuration ---
 TEMPLATES_DIR = os.getenv("TEMPLATES_DIR", "templates")
 DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "EUR")
 DEFAULT_VAT_PERCENT = float(os.getenv("DEFAULT_VAT_PERCENT", "20.0"))
 DRIVE_FOLDER_ID = os.getenv("DRIVE_FOLDER_ID")
 UPLOAD_DIR = "/tmp/uploads"
 GOOGLE_API_TIMEOUT = int(os.getenv("GOOGLE_API_TIMEOUT", "20"))
+# כמה ימים אחורה/קדימה מותר לקחת שער שמור כששירות השערים לא זמין
+FX_STALE_DAYS = int(os.getenv("FX_STALE_DAYS", "7"))
+DEBUG = os.getenv("DEBUG", "0") == "1"
+# שדות ספק שמופיעים בחשבונית בבולגרית
+SUPPLIER_BG_FIELDS = ("SupplierName", "SupplierAddress", "SupplierCity", "Bankname", "SupplierContactPerson")
+# ההמרה ל-PDF היא השלב היחיד שעדיין צריך קבצים (soffice) — על tmpfs כשיש
+CONVERT_DIR = os.getenv("CONVERT_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+# טקסט ושורות שחולצו מקובץ נשמרים לפי hash שלו: תצוגה מקדימה (dry_run) ואחריה שליחה אמיתית מחלצים פעם אחת
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL_SEC", str(24 * 3600)))
+PREVIEW_INVOICE_NUMBER = "PREVIEW"
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 if not os.path.exists(TEMPLATES_DIR):
@@ -54,56 +56,133 @@ if not os.path.exists(TEMPLATES_DIR):
 
 router = APIRouter()
 
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+_http_session = None
+_http_lock = threading.Lock()
+
+def http_session():
+    """One pooled requests.Session per process: stages reuse TLS connections instead of reconnecting."""
+    global _http_session
+    if _http_session is None:
+        with _http_lock:
+            if _http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
 # --- Core Helper Functions ---
 
 def log(msg):
     print(f"[{datetime.datetime.now()}] {msg}", flush=True)
 
+_CYRILLIC_RE = re.compile('[\u0400-\u04FF]')
+
 def is_cyrillic(text):
     if not text: return False
-    return bool(re.search('[\u0400-\u04FF]', text))
+    return bool(_CYRILLIC_RE.search(text))
 
-def auto_translate(text, target_lang="bg"):
-    if not text or not isinstance(text, str) or not text.strip() or is_cyrillic(text):
-        return text
+TRANSLATE_BATCH_SIZE = 100  # Google v2 מקבל עד 128 מחרוזות בבקשה
+
+def translate_many(texts, target_lang="bg"):
+    """
+    Translates a list of strings with one API request per TRANSLATE_BATCH_SIZE
+    unique uncached strings. Empty / Cyrillic strings come back unchanged;
+    entries that could not be translated come back as None.
+    """
+    results = [t if (not t or not isinstance(t, str) or not t.strip() or is_cyrillic(t)) else None for t in texts]
+    todo = {t for t, r in zip(texts, results) if r is None}
+    if not todo:
+        return results
+    done = {}
+    for t in todo:
+        cached = cache_get("translate", f"{target_lang}:{t}")
+        if cached is not None:
+            done[t] = cached
+    missing = [t for t in todo if t not in done]
     api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
+    if missing and not api_key:
         log("Warning: GOOGLE_API_KEY not set. Cannot translate.")
-        return text
-    try:
-        url = f"https://translation.googleapis.com/language/translate/v2?key={api_key}"
-        payload = {"q": text, "target": target_lang}
-        response = requests.post(url, json=payload, timeout=GOOGLE_API_TIMEOUT)
-        if response.ok:
-            return response.json()["data"]["translations"][0]["translatedText"].strip()
-        else:
-            log(f"Translation API error: {response.status_code} - {response.text}")
-            return text
-    except Exception as e:
-        log(f"❌ Translation failed: {e}")
-        return text
+        missing = []
+    url = f"https://translation.googleapis.com/language/translate/v2?key={api_key}"
+
+    def post(chunk):
+        response = http_session().post(url, json={"q": chunk, "target": target_lang}, timeout=GOOGLE_API_TIMEOUT)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RuntimeError(f"Translation API error: {response.status_code}")     # counts against the breaker
+        return response
+
+    for i in range(0, len(missing), TRANSLATE_BATCH_SIZE):
+        chunk = missing[i:i + TRANSLATE_BATCH_SIZE]
+        try:
+            response = breaker("translate").call(post, chunk)
+            if not response.ok:
+                log(f"Translation API error: {response.status_code} - {response.text}")
+                continue
+            for src, tr in zip(chunk, response.json()["data"]["translations"]):
+                done[src] = tr["translatedText"].strip()
+                cache_set("translate", f"{target_lang}:{src}", done[src])
+        except CircuitOpen as e:
+            log(f"❌ Translation skipped: {e}")
+            break
+        except Exception as e:
+            log(f"❌ Translation failed: {e}")
+    untranslated = [t for t in missing if t not in done]
+    if untranslated:
+        degraded(f"Translation unavailable: {len(untranslated)} text(s) left untranslated")
+    return [r if r is not None else done.get(t) for t, r in zip(texts, results)]
 
+def auto_translate(text, target_lang="bg"):
+    if not text or not isinstance(text, str) or not text.strip() or is_cyrillic(text):
+        return text
+    return translate_many([text], target_lang)[0] or text
+
+_TRANSLIT_TABLE = str.maketrans({
+    "a": "а", "b": "б", "c": "ц", "d": "д", "e": "е", "f": "ф",
+    "g": "г", "h": "х", "i": "и", "j": "дж", "k": "к", "l": "л",
+    "m": "м", "n": "н", "o": "о", "p": "п", "q": "кю", "r": "р",
+    "s": "с", "t": "т", "u": "у", "v": "в", "w": "у", "x": "кс",
+    "y": "й", "z": "з",
+    "A": "А", "B": "Б", "C": "Ц", "D": "Д", "E": "Е", "F": "Ф",
+    "G": "Г", "H": "Х", "I": "И", "J": "Дж", "K": "К", "L": "Л",
+    "M": "М", "N": "Н", "O": "О", "P": "П", "Q": "Кю", "R": "Р",
+    "S": "С", "T": "Т", "U": "У", "V": "В", "W": "У", "X": "Кс",
+    "Y": "Й", "Z": "З"
+})
+_SUFFIX_RE = re.compile(r'(?i)\b(LTD|EOOD|OOD)\b')
+_SUFFIXES = {"ltd": "ЛТД", "eood": "ЕООД", "ood": "ООД"}
+
+@lru_cache(maxsize=4096)
 def transliterate_to_bulgarian(text):
     if not text: return ""
     text = text.strip()
-    table = {
-        "a": "а", "b": "б", "c": "ц", "d": "д", "e": "е", "f": "ф",
-        "g": "г", "h": "х", "i": "и", "j": "дж", "k": "к", "l": "л",
-        "m": "м", "n": "н", "o": "о", "p": "п", "q": "кю", "r": "р",
-        "s": "с", "t": "т", "u": "у", "v": "в", "w": "у", "x": "кс",
-        "y": "й", "z": "з",
-        "A": "А", "B": "Б", "C": "Ц", "D": "Д", "E": "Е", "F": "Ф",
-        "G": "Г", "H": "Х", "I": "И", "J": "Дж", "K": "К", "L": "Л",
-        "M": "М", "N": "Н", "O": "О", "P": "П", "Q": "Кю", "R": "Р",
-        "S": "С", "T": "Т", "U": "У", "V": "В", "W": "У", "X": "Кс",
-        "Y": "Й", "Z": "З"
-    }
-    # First, handle common suffixes
-    text = re.sub(r'(?i)\bLTD\b', 'ЛТД', text)
-    text = re.sub(r'(?i)\bEOOD\b', 'ЕООД', text)
-    text = re.sub(r'(?i)\bOOD\b', 'ООД', text)
-    
-    return "".join(table.get(char, char) for char in text)
+    # First, handle common suffixes (one pass), then a single str.translate
+    text = _SUFFIX_RE.sub(lambda m: _SUFFIXES[m.group(1).lower()], text)
+    return text.translate(_TRANSLIT_TABLE)
+
+def supplier_field_bg(supplier_data, field):
+    """Bulgarian value of a supplier field: precomputed column if present, else translate now."""
+    value = supplier_data.get(f"{field}_bg")
+    if isinstance(value, str) and value:
+        return value
+    return auto_translate(str(supplier_data[field]))
+
+def supplier_fields_bg(supplier_data, fields, extra=()):
+    """
+    supplier_field_bg for several fields plus `extra` free texts, with all
+    missing translations in a single translate_many request.
+    Returns ({field: value}, [extra values]).
+    """
+    values = {f: supplier_data.get(f"{f}_bg") for f in fields}
+    todo = [f for f in fields if not (isinstance(values[f], str) and values[f])]
+    texts = [str(supplier_data[f]) for f in todo] + [t or "" for t in extra]
+    translated = [tr or src for src, tr in zip(texts, translate_many(texts))] if texts else []
+    values.update(zip(todo, translated))
+    return values, translated[len(todo):]
 
 def number_to_bulgarian_words(amount):
     try:
@@ -135,14 +214,16 @@ def number_to_bulgarian_words(amount):
         log(f"Error in number_to_bulgarian_words: {e}")
         return ""
 
-def extract_text_from_file(file_path, filename):
+def extract_text_from_file(data: bytes, filename):
     log(f"Extracting text from '{filename}'")
     if filename.lower().endswith(".pdf"):
         try:
-            text = "\n".join(page.extract_text() or "" for page in PdfReader(file_path).pages)
+            from PyPDF2 import PdfReader
+            text = "\n".join(page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages)
             if len(text.strip()) > 50: return text
             log("Fallback to OCR for PDF.")
-            return "\n".join(pytesseract.image_to_string(img, config='--psm 6') for img in convert_from_path(file_path, dpi=300))
+            from ocr import ocr_pdf
+            return ocr_pdf(data)
         except Exception as e:
             log(f"PDF extraction failed: {e}")
             return ""
@@ -161,15 +242,18 @@ def extract_invoice_date(text):
                     continue
     return None
 
-def extract_service_lines(text):
+def detect_currency(text):
+    """The invoice currency for lines that do not state one: ₪ wins, else the first code in the text, else EUR."""
     currency_pattern = r"\b(EUR|USD|BGN|ILS|GBP|JPY|CHF|CAD|AUD|₪)\b"
-    currencies_found = set(re.findall(currency_pattern, text))
-    log(f"Detected currencies in text: {currencies_found}")
-    default_currency = "EUR"
+    currencies_found = re.findall(currency_pattern, text)
+    log(f"Detected currencies in text: {set(currencies_found)}")
     if "₪" in currencies_found:
-        default_currency = "ILS"
-    elif currencies_found:
-        default_currency = list(currencies_found)[0]  # קח את הראשון שמצאת
+        return "ILS"
+    return currencies_found[0] if currencies_found else "EUR"  # קח את הראשון שמצאת
+
+
+def extract_service_lines(text):
+    default_currency = detect_currency(text)
 
     """
     מחזירה רשימה של שורות שירות בפורמט:
@@ -224,12 +308,20 @@ def extract_service_lines(text):
         log("No service lines detected.")
     return service_items
 
-def extract_recipient_details(text: str, supplier_data: pd.Series) -> dict:
+def extract_recipient_details(text: str, supplier_data: "pd.Series") -> dict:
     log("--- Starting Hybrid Recipient Details Extraction (V-Final) ---")
     details = {'name': '', 'vat': '', 'id': '', 'address': ''}
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
     supplier_vat = str(supplier_data.get("SupplierCompanyVAT", "###NEVER_FIND_THIS###"))
 
+    # --- Method 0: a VAT / EIK we've invoiced before fills the whole block from the registry ---
+    known = recipient_registry.find_in_text(text, exclude=(supplier_vat, str(supplier_data.get("SupplierCompanyID", ""))))
+    if known:
+        metrics.incr("recipient_registry_hit")
+        log(f"Method 0 SUCCESS: known recipient '{known['name']}' (VAT {known['vat'] or '-'}, EIK {known['id'] or '-'}).")
+        return known
+    metrics.incr("recipient_registry_miss")
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+
     # --- Method 1: Direct Keyword Search (The "Old Code" Magic) ---
     log("Attempting Method 1: Direct Keyword Search...")
     customer_keywords = ['customer name:', 'bill to:', 'invoice to:', 'invoice for:', 'client:', 'получател:', 'клиент:']
@@ -256,7 +348,7 @@ def extract_recipient_details(text: str, supplier_data: pd.Series) -> dict:
                             id_match = re.search(r'\d{9,}', sub_line)
                             if id_match: details['id'] = id_match.group(0)
                     log(f"Method 1 extracted: {details}")
-                    return details
+                    return recipient_registry.complete(details)
 
     # --- Method 2: Block Isolation Fallback (The "New" Smart Method) ---
     log("Method 1 FAILED. Trying Method 2: Block Isolation Fallback.")
@@ -276,7 +368,7 @@ def extract_recipient_details(text: str, supplier_data: pd.Series) -> dict:
                     id_match = re.search(r'\d{9,}', line)
                     if id_match: details['id'] = id_match.group(0)
             log(f"Method 2 extracted: {details}")
-            return details
+            return recipient_registry.complete(details)
 
     log("All methods failed to find recipient details.")
     return details
@@ -288,49 +380,83 @@ def get_template_path_by_rows(num_rows: int) -> str:
         raise FileNotFoundError(f"Template file not found: {path}")
     return path
 
+_template_bytes: dict = {}    # path -> (mtime_ns, bytes)
+
+def template_files() -> list:
+    return sorted(os.path.join(TEMPLATES_DIR, n) for n in os.listdir(TEMPLATES_DIR) if n.endswith(".docx"))
+
+def is_template_loaded(path: str) -> bool:
+    cached = _template_bytes.get(path)
+    return cached is not None and os.path.exists(path) and cached[0] == os.stat(path).st_mtime_ns
+
+def load_template(path: str):
+    """DocxTemplate from an in-memory copy of the file (re-read only when the file changes)."""
+    from docxtpl import DocxTemplate
+    mtime = os.stat(path).st_mtime_ns
+    cached = _template_bytes.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = _template_bytes[path] = (mtime, f.read())
+    return DocxTemplate(io.BytesIO(cached[1]))
+
+_drive_service = None
+
 def get_drive_service():
+    """Drive client, built once per process (building parses the discovery document)."""
+    global _drive_service
+    if _drive_service is not None:
+        return _drive_service
     creds_json = os.getenv("GOOGLE_CREDS_JSON")
     if not creds_json: raise ValueError("Missing GOOGLE_CREDS_JSON")
-    with NamedTemporaryFile(mode="w+", delete=False, suffix=".json") as tf:
-        tf.write(creds_json); path = tf.name
-    try:
-        creds = service_account.Credentials.from_service_account_file(path, scopes=["https://www.googleapis.com/auth/drive"])
-        return build("drive", "v3", credentials=creds)
-    finally: os.remove(path)
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+    creds = service_account.Credentials.from_service_account_info(json.loads(creds_json), scopes=["https://www.googleapis.com/auth/drive"])
+    _drive_service = build("drive", "v3", credentials=creds, cache_discovery=False)
+    return _drive_service
 
-def upload_to_drive(local_path, filename):
+def upload_to_drive(content: bytes, filename, mimetype=DOCX_MIME):
     log(f"Uploading '{filename}' to Google Drive...")
     service = get_drive_service()
     file_metadata = {"name": filename, "parents": [os.getenv("DRIVE_FOLDER_ID")]}
-    media = MediaFileUpload(local_path, resumable=True)
-    file = service.files().create(body=file_metadata, media_body=media, fields="id, webViewLink").execute()
-    service.permissions().create(fileId=file["id"], body={"type": "anyone", "role": "reader"}).execute()
+    from googleapiclient.http import MediaIoBaseUpload
+
+    def upload():
+        # לא hedged: העלאה כפולה יוצרת שני קבצים
+        media = MediaIoBaseUpload(io.BytesIO(content), mimetype=mimetype, resumable=True)
+        file = service.files().create(body=file_metadata, media_body=media, fields="id, webViewLink").execute()
+        service.permissions().create(fileId=file["id"], body={"type": "anyone", "role": "reader"}).execute()
+        return file
+
+    file = breaker("drive").call(upload)
     link = file.get("webViewLink")
     log(f"Successfully uploaded. Link: {link}")
     return link
-def docx_to_pdf(docx_path: str) -> str:
+def docx_to_pdf(docx: bytes) -> bytes:
     """
     ממיר DOCX ל-PDF באמצעות LibreOffice headless.
-    מחזיר את הנתיב המקומי ל-PDF שנוצר.
+    soffice עובד רק עם קבצים, אז הקלט והפלט עוברים בתיקייה פרטית לבקשה
+    (ב-CONVERT_DIR, tmpfs כברירת מחדל) שנמחקת מיד — בקשות מקבילות לא דורסות זו את זו.
+    מחזיר את תוכן ה-PDF.
     """
-    docx_path = os.path.abspath(docx_path)
-    out_dir = os.path.dirname(docx_path)
-    cmd = f"soffice --headless --convert-to pdf --outdir {shlex.quote(out_dir)} {shlex.quote(docx_path)}"
-    try:
-        subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"PDF conversion failed: {e.stderr.decode(errors='ignore')[:400]}")
+    with tempfile.TemporaryDirectory(prefix="convert-", dir=CONVERT_DIR) as out_dir:
+        docx_path = os.path.join(out_dir, "invoice.docx")
+        with open(docx_path, "wb") as f: f.write(docx)
+        cmd = f"soffice --headless --convert-to pdf --outdir {shlex.quote(out_dir)} {shlex.quote(docx_path)}"
+        try:
+            subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"PDF conversion failed: {e.stderr.decode(errors='ignore')[:400]}")
 
-    pdf_path = os.path.splitext(docx_path)[0] + ".pdf"
-    if not os.path.exists(pdf_path):
-        raise RuntimeError("PDF conversion did not produce an output file")
-    return pdf_path
+        pdf_path = os.path.join(out_dir, "invoice.pdf")
+        if not os.path.exists(pdf_path):
+            raise RuntimeError("PDF conversion did not produce an output file")
+        with open(pdf_path, "rb") as f:
+            return f.read()
 
 # --- Main API Endpoint ---
-@lru_cache(maxsize=512)
 def get_exchange_rate_for_date(date_obj, currency):
     """
-    מחזיר שער המרה ל-BGN עם timeout קצר ו-fallback מהיר ±3 ימים + cache בזיכרון.
+    מחזיר שער המרה ל-BGN עם timeout קצר ו-fallback מהיר ±3 ימים + cache משותף לכל ה-workers.
     """
     c = (currency or "").upper()
     if c == "BGN":
@@ -343,76 +469,195 @@ def get_exchange_rate_for_date(date_obj, currency):
     TIMEOUT_SEC = 3
     MAX_FALLBACK_DAYS = 3
 
+    cache_key = f"{c}:{date_obj.strftime('%Y-%m-%d')}"
+    cached = cache_get("fx", cache_key)
+    if cached is not None:
+        return cached
+
+    def fetch(url):
+        resp = http_session().get(url, timeout=TIMEOUT_SEC)
+        if resp.status_code >= 500:
+            resp.raise_for_status()             # שירות תקול — נספר ב-breaker
+        return resp.json() if resp.ok else {}   # 4xx: אין שער לתאריך הזה
+
     # מנסים תאריך מדויק ואז ±1..±3 ימים (סה״כ עד 7 ניסיונות מהירים)
-    for delta in range(0, MAX_FALLBACK_DAYS + 1):
-        candidates = [date_obj] if delta == 0 else [date_obj - datetime.timedelta(days=delta),
-                                                    date_obj + datetime.timedelta(days=delta)]
-        for d in candidates:
-            url = f"https://api.exchangerate.host/{d.strftime('%Y-%m-%d')}?base={c}&symbols=BGN"
-            try:
-                log(f"Fetching exchange rate for {c}→BGN on {d.strftime('%Y-%m-%d')}")
-                resp = requests.get(url, timeout=TIMEOUT_SEC)
-                resp.raise_for_status()
-                data = resp.json()
-                rate = data.get("rates", {}).get("BGN")
-                if rate is not None:
-                    rate = float(rate)
-                    log(f"Rate for {c}→BGN on {d.strftime('%Y-%m-%d')}: {rate}")
-                    return rate
-            except Exception as e:
-                # ממשיכים למועמד הבא ללא הפלת התהליך
-                continue
+    try:
+        for delta in range(0, MAX_FALLBACK_DAYS + 1):
+            candidates = [date_obj] if delta == 0 else [date_obj - datetime.timedelta(days=delta),
+                                                        date_obj + datetime.timedelta(days=delta)]
+            for d in candidates:
+                url = f"https://api.exchangerate.host/{d.strftime('%Y-%m-%d')}?base={c}&symbols=BGN"
+                try:
+                    log(f"Fetching exchange rate for {c}→BGN on {d.strftime('%Y-%m-%d')}")
+                    data = breaker("fx").hedged(fetch, url)
+                    rate = data.get("rates", {}).get("BGN")
+                    if rate is not None:
+                        rate = float(rate)
+                        log(f"Rate for {c}→BGN on {d.strftime('%Y-%m-%d')}: {rate}")
+                        cache_set("fx", cache_key, rate)
+                        return rate
+                except CircuitOpen:
+                    raise
+                except Exception as e:
+                    # ממשיכים למועמד הבא ללא הפלת התהליך
+                    continue
+    except CircuitOpen as e:
+        log(f"FX lookup skipped: {e}")
+
+    # השירות לא ענה: השער השמור הקרוב ביותר (עד FX_STALE_DAYS), מסומן ב-errors
+    for delta in range(1, FX_STALE_DAYS + 1):
+        for d in (date_obj - datetime.timedelta(days=delta), date_obj + datetime.timedelta(days=delta)):
+            stale = cache_get("fx", f"{c}:{d.strftime('%Y-%m-%d')}")
+            if stale is not None:
+                degraded(f"FX service unavailable: using the cached {c}→BGN rate of {d.strftime('%Y-%m-%d')}")
+                return stale
 
     raise ValueError(f"Could not fetch rate for {c}→BGN near {date_obj.strftime('%Y-%m-%d')} (±{MAX_FALLBACK_DAYS}d)")
 
 
 @router.post("/process-invoice/")
-async def process_invoice_upload(supplier_id: str, file: UploadFile):
+async def process_invoice_upload(supplier_id: str, file: UploadFile, idempotency_key: Optional[str] = None,
+                                 dry_run: bool = False, include_docx: bool = False, client: str = "anonymous"):
+    """
+    Idempotent wrapper: the same Idempotency-Key (or, without one, the same
+    file + supplier_id) runs the pipeline once; duplicates in flight wait for
+    that run and completed ones get the stored response back.
+    A dry run bypasses it (it has no side effects, and its response must not
+    be replayed to the real submission that usually follows).
+    Only runs that actually execute the pipeline go through admission control
+    (replays are answered without queueing); the wait is in X-Queue-Wait-Ms.
+    """
+    import admission
+    data = await file.read()
+    queue_wait = {}
+
+    async def admitted_run(**kwargs):
+        cls, cost = await to_thread(admission.classify, data, file.filename)
+        async with admission.admitted(client, cls, cost) as wait_ms:
+            queue_wait["X-Queue-Wait-Ms"] = str(wait_ms)
+            return await _process_invoice(supplier_id, file.filename, data, **kwargs)
+
+    if dry_run:
+        status, body = await admitted_run(dry_run=True, include_docx=include_docx)
+        return FastJSONResponse(body, status_code=status, headers=queue_wait)
+    fingerprint = f"{supplier_id}:{hashlib.sha256(data).hexdigest()}"
+    key = f"key:{idempotency_key}" if idempotency_key else f"upload:{fingerprint}"
+    try:
+        (status, body), replayed = await run_once(key, fingerprint, admitted_run)
+    except IdempotencyConflict as e:
+        return FastJSONResponse({"success": False, "error": str(e)}, status_code=409)
+    headers = {**queue_wait, **({"Idempotent-Replayed": "true"} if replayed else {})}
+    return FastJSONResponse(body, status_code=status, headers=headers)
+
+
+async def _process_invoice(supplier_id: str, filename: str, data: bytes,
+                           dry_run: bool = False, include_docx: bool = False):
+    """
+    dry_run: extraction and computation only — no invoice number, no write to
+    the suppliers file, no archive, no conversion or upload. Returns the
+    template context (and, with include_docx, the preview DOCX as base64).
+    Fallbacks taken on the way (see resilience.degraded) are added to "errors".
+    """
+    with collect() as notes:
+        status, body = await _run_invoice(supplier_id, filename, data, dry_run, include_docx)
+    if notes:
+        errors = body.setdefault("errors", [])
+        errors.extend(n for n in notes if n not in errors)
+    return status, body
+
+
+async def _run_invoice(supplier_id: str, filename: str, data: bytes, dry_run: bool, include_docx: bool):
+    from batch_validation import bgn_amounts
+    from supplier_registry import find_supplier, has_duplicate_iban, set_last_invoice_number
+
     processing_errors = []
-    file_path = f"/tmp/{file.filename}"
+    timings = {} if DEBUG else None
+    file_hash = hashlib.sha256(data).hexdigest()
     try:
-        with open(file_path, "wb") as f: f.write(await file.read())
-        text = extract_text_from_file(file_path, file.filename)
-        if not text: raise HTTPException(status_code=400, detail="Could not extract text from file.")
-
-        df = pd.read_excel(get_suppliers_current_path())
-        supplier_row = df[df["SupplierCompanyID"] == str(supplier_id)]
-        if supplier_row.empty: raise HTTPException(status_code=404, detail=f"Supplier with ID '{supplier_id}' not found.")
-        supplier_data = supplier_row.iloc[0]
-        log(f"Loaded Supplier Data for: {supplier_data['SupplierName']}")
-        iban = str(supplier_data["IBAN"]).strip()
-        if not iban:
-            raise HTTPException(status_code=400, detail=f"Missing IBAN for supplier {supplier_data['SupplierName']}.")
-        
-        # בדוק אם ה־IBAN מופיע פעמיים בקובץ
-        if df["IBAN"].value_counts().get(iban, 0) > 1:
-            raise HTTPException(status_code=400, detail=f"Duplicate IBAN detected for supplier {supplier_data['SupplierName']}.")
-
-        date_obj = extract_invoice_date(text) or datetime.datetime.now()
-        service_items = extract_service_lines(text)
-        max_supported_rows = 5
-        if len(service_items) > max_supported_rows:
-            raise HTTPException(status_code=400, detail=f"Too many service lines ({len(service_items)}) — maximum supported is {max_supported_rows}.")
-
-        if not service_items:     
-            raise HTTPException(status_code=400, detail="No service lines found in the invoice.")
-        customer_details = extract_recipient_details(text, supplier_data)
-        if not customer_details.get('name'): processing_errors.append("Warning: Could not identify recipient details.")
+        suppliers_path = current_suppliers_path()
+
+        # --- שלבי העשרה כגרף: כל שלב רץ ברגע שהתלויות שלו מוכנות (FX ותרגום במקביל) ---
+        def text_stage():
+            text = cache_get("extraction", f"text:{file_hash}")
+            if text is None:
+                text = extract_text_from_file(data, filename)
+                if text: cache_set("extraction", f"text:{file_hash}", text, ttl=EXTRACTION_CACHE_TTL)
+            if not text: raise HTTPException(status_code=400, detail="Could not extract text from file.")
+            return text
+
+        def supplier_stage():
+            supplier_data = find_supplier(suppliers_path, supplier_id)
+            if supplier_data is None: raise HTTPException(status_code=404, detail=f"Supplier with ID '{supplier_id}' not found.")
+            log(f"Loaded Supplier Data for: {supplier_data['SupplierName']}")
+            iban = str(supplier_data["IBAN"]).strip()
+            if not iban:
+                raise HTTPException(status_code=400, detail=f"Missing IBAN for supplier {supplier_data['SupplierName']}.")
+            # כפילויות IBAN נבדקות פעם אחת לכל גרסה (בהעלאה, או בטעינה הראשונה של גרסה ישנה)
+            if has_duplicate_iban(suppliers_path, iban):
+                raise HTTPException(status_code=400, detail=f"Duplicate IBAN detected for supplier {supplier_data['SupplierName']}.")
+            return supplier_data
+
+        def date_stage(text):
+            return extract_invoice_date(text) or datetime.datetime.now()
+
+        def lines_stage(text):
+            service_items = cache_get("extraction", f"lines:{file_hash}")
+            if service_items is None:
+                # טבלה לפי קואורדינטות (PDF דיגיטלי); אחרת — regex על הטקסט השטוח
+                service_items = extract_table_lines(io.BytesIO(data), default_currency=detect_currency(text)) if filename.lower().endswith(".pdf") else []
+                if not service_items:
+                    service_items = extract_service_lines(text)
+                cache_set("extraction", f"lines:{file_hash}", service_items, ttl=EXTRACTION_CACHE_TTL)
+            max_supported_rows = 5
+            if len(service_items) > max_supported_rows:
+                raise HTTPException(status_code=400, detail=f"Too many service lines ({len(service_items)}) — maximum supported is {max_supported_rows}.")
+            if not service_items:
+                raise HTTPException(status_code=400, detail="No service lines found in the invoice.")
+            return service_items
+
+        def recipient_stage(text, supplier):
+            return extract_recipient_details(text, supplier)
+
+        def fx_stage(date, lines):
+            return get_exchange_rate_for_date(date, lines[0]["currency"])
+
+        def translations_stage(supplier, recipient):
+            # כתובת של לקוח מוכר כבר מתורגמת ברשומה שלו
+            extra = [] if recipient.get('address_bg') else [recipient.get('address', '')]
+            return supplier_fields_bg(supplier, SUPPLIER_BG_FIELDS, extra=extra)
+
+        def template_stage(lines):
+            return load_template(get_template_path_by_rows(len(lines)))
+
+        stages = {
+            "text": ((), text_stage),
+            "supplier": ((), supplier_stage),
+            "date": (("text",), date_stage),
+            "lines": (("text",), lines_stage),
+            "recipient": (("text", "supplier"), recipient_stage),
+            "fx": (("date", "lines"), fx_stage),
+            "translations": (("supplier", "recipient"), translations_stage),
+        }
+        if not dry_run or include_docx:
+            stages["template"] = (("lines",), template_stage)
+        r = await run_stages(stages, timings)
+        supplier_data, service_items, customer_details = r["supplier"], r["lines"], r["recipient"]
+        date_obj, exchange_rate, tpl = r["date"], r["fx"], r.get("template")
+        supplier_bg, address_bg = r["translations"]
+        recipient_address_bg = customer_details.get('address_bg') or (address_bg[0] if address_bg else '')
 
+        if not customer_details.get('name'): processing_errors.append("Warning: Could not identify recipient details.")
         currency = service_items[0]["currency"]
-        exchange_rate = get_exchange_rate_for_date(date_obj, currency)
-        base_bgn = sum(item['line_total'] for item in service_items) * exchange_rate
-        vat_bgn = base_bgn * (DEFAULT_VAT_PERCENT / 100)
-        total_bgn = base_bgn + vat_bgn
-        
-        last_invoice_num = int(supplier_data.get('Last invoice number', 0))
-        invoice_number = f"{last_invoice_num + 1:010d}"
+        amounts = bgn_amounts([item['line_total'] for item in service_items], exchange_rate, DEFAULT_VAT_PERCENT)
+        base_bgn, vat_bgn, total_bgn = amounts["base"], amounts["vat"], amounts["total"]
         
         def format_bgn(amount): return f"{amount:,.2f}".replace(",", " ").replace(".", ",")
         
         recipient_name_raw = customer_details.get('name', '')
         if not recipient_name_raw:
             raise HTTPException(status_code=400, detail="Recipient name could not be identified.")
+        elif customer_details.get('name_bg'):
+            recipient_name_final = customer_details['name_bg']
         elif is_cyrillic(recipient_name_raw):
             recipient_name_final = recipient_name_raw
         else:
@@ -426,23 +671,22 @@ async def process_invoice_upload(supplier_id: str, file: UploadFile):
             row_context[f"Cur{idx}"] = (item.get("currency") or currency or "EUR").upper()
             row_context[f"Amount{idx}"] = f"{item['line_total']:.2f}"
             row_context[f"UnitPrice{idx}"] = f"{exchange_rate:.5f}"
-            row_context[f"LineTotal{idx}"] = format_bgn(round(item['line_total'] * exchange_rate, 2))
+            row_context[f"LineTotal{idx}"] = format_bgn(amounts["lines"][idx - 1])
 
         base_context = {
-            "InvoiceNumber": invoice_number,
             "Date": date_obj.strftime("%d.%m.%Y"),
             "RecipientName": recipient_name_final,
             "RecipientID": customer_details.get('id', ''),
             "RecipientVAT": customer_details.get('vat', ''),
-            "RecipientAddress": auto_translate(customer_details.get('address', '')),
-            "SupplierName": auto_translate(str(supplier_data["SupplierName"])),
+            "RecipientAddress": recipient_address_bg,
+            "SupplierName": supplier_bg["SupplierName"],
             "SupplierCompanyID": str(supplier_data["SupplierCompanyID"]),
             "SupplierCompanyVAT": str(supplier_data["SupplierCompanyVAT"]),
-            "SupplierAddress": auto_translate(str(supplier_data["SupplierAddress"])),
-            "SupplierCity": auto_translate(str(supplier_data["SupplierCity"])),
+            "SupplierAddress": supplier_bg["SupplierAddress"],
+            "SupplierCity": supplier_bg["SupplierCity"],
             "SupplierContactPerson": str(supplier_data["SupplierContactPerson"]),
             "IBAN": str(supplier_data["IBAN"]),
-            "BankName": auto_translate(str(supplier_data["Bankname"])),
+            "BankName": supplier_bg["Bankname"],
             "BankCode": str(supplier_data.get("BankCode", "")),
             "AmountBGN": format_bgn(base_bgn),
             "VATAmount": format_bgn(vat_bgn),
@@ -450,47 +694,154 @@ async def process_invoice_upload(supplier_id: str, file: UploadFile):
             "TotalBGN": format_bgn(total_bgn),
             "TotalInWords": number_to_bulgarian_words(total_bgn),
             "ExchangeRate": f"{exchange_rate:.5f}",
-            "TransactionBasis": auto_translate(str(supplier_data["SupplierContactPerson"])) or "По сметка"
+            "TransactionBasis": supplier_bg["SupplierContactPerson"] or "По сметка"
         }
-        
-        template_path = get_template_path_by_rows(len(service_items))
-        tpl = DocxTemplate(template_path)
-        tpl.render({**base_context, **row_context})
-        
-        output_filename = f"bulgarian_invoice_{invoice_number}.docx"
-        output_path = f"/tmp/{output_filename}"
-        tpl.save(output_path)
-        log(f"Invoice '{output_filename}' created locally.")
-        
-        df.loc[df["SupplierCompanyID"] == str(supplier_id), "Last invoice number"] = int(invoice_number)
-        df.to_excel(get_suppliers_current_path(), index=False)
-        drive_link = upload_to_drive(output_path, output_filename)
-        # --- המרת DOCX ל-PDF והעלאה ל-Drive ---
-        pdf_link = None
-        try:
-            pdf_path = docx_to_pdf(output_path)
-            pdf_filename = os.path.splitext(output_filename)[0] + ".pdf"
-            pdf_link = upload_to_drive(pdf_path, pdf_filename)
-            log(f"PDF '{pdf_filename}' uploaded. Link: {pdf_link}")
-        except Exception as e:
-            log(f"PDF export failed: {e}")
 
-        return JSONResponse({
+        if dry_run:
+            preview = {
+                "context": {**base_context, **row_context, "InvoiceNumber": PREVIEW_INVOICE_NUMBER},
+                "service_lines": service_items,
+                "currency": currency,
+                "exchange_rate": exchange_rate,
+                "amounts_bgn": {"base": base_bgn, "vat": vat_bgn, "total": total_bgn},
+            }
+            if include_docx:
+                import base64
+
+                def preview_render_stage():
+                    tpl.render(preview["context"])
+                    buf = io.BytesIO()
+                    tpl.save(buf)
+                    return buf.getvalue()
+
+                docx_bytes = (await run_stages({"render": ((), preview_render_stage)}, timings))["render"]
+                preview["docx_base64"] = base64.b64encode(docx_bytes).decode("ascii")
+            return 200, {
+                "success": True,
+                "dry_run": True,
+                "data": preview,
+                "errors": processing_errors,
+                **({"timings": timings} if DEBUG else {}),
+            }
+
+        # --- אחרי ההעשרה: רינדור, מונה, ארכיון, Drive ו-PDF — גם הם שלבים בגרף (threads),
+        # כך שה-event loop (/ping, /ready, תור ה-admission) לא נחסם לשניות על כל חשבונית ---
+        archive_id = str(supplier_data["SupplierCompanyID"])
+        counter_name = f"invoice:{archive_id}"
+
+        def render_stage():
+            # המספר מוקצה אטומית (משותף לכל ה-workers) רק עכשיו, ומוחזר אם הרינדור נכשל.
+            # נשמר עם ה-Idempotency-Key: ניסיון חוזר אחרי כישלון במונה/ארכיון מקבל אותו מספר, בלי חור
+            number = reserve_number(lambda: next_counter(counter_name, floor=int(supplier_data.get('Last invoice number', 0))))
+            invoice_number = f"{number:010d}"
+            try:
+                tpl.render({**base_context, **row_context, "InvoiceNumber": invoice_number})
+                buf = io.BytesIO()
+                tpl.save(buf)
+            except Exception:
+                if release_counter(counter_name, number):
+                    unreserve_number()
+                raise
+            log(f"Invoice '{invoice_number}' rendered ({buf.tell()} bytes).")
+            return number, invoice_number, f"bulgarian_invoice_{invoice_number}.docx", buf.getvalue()
+
+        def counter_stage(render):
+            set_last_invoice_number(suppliers_path, supplier_id, render[0])
+
+        def archive_stage(render):
+            # ארכיון מקומי + רישום: הורדה חוזרת ודוחות לא צריכים את Drive
+            _, invoice_number, _, docx_bytes = render
+            invoice_store.record_invoice({
+                "supplier_id": archive_id,
+                "number": invoice_number,
+                "issue_date": date_obj.strftime("%Y-%m-%d"),
+                "supplier_name": str(supplier_data["SupplierName"]),
+                "supplier_vat": str(supplier_data["SupplierCompanyVAT"]),
+                "recipient_name": recipient_name_final,
+                "recipient_id": customer_details.get('id', ''),
+                "recipient_vat": customer_details.get('vat', ''),
+                "currency": currency,
+                "amount": round(sum(item['line_total'] for item in service_items), 2),
+                "exchange_rate": exchange_rate,
+                "base_bgn": base_bgn,
+                "vat_bgn": vat_bgn,
+                "total_bgn": total_bgn,
+                "source_file": filename,
+                "docx_sha": invoice_store.save_blob(docx_bytes),
+            })
+            # תרגום שנכשל (טקסט לטיני) לא נשמר ככתובת הבולגרית של הלקוח
+            recipient_registry.record(
+                recipient_name_raw, vat=customer_details.get('vat'), eik=customer_details.get('id'),
+                address=customer_details.get('address'), name_bg=recipient_name_final,
+                address_bg=recipient_address_bg if is_cyrillic(recipient_address_bg) else None,
+            )
+
+        def upload_docx_stage(render, archive):
+            # החשבונית כבר ממוספרת ובארכיון: Drive שלא זמין לא מפיל את הבקשה (ניסיון חוזר היה מקצה מספר חדש)
+            _, invoice_number, output_filename, docx_bytes = render
+            try:
+                drive_link = upload_to_drive(docx_bytes, output_filename)
+                invoice_store.update_invoice(archive_id, invoice_number, docx_link=drive_link)
+                return drive_link
+            except Exception as e:
+                log(f"Drive upload failed: {e}")
+                processing_errors.append(f"Drive upload failed: the invoice is archived locally "
+                                         f"(GET /invoices/{invoice_number}/download)")
+                return None
+
+        def pdf_stage(render, archive):
+            # soffice רץ במקביל להעלאת ה-DOCX
+            _, invoice_number, _, docx_bytes = render
+            try:
+                pdf_bytes = docx_to_pdf(docx_bytes)
+                invoice_store.update_invoice(archive_id, invoice_number, pdf_sha=invoice_store.save_blob(pdf_bytes))
+                return pdf_bytes
+            except Exception as e:
+                log(f"PDF export failed: {e}")
+                return None
+
+        def upload_pdf_stage(render, upload_docx, pdf):
+            # אחרי העלאת ה-DOCX: ה-client של Drive לא thread-safe
+            if pdf is None:
+                return None
+            _, invoice_number, output_filename, _ = render
+            try:
+                pdf_filename = os.path.splitext(output_filename)[0] + ".pdf"
+                pdf_link = upload_to_drive(pdf, pdf_filename, "application/pdf")
+                invoice_store.update_invoice(archive_id, invoice_number, pdf_link=pdf_link)
+                log(f"PDF '{pdf_filename}' uploaded. Link: {pdf_link}")
+                return pdf_link
+            except Exception as e:
+                log(f"PDF export failed: {e}")
+                return None
+
+        post = await run_stages({
+            "render": ((), render_stage),
+            "counter": (("render",), counter_stage),
+            "archive": (("render",), archive_stage),
+            "upload_docx": (("render", "archive"), upload_docx_stage),
+            "pdf": (("render", "archive"), pdf_stage),
+            "upload_pdf": (("render", "upload_docx", "pdf"), upload_pdf_stage),
+        }, timings)
+        invoice_number, drive_link, pdf_link = post["render"][1], post["upload_docx"], post["upload_pdf"]
+
+        return 200, {
             "success": True,
             "data": {
                 "invoice_number": invoice_number,
                 "docx_link": drive_link,
                 "pdf_link": pdf_link
             },
-            "errors": processing_errors
-        })
+            "errors": processing_errors,
+            **({"timings": timings} if DEBUG else {}),
+        }
 
 
+    except HTTPException as e:
+        # שגיאה צפויה של הקלט (ספק לא קיים, IBAN כפול, אין שורות) — הקוד שלה, לא 500
+        log(f"❌ {e.status_code}: {e.detail}")
+        return e.status_code, {"success": False, "error": e.detail}
     except Exception as e:
         log(f"❌ GLOBAL EXCEPTION: {traceback.format_exc()}")
-        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
-    finally:
-        if 'file_path' in locals() and os.path.exists(file_path): os.remove(file_path)
-        if 'output_path' in locals() and os.path.exists(output_path): os.remove(output_path)
-        if 'pdf_path' in locals() and os.path.exists(pdf_path): os.remove(pdf_path)
+        return 500, {"success": False, "error": str(e)}
 
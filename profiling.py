@@ -0,0 +1,164 @@
+# profiling.py
+"""
+Opt-in per-request profiling. A request is profiled when it carries
+`X-Profile: 1` with the admin token, or when it is drawn by
+PROFILE_SAMPLE_RATE (only for PROFILE_PATHS). The profile — cProfile stats
+of the event-loop thread and of every pipeline stage the request ran in the
+thread pool, plus the tracemalloc peak — is stored in the shared state DB
+under the request's X-Request-ID and served by GET /admin/profiles/{id}.
+
+Unprofiled requests only pay for one random() and one ContextVar lookup per
+stage. Caveats: the loop thread and tracemalloc are shared, so requests
+running concurrently on the same worker can show up in a profile; only one
+request at a time profiles the loop thread.
+"""
+import os
+import io
+import hmac
+import time
+import random
+import base64
+import marshal
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from shared_state import cache_get, cache_set
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_PATHS = tuple(p.strip() for p in os.getenv("PROFILE_PATHS", "/process-invoice/,/ai/parse").split(",") if p.strip())
+PROFILE_TTL = float(os.getenv("PROFILE_TTL_SEC", str(24 * 3600)))
+PROFILE_TOP = 40
+
+_current: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+_lock = threading.Lock()
+_loop_profiler_busy = False
+_tracing = 0            # profiled requests that currently need tracemalloc
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def should_profile(path: str, header: Optional[str], token: Optional[str]) -> bool:
+    if header and header not in ("0", "false") and is_admin(token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and path in PROFILE_PATHS and random.random() < PROFILE_SAMPLE_RATE
+
+
+class RequestProfile:
+    def __init__(self, request_id: str, path: str):
+        self.request_id = request_id
+        self.path = path
+        self.stats: Optional[pstats.Stats] = None
+        self.threads = 0
+        self._lock = threading.Lock()
+
+    def add(self, profiler: cProfile.Profile) -> None:
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+            self.threads += 1
+
+
+def run(fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+    """fn(*args, **kwargs), under cProfile when the calling request is being profiled (used for pipeline stages)."""
+    profile = _current.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profile.add(profiler)
+
+
+@contextmanager
+def profiled(request_id: str, path: str) -> Iterator[RequestProfile]:
+    """
+    Wraps one request (see main.py): cProfile on the event-loop thread (if no
+    other request is using it) and tracemalloc; the result is stored when the
+    request ends.
+    """
+    global _loop_profiler_busy, _tracing
+    profile = RequestProfile(request_id, path)
+    loop_profiler = None
+    with _lock:
+        if not _loop_profiler_busy:
+            _loop_profiler_busy = True
+            loop_profiler = cProfile.Profile()
+        _tracing += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    token = _current.set(profile)
+    t0 = time.perf_counter()
+    if loop_profiler:
+        loop_profiler.enable()
+    try:
+        yield profile
+    finally:
+        if loop_profiler:
+            loop_profiler.disable()
+        wall = time.perf_counter() - t0
+        _current.reset(token)
+        with _lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            _tracing -= 1
+            if _tracing == 0:
+                tracemalloc.stop()
+            if loop_profiler:
+                _loop_profiler_busy = False
+        if loop_profiler:
+            profile.add(loop_profiler)
+        save(profile, wall, peak)
+
+
+def _top(stats: pstats.Stats, n: int = PROFILE_TOP) -> list[dict]:
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({"function": f"{func} ({os.path.basename(filename)}:{line})", "calls": nc,
+                     "self_ms": round(tt * 1000, 2), "cumulative_ms": round(ct * 1000, 2)})
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:n]
+
+
+def save(profile: RequestProfile, wall: float, peak_bytes: int) -> None:
+    stats = profile.stats
+    cache_set("profile", profile.request_id, {
+        "request_id": profile.request_id,
+        "path": profile.path,
+        "created": time.time(),
+        "wall_ms": round(wall * 1000, 1),
+        "tracemalloc_peak_kb": round(peak_bytes / 1024, 1),
+        "profiled_threads": profile.threads,
+        "top": _top(stats) if stats else [],
+        # pstats dump (snakeviz / python -m pstats), base64 because the cache stores JSON
+        "pstats": base64.b64encode(marshal.dumps(stats.stats)).decode("ascii") if stats else None,
+    }, ttl=PROFILE_TTL)
+
+
+def load(request_id: str) -> Optional[dict]:
+    return cache_get("profile", request_id)
+
+
+def pstats_bytes(record: dict) -> bytes:
+    return base64.b64decode(record["pstats"]) if record.get("pstats") else b""
+
+
+def text_report(record: dict, limit: int = PROFILE_TOP) -> str:
+    """The classic `pstats` listing, sorted by cumulative time."""
+    out = io.StringIO()
+    if record.get("pstats"):
+        stats = pstats.Stats(stream=out)
+        stats.stats = marshal.loads(pstats_bytes(record))
+        stats.get_top_level_stats()
+        stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,231 @@
+# recipient_registry.py
+"""
+Recipient master data learned from our own invoices and /ai/feedback
+corrections: name as printed, VAT, EIK, address and the canonical Bulgarian
+name/address that went on the generated invoice.
+
+extract_recipient_details looks for VAT / EIK numbers in the text first; a
+known one fills the whole recipient block from an in-memory dict (no keyword
+scan, no transliteration, no address translation). When only a name comes
+out of the layout heuristics, a trigram matcher fills the missing VAT / EIK /
+address from the closest known name. The registry is seeded once from the
+invoice register and the feedback store, then updated by every generated
+invoice and every correction.
+"""
+import os
+import re
+import json
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+import invoice_store
+from feedback_store import normalize_vat
+from shared_state import connect
+
+RECIPIENT_DB = os.getenv("RECIPIENT_DB", os.path.join(invoice_store.ARCHIVE_DIR, "recipients.db"))
+os.makedirs(os.path.dirname(os.path.abspath(RECIPIENT_DB)), exist_ok=True)
+# Jaccard על trigrams של השם המנורמל; מתחת לסף לא משלימים כלום
+RECIPIENT_MATCH_THRESHOLD = float(os.getenv("RECIPIENT_MATCH_THRESHOLD", "0.6"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipients (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    name        TEXT NOT NULL,           -- as printed on the source invoice
+    name_bg     TEXT,                    -- as printed on our invoice
+    vat         TEXT,                    -- normalized (no spaces / dashes)
+    eik         TEXT,
+    address     TEXT,
+    address_bg  TEXT,
+    samples     INTEGER NOT NULL,
+    updated     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_recipients_vat ON recipients (vat);
+CREATE INDEX IF NOT EXISTS ix_recipients_eik ON recipients (eik);
+"""
+
+FIELDS = ("name", "name_bg", "vat", "eik", "address", "address_bg")
+# ДДС номер: קוד מדינה + ספרות; ЕИК/БУЛСТАТ: 9 או 13 ספרות
+VAT_RE = re.compile(r"\b[A-Z]{2}[ .\-]?\d(?:[ .\-]?\d){7,12}\b")
+EIK_RE = re.compile(r"\b\d{9}(?:\d{4})?\b")
+_LEGAL_FORMS = re.compile(
+    r"\b(ltd|llc|inc|gmbh|ag|bv|sa|srl|sro|ood|eood|ead|ad|et|оод|еоод|еад|ад|ет|лтд)\b\.?", re.IGNORECASE
+)
+_NON_WORD = re.compile(r"[\W_]+")
+
+_migrated = False
+_cache: tuple = (None, None)   # (registry signature, RecipientIndex)
+
+
+def eik_from_vat(vat: Optional[str]) -> Optional[str]:
+    """Bulgarian VAT numbers are "BG" + the EIK."""
+    return vat[2:] if vat and vat.startswith("BG") and vat[2:].isdigit() and len(vat) in (11, 15) else None
+
+
+def _db():
+    global _migrated
+    conn = connect(RECIPIENT_DB, _SCHEMA)
+    if not _migrated:
+        _migrated = True
+        if conn.execute("SELECT 1 FROM recipients LIMIT 1").fetchone() is None:
+            _import_history()
+    return conn
+
+
+def _import_history() -> None:
+    """
+    Seeds an empty registry: our own invoices (the register only has the
+    Bulgarian name), then the feedback corrections on top of them.
+    """
+    import feedback_store
+    for name_bg, eik, vat in invoice_store.iter_register(("recipient_name", "recipient_id", "recipient_vat")):
+        record(name_bg, vat=vat, eik=eik, name_bg=name_bg)
+    for line in feedback_store.iter_export():
+        payload = json.loads(line)["payload"]
+        if (payload.get("_meta") or {}).get("_invalid_schema"):
+            continue
+        party = payload.get("recipient") or {}
+        record(party.get("name"), vat=party.get("vat_id"), address=party.get("address"))
+
+
+# ---------------------------
+# Writing
+# ---------------------------
+def record(name: Optional[str], vat: Optional[str] = None, eik: Optional[str] = None,
+           address: Optional[str] = None, name_bg: Optional[str] = None,
+           address_bg: Optional[str] = None) -> bool:
+    """
+    Adds / refreshes one recipient (newer non-empty values win). Recipients
+    without a VAT or EIK are not kept — there is nothing to look them up by.
+    """
+    vat = normalize_vat(vat) or None
+    eik = re.sub(r"\D", "", eik or "") or eik_from_vat(vat)
+    name = (name or "").strip()
+    if not name or not (vat or eik):
+        return False
+    new = {"name": name, "name_bg": name_bg, "vat": vat, "eik": eik, "address": address, "address_bg": address_bg}
+    new = {k: (v.strip() if isinstance(v, str) else v) or None for k, v in new.items()}
+    conn = _db()
+    row = conn.execute(
+        f"SELECT id, samples, {', '.join(FIELDS)} FROM recipients WHERE vat = ? OR eik = ? ORDER BY vat = ? DESC LIMIT 1",
+        (vat, eik, vat),
+    ).fetchone()
+    now = datetime.utcnow().isoformat(timespec="microseconds")
+    if row is None:
+        conn.execute(
+            f"INSERT INTO recipients ({', '.join(FIELDS)}, samples, updated) VALUES ({', '.join('?' * len(FIELDS))}, 1, ?)",
+            (*new.values(), now),
+        )
+    else:
+        merged = {f: new[f] or old for f, old in zip(FIELDS, row[2:])}
+        conn.execute(
+            f"UPDATE recipients SET {', '.join(f'{f} = ?' for f in FIELDS)}, samples = ?, updated = ? WHERE id = ?",
+            (*merged.values(), row[1] + 1, now, row[0]),
+        )
+    return True
+
+
+# ---------------------------
+# Lookup
+# ---------------------------
+def _norm_name(name: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", _LEGAL_FORMS.sub(" ", name.lower())).split())
+
+
+def trigrams(name: str) -> set[str]:
+    padded = f"  {_norm_name(name)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class RecipientIndex:
+    """VAT / EIK dicts plus an inverted trigram index over the names (original and Bulgarian)."""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        self.rows = list(rows)
+        self.by_vat: dict[str, int] = {}
+        self.by_eik: dict[str, int] = {}
+        self.grams: dict[str, list[tuple[int, int]]] = defaultdict(list)   # trigram -> [(row, name variant)]
+        self.sizes: dict[tuple[int, int], int] = {}
+        for pos, row in enumerate(self.rows):
+            if row["vat"]:
+                self.by_vat[row["vat"]] = pos
+            if row["eik"]:
+                self.by_eik[row["eik"]] = pos
+            for variant, name in enumerate(filter(None, {row["name"], row["name_bg"]})):
+                grams = trigrams(name)
+                self.sizes[pos, variant] = len(grams)
+                for g in grams:
+                    self.grams[g].append((pos, variant))
+
+    def lookup(self, vat: Optional[str] = None, eik: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        pos = self.by_vat.get(normalize_vat(vat)) if vat else None
+        if pos is None and eik:
+            pos = self.by_eik.get(eik)
+        return None if pos is None else self.rows[pos]
+
+    def match_name(self, name: str) -> Optional[tuple[Dict[str, Any], float]]:
+        """Closest known recipient by trigram Jaccard similarity, as (row, score)."""
+        query = trigrams(name)
+        if not query:
+            return None
+        overlap: Counter = Counter()
+        for g in query:
+            overlap.update(self.grams.get(g, ()))
+        best, best_score = None, 0.0
+        for key, shared in overlap.items():
+            score = shared / (len(query) + self.sizes[key] - shared)
+            if score > best_score:
+                best, best_score = key[0], score
+        return None if best is None else (self.rows[best], round(best_score, 3))
+
+
+def index() -> RecipientIndex:
+    """The in-memory index, rebuilt only when some worker changed the registry."""
+    global _cache
+    conn = _db()
+    signature = tuple(conn.execute("SELECT count(*), max(updated) FROM recipients").fetchone())
+    if _cache[0] != signature:
+        rows = conn.execute(f"SELECT {', '.join(FIELDS)} FROM recipients").fetchall()
+        _cache = (signature, RecipientIndex(dict(zip(FIELDS, r)) for r in rows))
+    return _cache[1]
+
+
+def _details(row: Dict[str, Any]) -> Dict[str, str]:
+    """A registry row in the shape extract_recipient_details returns."""
+    return {"name": row["name"], "vat": row["vat"] or "", "id": row["eik"] or "", "address": row["address"] or "",
+            "name_bg": row["name_bg"] or "", "address_bg": row["address_bg"] or ""}
+
+
+def find_in_text(text: str, exclude: Iterable[str] = ()) -> Optional[Dict[str, str]]:
+    """Recipient details of the first known VAT, else the first known EIK, in the text (the supplier's own are skipped)."""
+    skip = {normalize_vat(x) for x in exclude if x}
+    skip |= {eik_from_vat(x) for x in skip}
+    idx = index()
+    for m in VAT_RE.finditer(text):
+        vat = normalize_vat(m.group())
+        if vat not in skip and (row := idx.lookup(vat=vat)):
+            return _details(row)
+    for m in EIK_RE.finditer(text):
+        if m.group() not in skip and (row := idx.lookup(eik=m.group())):
+            return _details(row)
+    return None
+
+
+def complete(details: Dict[str, str]) -> Dict[str, str]:
+    """
+    Fills the empty fields of heuristically extracted details from the
+    closest known name, unless the VAT / EIK found in the text disagree.
+    """
+    if not details.get("name") or (details.get("vat") and details.get("id")):
+        return details
+    found = index().match_name(details["name"])
+    if found is None or found[1] < RECIPIENT_MATCH_THRESHOLD:
+        return details
+    known = _details(found[0])
+    vat = normalize_vat(details.get("vat"))
+    if (vat and vat != known["vat"]) or (details.get("id") and details["id"] != known["id"]):
+        return details
+    merged = {**known, **{k: v for k, v in details.items() if v}}
+    if merged["address"] != known["address"]:
+        merged["address_bg"] = ""            # the known translation is of a different address
+    return merged
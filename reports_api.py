@@ -0,0 +1,101 @@
+# reports_api.py
+import io
+import csv
+import tempfile
+from datetime import date
+from typing import Iterator, Optional
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+import invoice_store
+
+router = APIRouter(prefix="/reports", tags=["Reports"])
+
+# (עמודה ברישום, כותרת בדוח)
+REGISTER_COLUMNS = (
+    ("issue_date", "Date"),
+    ("number", "Invoice number"),
+    ("supplier_id", "Supplier ID"),
+    ("supplier_name", "Supplier"),
+    ("supplier_vat", "Supplier VAT"),
+    ("recipient_name", "Recipient"),
+    ("recipient_id", "Recipient ID"),
+    ("recipient_vat", "Recipient VAT"),
+    ("currency", "Currency"),
+    ("amount", "Amount"),
+    ("exchange_rate", "Exchange rate"),
+    ("base_bgn", "Base BGN"),
+    ("vat_bgn", "VAT BGN"),
+    ("total_bgn", "Total BGN"),
+)
+TOTALED = ("base_bgn", "vat_bgn", "total_bgn")
+CHUNK_ROWS = 500
+XLSX_CHUNK_BYTES = 64 * 1024
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _rows(date_from, date_to, supplier) -> Iterator[list]:
+    """Register rows followed by a totals row; the sums are kept while streaming, not by re-reading."""
+    columns = tuple(c for c, _ in REGISTER_COLUMNS)
+    idx = [columns.index(c) for c in TOTALED]
+    sums, count = [0.0] * len(TOTALED), 0
+    for row in invoice_store.iter_register(columns, date_from, date_to, supplier):
+        for i, j in enumerate(idx):
+            sums[i] += row[j] or 0.0
+        count += 1
+        yield list(row)
+    totals = [None] * len(columns)
+    totals[0], totals[1] = "TOTAL", count
+    for i, j in enumerate(idx):
+        totals[j] = round(sums[i], 2)
+    yield totals
+
+
+def _iter_csv(rows: Iterator[list]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # BOM: Excel פותח UTF-8 עם קירילית נכון רק איתו
+    buf.write("\ufeff")
+    writer.writerow([title for _, title in REGISTER_COLUMNS])
+    for n, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if n % CHUNK_ROWS == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def _iter_xlsx(rows: Iterator[list]) -> Iterator[bytes]:
+    """
+    openpyxl write-only: rows go straight to the worksheet's temp XML file, so
+    memory stays flat. A zip can only be sent once it's complete, so the
+    workbook is saved to a temp file and streamed from there in chunks.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Register")
+    ws.append([title for _, title in REGISTER_COLUMNS])
+    for row in rows:
+        ws.append(row)
+    with tempfile.TemporaryFile() as f:
+        wb.save(f)
+        f.seek(0)
+        while chunk := f.read(XLSX_CHUNK_BYTES):
+            yield chunk
+
+
+@router.get("/register")
+def invoice_register(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    supplier: Optional[str] = Query(None, description="SupplierCompanyID or VAT"),
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+):
+    """Invoice register for a period (month-end VAT reporting), streamed as CSV or XLSX."""
+    rows = _rows(date_from, date_to, supplier)
+    name = "register_{}_{}.{}".format(date_from or "start", date_to or "end", format)
+    body, media_type = (_iter_csv(rows), "text/csv; charset=utf-8") if format == "csv" else (_iter_xlsx(rows), XLSX_MIME)
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
@@ -0,0 +1,202 @@
+# resilience.py
+"""
+Circuit breakers and hedged requests for the external dependencies
+(Google Translate, exchangerate.host, Drive, OpenAI).
+
+A breaker opens after BREAKER_FAILURES consecutive failures and then fails
+fast (CircuitOpen) instead of letting every invoice wait out the timeouts;
+after BREAKER_RESET_SEC one probe call is let through (half-open) and its
+result closes or re-opens it. Breakers live in each worker's memory — a
+dependency that is down is noticed by every worker within a few calls, and
+the transitions are counted in the shared metrics.
+
+For idempotent GETs, hedged() sends a second identical request when the
+first hasn't answered within the dependency's recent p95 latency and takes
+whichever answers first.
+
+Callers that fall back (cached value, untranslated text) report it with
+degraded(); _process_invoice collects those notes into the response errors.
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SEC = float(os.getenv("BREAKER_RESET_SEC", "30"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") == "1"
+# p95 מחושב רק כשיש מספיק מדידות; לפני כן אין בקשה שנייה
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+LATENCY_WINDOW = 200
+
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_WORKERS", "8")), thread_name_prefix="hedge")
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+def _count(name: str) -> None:
+    try:
+        import metrics
+        metrics.incr(name)
+    except Exception:
+        pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET_SEC):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self._opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        """True if a call may go out now (closed, or the single half-open probe)."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok: bool, seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._probing = False
+            if ok:
+                if seconds is not None:
+                    self._latencies.append(seconds)
+                if self._opened_at is not None:
+                    _count(f"breaker_{self.name}_closed")
+                self._consecutive, self._opened_at = 0, None
+                return
+            self._consecutive += 1
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                if self._opened_at is None:
+                    _count(f"breaker_{self.name}_opened")
+                self._opened_at = time.monotonic()      # a failed probe re-opens for another period
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _attempt(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        t0 = time.perf_counter()
+        try:
+            value = fn(*args, **kwargs)
+        except Exception:
+            self.record(False)
+            raise
+        self.record(True, time.perf_counter() - t0)
+        return value
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """fn(*args, **kwargs) through the breaker; CircuitOpen without calling when open."""
+        if not self.allow():
+            _count(f"breaker_{self.name}_rejected")
+            raise CircuitOpen(f"{self.name} is unavailable (circuit open)")
+        return self._attempt(fn, *args, **kwargs)
+
+    def hedged(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Like call(), but when the first attempt is slower than the recent p95
+        a second one is started and the first successful answer wins. Only
+        for idempotent requests. The loser keeps running until its own
+        timeout; its result is ignored.
+        """
+        if not self.allow():
+            _count(f"breaker_{self.name}_rejected")
+            raise CircuitOpen(f"{self.name} is unavailable (circuit open)")
+        delay = self.p95() if HEDGE_ENABLED and self.state == "closed" else None
+        if delay is None:
+            return self._attempt(fn, *args, **kwargs)
+
+        first = _hedge_pool.submit(self._attempt, fn, *args, **kwargs)
+        done, _ = wait([first], timeout=max(delay, HEDGE_MIN_DELAY_MS / 1000))
+        if done:
+            return first.result()
+        _count(f"hedge_{self.name}_sent")
+        pending = {first, _hedge_pool.submit(self._attempt, fn, *args, **kwargs)}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is not first:
+                        _count(f"hedge_{self.name}_won")
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    def snapshot(self) -> dict:
+        p95 = self.p95()
+        with self._lock:
+            return {
+                "state": self._state(),
+                "consecutive_failures": self._consecutive,
+                "samples": len(self._latencies),
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+
+
+BREAKERS: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in BREAKERS:
+            BREAKERS[name] = CircuitBreaker(name)
+        return BREAKERS[name]
+
+
+def snapshot() -> dict:
+    """State of this worker's breakers (for /metrics)."""
+    return {name: b.snapshot() for name, b in sorted(BREAKERS.items())}
+
+
+# ---------------------------
+# Degraded results of the current request
+# ---------------------------
+_notes: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("degraded_notes", default=None)
+
+
+@contextmanager
+def collect():
+    """Collects degraded() notes raised by this request (also from its stage threads, which copy the context)."""
+    notes: list[str] = []
+    token = _notes.set(notes)
+    try:
+        yield notes
+    finally:
+        _notes.reset(token)
+
+
+def degraded(message: str) -> None:
+    notes = _notes.get()
+    if notes is not None and message not in notes:
+        notes.append(message)
@@ -0,0 +1,176 @@
+# responses.py
+"""
+How JSON goes on the wire. FastJSONResponse (the app's default response
+class) serialises with orjson: several times faster than json.dumps, NaN /
+inf become null instead of a 500, numpy scalars are handled natively.
+json_with_raw splices a value that is already JSON (DataFrame.to_json) into
+the envelope without decoding it again.
+
+CompressionMiddleware compresses responses of COMPRESS_MIN_BYTES and more
+with brotli when the client accepts it and the module is installed, else
+gzip; files that are already compressed (PDF, DOCX, XLSX) are sent as is.
+"""
+import os
+import zlib
+from typing import Any, Callable, Optional
+
+import anyio.to_thread
+from fastapi.responses import JSONResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# רמה 6 / quality 4: כמעט אותו יחס דחיסה כמו המקסימום, בחלק מזמן ה-CPU
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+THREAD_MIN_BYTES = 128 * 1024       # larger chunks are compressed off the event loop
+# prefixes of media types that are already compressed (or streamed as events)
+EXCLUDED_CONTENT_TYPES = (
+    "application/pdf",
+    "application/octet-stream",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/grpc",
+    "application/vnd.openxmlformats-officedocument.",
+    "text/event-stream",
+    "image/",
+    "audio/",
+    "video/",
+    "font/woff",
+)
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is None:  # pragma: no cover
+        return JSONResponse(content).body
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_with_raw(content: dict, key: str, raw: bytes, status_code: int = 200) -> Response:
+    """`content` plus content[key] = raw, where raw is already serialised JSON."""
+    head = dumps(content)[:-1]
+    body = head + (b"," if len(head) > 1 else b"") + dumps(key) + b":" + raw + b"}"
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+def _accepts(header: str, coding: str) -> bool:
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() == coding:
+            q = params.strip()
+            try:
+                return not q.startswith("q=") or float(q[2:]) > 0
+            except ValueError:
+                return True
+    return False
+
+
+def _compressor(coding: str, gzip_level: int, brotli_quality: int) -> Callable[[bytes, bool], bytes]:
+    """compress(chunk, more_body) for one response body."""
+    if coding == "br":
+        br = brotli.Compressor(quality=brotli_quality)
+        # flush בכל chunk: דוח CSV שנשלח בזרם מגיע ללקוח בלי לחכות לסוף
+        return lambda body, more: br.process(body) + (br.flush() if more else br.finish())
+    gz = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return lambda body, more: gz.compress(body) + gz.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    brotli (when installed and accepted) or gzip for bodies of minimum_size
+    and more. Plain ASGI on top of Starlette's public Headers only, so a
+    Starlette upgrade can't break it.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES, compresslevel: int = GZIP_LEVEL,
+                 brotli_quality: int = BROTLI_QUALITY) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        coding = None
+        if scope["type"] == "http":
+            accept = Headers(scope=scope).get("Accept-Encoding", "")
+            if brotli is not None and _accepts(accept, "br"):
+                coding = "br"
+            elif _accepts(accept, "gzip"):
+                coding = "gzip"
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(self, coding, send))
+
+
+class _CompressingSend:
+    """The `send` of one response: holds back the headers until the first body chunk decides."""
+
+    def __init__(self, mw: CompressionMiddleware, coding: str, send: Send) -> None:
+        self.mw = mw
+        self.coding = coding
+        self.send = send
+        self.start: Optional[Message] = None
+        self.passthrough = False
+        self.compress: Optional[Callable[[bytes, bool], bytes]] = None
+
+    async def __call__(self, message: Message) -> None:
+        kind = message["type"]
+        if kind == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+            self.passthrough = ("content-encoding" in headers or message["status"] == 206
+                                or media_type.startswith(EXCLUDED_CONTENT_TYPES))
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start = message
+            return
+        if kind != "http.response.body" or self.passthrough:
+            if self.start is not None:           # e.g. pathsend: headers go out unchanged
+                await self.send(self.start)
+                self.start = None
+            await self.send(message)
+            return
+
+        body, more = message.get("body", b""), message.get("more_body", False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            if len(body) < self.mw.minimum_size and not more:
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            self.compress = _compressor(self.coding, self.mw.compresslevel, self.mw.brotli_quality)
+            body = await self._compress(body, more)
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            headers["Content-Encoding"] = self.coding
+            if more or start.get("trailers", False):
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self.send(start)
+        else:
+            body = await self._compress(body, more)
+        await self.send({**message, "body": body})
+
+    async def _compress(self, body: bytes, more: bool) -> bytes:
+        if len(body) >= THREAD_MIN_BYTES:
+            return await anyio.to_thread.run_sync(self.compress, body, more)
+        return self.compress(body, more)
@@ -0,0 +1,166 @@
+# shared_state.py
+"""
+State shared by all worker processes on a node: a small SQLite database in
+WAL mode (readers never block the single writer). Holds cross-process caches
+(FX rates, translations), monotonic counters (invoice numbers) and
+idempotency records for /process-invoice/. A write by one worker is
+immediately visible to all others, so nothing needs an explicit
+invalidation message.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Optional
+
+STATE_DB = os.getenv("STATE_DB", "/app/data/state.db")
+os.makedirs(os.path.dirname(os.path.abspath(STATE_DB)), exist_ok=True)
+# כל כמה זמן כל worker מוחק רשומות cache שפג תוקפן (אחרת state.db רק גדל)
+STATE_PURGE_SEC = float(os.getenv("STATE_PURGE_SEC", "600"))
+
+_local = threading.local()
+_last_purge = 0.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    ns      TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    value   TEXT NOT NULL,
+    expires REAL,
+    PRIMARY KEY (ns, key)
+);
+CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires) WHERE expires IS NOT NULL;
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS idempotency (
+    key         TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status      TEXT NOT NULL,          -- 'running' | 'done'
+    http_status INTEGER,
+    body        TEXT,
+    updated     REAL NOT NULL,
+    reserved    INTEGER                  -- invoice number allocated by this key's (failed) attempt
+);
+CREATE INDEX IF NOT EXISTS ix_idempotency_updated ON idempotency (updated);
+"""
+
+
+def connect(path: Optional[str] = None, schema: Optional[str] = None) -> sqlite3.Connection:
+    """
+    One autocommit WAL connection per thread and database file (sqlite3
+    connections aren't thread-safe). Other modules pass their own path and
+    schema to reuse the same setup for their databases.
+    """
+    if path is None:
+        path, schema = STATE_DB, _SCHEMA
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if schema:
+            conn.executescript(schema)
+        if schema is _SCHEMA:
+            _upgrade(conn)
+        conns[path] = conn
+    return conn
+
+
+def _upgrade(conn: sqlite3.Connection) -> None:
+    """Columns added after a table was first created (CREATE TABLE IF NOT EXISTS keeps the old shape)."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(idempotency)")}
+    if "reserved" not in cols:
+        try:
+            conn.execute("ALTER TABLE idempotency ADD COLUMN reserved INTEGER")
+        except sqlite3.OperationalError:
+            pass            # another worker added it first
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """BEGIN IMMEDIATE ... COMMIT — takes the write lock up front so read-modify-write is atomic."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# ---------------------------
+# Cache
+# ---------------------------
+def cache_get(ns: str, key: str, default: Any = None) -> Any:
+    row = connect().execute(
+        "SELECT value, expires FROM cache WHERE ns = ? AND key = ?", (ns, key)
+    ).fetchone()
+    if row is None or (row[1] is not None and row[1] < time.time()):
+        return default
+    return json.loads(row[0])
+
+
+def cache_set(ns: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+    expires = time.time() + ttl if ttl else None
+    connect().execute(
+        "INSERT OR REPLACE INTO cache (ns, key, value, expires) VALUES (?, ?, ?, ?)",
+        (ns, key, json.dumps(value, ensure_ascii=False), expires),
+    )
+    if expires is not None:
+        maybe_purge()
+
+
+def purge_expired(now: Optional[float] = None) -> int:
+    """Deletes cache rows past their TTL (TTLs are otherwise only checked on read); returns how many."""
+    return connect().execute("DELETE FROM cache WHERE expires < ?", (now or time.time(),)).rowcount
+
+
+def maybe_purge() -> None:
+    """purge_expired at most every STATE_PURGE_SEC per worker (called from the write paths)."""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge >= STATE_PURGE_SEC:
+        _last_purge = now
+        purge_expired(now)
+
+
+def cache_clear(ns: str) -> None:
+    connect().execute("DELETE FROM cache WHERE ns = ?", (ns,))
+
+
+# ---------------------------
+# Counters
+# ---------------------------
+def next_counter(name: str, floor: int = 0) -> int:
+    """
+    Atomically allocates the next value of a counter across all workers.
+    `floor` seeds/raises the counter (e.g. the number already stored in the
+    supplier xlsx), so the result is always > max(stored, floor).
+    """
+    with transaction(connect()) as conn:
+        row = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        value = max(row[0] if row else 0, int(floor)) + 1
+        conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, value))
+    return value
+
+
+def release_counter(name: str, value: int) -> bool:
+    """Gives back `value` if nothing was allocated after it (keeps numbering gap-free on failure)."""
+    with transaction(connect()) as conn:
+        cur = conn.execute(
+            "UPDATE counters SET value = value - 1 WHERE name = ? AND value = ?", (name, int(value))
+        )
+        return cur.rowcount == 1
+
+
+def counter_value(name: str) -> int:
+    row = connect().execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
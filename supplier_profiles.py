@@ -0,0 +1,329 @@
+# supplier_profiles.py
+"""
+Per-supplier extraction profiles learned from /ai/feedback corrections.
+
+Most invoices come from a stable set of suppliers whose PDFs always share a
+layout. From the corrected payloads and the text they were parsed from we
+learn, per supplier, the label in front of each key field (invoice number,
+issue date, totals) and the column layout of the line table. /ai/parse
+finds the profile by the supplier's VAT / IBAN in the text and applies it
+before any model call; a profile that doesn't fully match is skipped.
+"""
+import os
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import feedback_store
+from feedback_store import normalize_vat
+from pdf_tables import to_float
+
+PROFILE_MIN_SAMPLES = int(os.getenv("PROFILE_MIN_SAMPLES", "2"))
+PROFILE_CONFIDENCE = 0.9
+
+# מספרים בלי רווחים: בטבלת השורות העמודות מופרדות ברווחים
+NUM_RE = r"-?\d[\d.,]*\d|\d"
+INVOICE_NO_RE = r"[A-Za-z0-9][A-Za-z0-9\-/.]*[A-Za-z0-9]|[A-Za-z0-9]"
+DATE_FORMATS = {
+    "%d.%m.%Y": r"\d{2}\.\d{2}\.\d{4}",
+    "%Y-%m-%d": r"\d{4}-\d{2}-\d{2}",
+    "%d/%m/%Y": r"\d{2}/\d{2}/\d{4}",
+}
+AMOUNT_FIELDS = ("grand_total", "subtotal", "tax_total")
+FIELDS = ("invoice_number", "issue_date") + AMOUNT_FIELDS
+REQUIRED = ("invoice_number", "issue_date", "grand_total")
+LABEL_WORDS = 3
+_SEP = r"[\s:#№]*"
+_NUM = re.compile(NUM_RE)
+
+_cache: tuple = (None, [])   # (profiles signature, [(keys, supplier_vat, profile, compiled)])
+
+
+def _norm_key(value: Optional[str]) -> Optional[str]:
+    return re.sub(r"\s+", "", value).upper() if value else None
+
+
+# ---------------------------
+# Learning
+# ---------------------------
+def _expected(payload: Dict[str, Any], field: str) -> Any:
+    if field in AMOUNT_FIELDS:
+        v = (payload.get("totals") or {}).get(field)
+        return float(v) if v else None      # 0.0 is too ambiguous to anchor on
+    v = payload.get(field)
+    return str(v)[:10] if field == "issue_date" and v else (v or None)
+
+
+def _same(field: str, got: Any, want: Any) -> bool:
+    if got is None or want is None:
+        return False
+    if field in AMOUNT_FIELDS:
+        return abs(float(got) - float(want)) < 0.005
+    return str(got) == str(want)
+
+
+def _label_before(text: str, start: int) -> str:
+    """Last words in front of a value on its line (or the previous line when the value stands alone)."""
+    line_start = text.rfind("\n", 0, start) + 1
+    label = text[line_start:start].rstrip(" \t:#№")
+    if not label.strip():
+        prev = text[:line_start].rstrip()
+        label = prev[prev.rfind("\n") + 1:]
+    return " ".join(label.split()[-LABEL_WORDS:])
+
+
+def _occurrences(field: str, want: Any, text: str) -> list[tuple[int, str, Optional[str]]]:
+    """(position, value regex, date format) for every place the corrected value appears in the text."""
+    if field in AMOUNT_FIELDS:
+        return [(m.start(), NUM_RE, None) for m in _NUM.finditer(text) if _same(field, to_float(m.group()), want)]
+    if field == "issue_date":
+        try:
+            d = datetime.strptime(want, "%Y-%m-%d")
+        except ValueError:
+            return []
+        return [
+            (m.start(), rx, fmt)
+            for fmt, rx in DATE_FORMATS.items()
+            for m in re.finditer(re.escape(d.strftime(fmt)), text)
+        ]
+    return [(m.start(), INVOICE_NO_RE, None) for m in re.finditer(rf"(?<!\w){re.escape(want)}(?!\w)", text)]
+
+
+def _pattern(label: str, value_re: str) -> str:
+    words = r"\s+".join(re.escape(w) for w in label.split())
+    return rf"(?<!\w){words}{_SEP}({value_re})"
+
+
+def _convert(field: str, raw: str, fmt: Optional[str]) -> Any:
+    if field in AMOUNT_FIELDS:
+        return to_float(raw)
+    if field == "issue_date":
+        try:
+            return datetime.strptime(raw, fmt).date().isoformat()
+        except (TypeError, ValueError):
+            return None
+    return raw
+
+
+def _learn_field(field: str, samples: list[tuple[Dict[str, Any], str]]) -> Optional[Dict[str, Any]]:
+    """The anchor that re-extracts the corrected value from the most samples (and from at least half of them)."""
+    known = [(_expected(p, field), t) for p, t in samples]
+    known = [(want, t) for want, t in known if want is not None]
+    if not known:
+        return None
+    candidates: Counter = Counter()
+    for want, text in known:
+        for pos, value_re, fmt in _occurrences(field, want, text):
+            label = _label_before(text, pos)
+            if label:
+                candidates[(_pattern(label, value_re), fmt)] += 1
+
+    best, best_score = None, 0
+    for (pattern, fmt), _ in candidates.most_common():
+        rx = re.compile(pattern)
+        score = 0
+        for want, text in known:
+            m = rx.search(text)
+            score += bool(m) and _same(field, _convert(field, m.group(1), fmt), want)
+        if score > best_score:
+            best, best_score = {"pattern": pattern, "format": fmt}, score
+    if best_score >= min(PROFILE_MIN_SAMPLES, len(known)) and best_score * 2 >= len(known):
+        return best
+    return None
+
+
+def _line_layout(numbers: list[Optional[float]], line: Dict[str, Any]) -> Optional[tuple]:
+    """(column count, quantity idx, unit_price idx, line_total idx or None) for one corrected row."""
+    qty, price, total = line.get("quantity"), line.get("unit_price"), line.get("line_total")
+    if qty is None or price is None:
+        return None
+    used: list[int] = []
+
+    def col(v):
+        i = next((i for i, n in enumerate(numbers) if i not in used and n is not None and abs(n - float(v)) < 0.005), None)
+        if i is not None:
+            used.append(i)
+        return i
+
+    q, p = col(qty), col(price)
+    if q is None or p is None:
+        return None
+    # line_total בסכמה כולל מס; אם בטבלה מופיע רק נטו — ServiceLine יחשב אותו
+    t = col(total) if total is not None else None
+    return (len(numbers), q, p, t)
+
+
+def _learn_lines(samples: list[tuple[Dict[str, Any], str]]) -> Optional[Dict[str, Any]]:
+    layouts: Counter = Counter()
+    rates: Counter = Counter()
+    headers: Counter = Counter()
+    seen = 0
+    for payload, text in samples:
+        rows = [r.strip() for r in text.splitlines() if r.strip()]
+        for k, line in enumerate(payload.get("service_lines") or []):
+            desc = (line.get("description") or "").strip()
+            idx = next((i for i, r in enumerate(rows) if desc and desc in r), None)
+            if idx is None:
+                continue
+            row = rows[idx]
+            if k == 0 and idx > 0:
+                headers[rows[idx - 1]] += 1     # the table's header row
+            seen += 1
+            tail = row[row.index(desc) + len(desc):]
+            layout = _line_layout([to_float(n) for n in _NUM.findall(tail)], line)
+            if layout:
+                layouts[layout] += 1
+                rates[float(line.get("tax_rate") or 0.0)] += 1
+    if not layouts:
+        return None
+    (n, q, p, t), count = layouts.most_common(1)[0]
+    if count * 2 < seen:
+        return None
+    header, hits = headers.most_common(1)[0] if headers else (None, 0)
+    return {
+        "columns": n, "quantity": q, "unit_price": p, "line_total": t,
+        "tax_rate": rates.most_common(1)[0][0],
+        "header": header if hits * 2 >= sum(headers.values()) else None,
+    }
+
+
+def learn(supplier_vat: str) -> Optional[Dict[str, Any]]:
+    """
+    (Re)builds the profile of one supplier from its corrections. Drops the
+    stored profile when the required fields can no longer be anchored
+    (e.g. the supplier changed its layout).
+    """
+    samples = feedback_store.training_samples(supplier_vat)
+    if len(samples) < PROFILE_MIN_SAMPLES:
+        return None
+    fields = {f: rule for f in FIELDS if (rule := _learn_field(f, samples))}
+    if any(f not in fields for f in REQUIRED):
+        feedback_store.delete_profile(supplier_vat)
+        return None
+
+    latest = samples[0][0]
+    keys = {normalize_vat(supplier_vat)}
+    keys.update(_norm_key((p.get("supplier") or {}).get("iban")) for p, _ in samples)
+    currencies = Counter((p.get("currency") or "EUR").upper() for p, _ in samples)
+    profile = {
+        "fields": fields,
+        "lines": _learn_lines(samples),
+        "currency": currencies.most_common(1)[0][0],
+        "supplier": latest.get("supplier") or {},
+    }
+    feedback_store.save_profile(supplier_vat, sorted(k for k in keys if k), profile, len(samples))
+    return profile
+
+
+# ---------------------------
+# Matching & extraction
+# ---------------------------
+def _profiles() -> list[tuple]:
+    """Compiled profiles; reloaded only when the profiles table changes (any worker)."""
+    global _cache
+    sig = feedback_store.profiles_signature()
+    if sig != _cache[0]:
+        entries = []
+        for p in feedback_store.load_profiles():
+            compiled = {f: (re.compile(r["pattern"]), r.get("format")) for f, r in p["profile"]["fields"].items()}
+            entries.append((p["keys"], p["supplier_vat"], p["profile"], compiled))
+        _cache = (sig, entries)
+    return _cache[1]
+
+
+def match(text: str) -> Optional[tuple]:
+    """The profile whose VAT / IBAN appears first in the text (the supplier block precedes the recipient)."""
+    flat = re.sub(r"\s+", "", text).upper()
+    best = None
+    for entry in _profiles():
+        for key in entry[0]:
+            pos = flat.find(key)
+            if pos >= 0 and (best is None or pos < best[0]):
+                best = (pos, entry)
+    return best[1] if best else None
+
+
+def _extract_lines(layout: Dict[str, Any], text: str) -> list[Dict[str, Any]]:
+    """Consecutive rows with the learned column count, right after the learned header row."""
+    n = layout["columns"]
+    row_re = re.compile(rf"^(.*?[^\W\d_].*?)\s+((?:{NUM_RE})(?:\s+(?:{NUM_RE})){{{n - 1}}})$")
+    rows = [r.strip() for r in text.splitlines() if r.strip()]
+    header = layout.get("header")
+    if header:
+        if header not in rows:
+            return []
+        rows = rows[rows.index(header) + 1:]
+
+    lines = []
+    for row in rows:
+        m = row_re.match(row)
+        nums = [to_float(x) for x in _NUM.findall(m.group(2))] if m else []
+        if len(nums) != n or any(x is None for x in nums):
+            if lines:
+                break
+            continue
+        qty, price = nums[layout["quantity"]], nums[layout["unit_price"]]
+        total = nums[layout["line_total"]] if layout["line_total"] is not None else None
+        # שורה אמיתית: הסכום שווה לכמות × מחיר (נטו או כולל מס)
+        if total is not None and not any(
+            abs(total - qty * price * k) < 0.01 for k in (1.0, 1.0 + layout["tax_rate"] / 100.0)
+        ):
+            if lines:
+                break
+            continue
+        lines.append({
+            "description": m.group(1).strip(),
+            "quantity": qty,
+            "unit_price": price,
+            "tax_rate": layout["tax_rate"],
+            "line_total": total,
+        })
+    return lines
+
+
+def apply(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Deterministic extraction with the matching supplier profile. Returns an
+    Invoice-compatible payload, or None when no profile matches or any
+    required field / the line table doesn't come out cleanly.
+    """
+    entry = match(text)
+    if entry is None:
+        return None
+    _, supplier_vat, profile, compiled = entry
+
+    values: Dict[str, Any] = {}
+    for field, (rx, fmt) in compiled.items():
+        m = rx.search(text)
+        values[field] = _convert(field, m.group(1), fmt) if m else None
+    if any(values.get(f) in (None, "") for f in REQUIRED):
+        return None
+
+    lines = _extract_lines(profile["lines"], text) if profile.get("lines") else []
+    if profile.get("lines") and not lines:
+        return None
+
+    currency = profile.get("currency") or "EUR"
+    payload = {
+        "supplier": dict(profile.get("supplier") or {}),
+        "recipient": {"name": ""},
+        "invoice_number": values["invoice_number"][:64],
+        "issue_date": values["issue_date"],
+        "currency": currency,
+        "service_lines": lines,
+        "totals": {
+            "subtotal": values.get("subtotal") or 0.0,
+            "tax_total": values.get("tax_total") or 0.0,
+            "grand_total": values["grand_total"],
+            "currency": currency,
+        },
+        "extractor": "profile",
+        "extraction_confidence": PROFILE_CONFIDENCE,
+        "template_hint": f"profile:{supplier_vat}",
+    }
+    # עם טבלת שורות — הסכומים חייבים להסתדר, אחרת עדיף לתת למודל לנסות
+    from batch_validation import validate_invoice
+    if lines and validate_invoice(payload)[0]:
+        return None
+    return payload
@@ -0,0 +1,480 @@
+# supplier_registry.py
+import os
+import json
+import shutil
+import tempfile
+import threading
+from typing import Optional
+
+import pandas as pd
+
+import version_store
+
+# עמודות שה-pipeline באמת משתמש בהן — כל השאר לא נטען בכלל
+SUPPLIER_COLUMNS = [
+    "SupplierCompanyID",
+    "SupplierName",
+    "SupplierCompanyVAT",
+    "SupplierAddress",
+    "SupplierCity",
+    "SupplierContactPerson",
+    "IBAN",
+    "Bankname",
+    "BankCode",
+    "Last invoice number",
+]
+COUNTER_COLUMN = "Last invoice number"
+# שדות שמתורגמים לבולגרית פעם אחת בהעלאת גרסה ונשמרים ב-cache כ-<field>_bg
+TRANSLATED_COLUMNS = ["SupplierName", "SupplierAddress", "SupplierCity", "Bankname", "SupplierContactPerson"]
+# עמודות שה-pipeline ניגש אליהן ישירות (BankCode והמונה אופציונליים)
+REQUIRED_COLUMNS = [c for c in SUPPLIER_COLUMNS if c not in ("BankCode", COUNTER_COLUMN)]
+CACHE_SUFFIX = ".pkl"
+META_SUFFIX = ".meta.json"
+# עמודות שאפשר לחפש בהן ב-preview
+SEARCH_COLUMNS = ("SupplierCompanyID", "SupplierName", "IBAN")
+
+_lock = threading.Lock()
+_loaded: dict[str, tuple[tuple, "SupplierTable"]] = {}
+
+
+class SupplierTable:
+    """Typed, column-projected supplier frame plus a lazy SupplierCompanyID index."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.validation: Optional[dict] = None     # filled by validation() on first use
+        self._by_id: Optional[dict[str, int]] = None
+        self._search: Optional[pd.Series] = None
+        self._dup_ibans: Optional[set[str]] = None
+
+    def position(self, supplier_id: str) -> Optional[int]:
+        if self._by_id is None:
+            ids = self.df["SupplierCompanyID"] if "SupplierCompanyID" in self.df else []
+            # first occurrence wins, same as the old `df[...].iloc[0]`
+            self._by_id = {}
+            for pos, sid in enumerate(ids):
+                self._by_id.setdefault(sid, pos)
+        return self._by_id.get(str(supplier_id).strip())
+
+    def get(self, supplier_id: str) -> Optional[pd.Series]:
+        pos = self.position(supplier_id)
+        return None if pos is None else self.df.iloc[pos]
+
+    def duplicate_ibans(self) -> set[str]:
+        if self._dup_ibans is None:
+            ibans = self.df["IBAN"].str.replace(" ", "", regex=False) if "IBAN" in self.df else pd.Series([], dtype=str)
+            self._dup_ibans = set(ibans[ibans.duplicated(keep=False) & (ibans != "")])
+        return self._dup_ibans
+
+    def search_index(self) -> pd.Series:
+        if self._search is None:
+            parts = [self.df[c].str.lower() for c in SEARCH_COLUMNS if c in self.df]
+            if "IBAN" in self.df:
+                parts.append(self.df["IBAN"].str.replace(" ", "", regex=False).str.lower())
+            hay = pd.Series([""] * len(self.df), index=self.df.index, dtype=str)
+            for part in parts:
+                hay = hay + "\n" + part
+            self._search = hay
+        return self._search
+
+    def page(self, offset: int, limit: int, columns: Optional[list[str]] = None,
+             q: Optional[str] = None) -> tuple[pd.DataFrame, int]:
+        """Returns (rows[offset:offset+limit], number of matching rows)."""
+        df = self.df
+        if q:
+            df = df[_matches(self.search_index(), q)]
+        if columns:
+            df = df[columns]
+        return df.iloc[offset:offset + limit], len(df)
+
+
+def _matches(hay: pd.Series, q: str) -> pd.Series:
+    q = q.strip().lower()
+    hit = hay.str.contains(q, regex=False)
+    compact = q.replace(" ", "")
+    if compact != q:
+        hit |= hay.str.contains(compact, regex=False)
+    return hit
+
+
+def cache_path(xlsx_path: str) -> str:
+    return xlsx_path + CACHE_SUFFIX
+
+
+def _as_text(v) -> str:
+    if v is None or (isinstance(v, float) and v != v):
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        # Excel שומר מספרים כ-float: 203504721.0 -> "203504721"
+        return str(int(v))
+    return str(v).strip()
+
+
+def read_suppliers_xlsx(source) -> pd.DataFrame:
+    """
+    Reads only SUPPLIER_COLUMNS from an xlsx (path or file-like) and types them:
+    IDs/text as str (missing -> ""), the invoice counter as int64.
+    """
+    df = pd.read_excel(source, usecols=lambda c: str(c).strip() in SUPPLIER_COLUMNS, dtype=object)
+    df.columns = [str(c).strip() for c in df.columns]
+    for col in df.columns:
+        if col == COUNTER_COLUMN:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("int64")
+        else:
+            df[col] = df[col].map(_as_text).astype(str)
+    return df.reset_index(drop=True)
+
+
+def add_translations(df: pd.DataFrame, translate) -> pd.DataFrame:
+    """
+    Adds <field>_bg columns for TRANSLATED_COLUMNS. `translate` takes a list of
+    strings and returns translations (None where unavailable); all unique
+    values are sent in one call so the API batches them.
+    """
+    fields = [c for c in TRANSLATED_COLUMNS if c in df]
+    uniq = list(dict.fromkeys(v for c in fields for v in df[c] if v))
+    if not uniq:
+        return df
+    mapping = {src: tr for src, tr in zip(uniq, translate(uniq)) if tr}
+    if not mapping:
+        # אין תרגום זמין (אין API key וכו') — לא שומרים עמודות ריקות
+        return df
+    df = df.copy()
+    for c in fields:
+        df[c + "_bg"] = df[c].map(lambda v: mapping.get(v, "")).astype(str)
+    return df
+
+
+def _signature(xlsx_path: str) -> tuple:
+    st = os.stat(xlsx_path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def build_cache(xlsx_path: str, df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Converts a supplier xlsx into its compact on-disk cache (pickled typed frame
+    next to the xlsx). Called once per version at upload time.
+    """
+    if df is None:
+        df = read_suppliers_xlsx(xlsx_path)
+    _write_pickle(xlsx_path, df)
+    with _lock:
+        _loaded[xlsx_path] = (_signature(xlsx_path), SupplierTable(df))
+    return df
+
+
+def _write_pickle(xlsx_path: str, df: pd.DataFrame) -> None:
+    tmp = cache_path(xlsx_path) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+    df.to_pickle(tmp)
+    os.replace(tmp, cache_path(xlsx_path))
+
+
+def _read_fresh_cache(xlsx_path: str) -> Optional[pd.DataFrame]:
+    pkl = cache_path(xlsx_path)
+    if os.path.exists(pkl) and os.path.getmtime(pkl) >= os.path.getmtime(xlsx_path):
+        try:
+            return pd.read_pickle(pkl)
+        except Exception:
+            return None
+    return None
+
+
+def _translated_xlsx(xlsx_path: str) -> pd.DataFrame:
+    """Re-reads the xlsx with the *_bg columns the upload precomputes (translate_many hits the shared cache)."""
+    from process import translate_many
+    return add_translations(read_suppliers_xlsx(xlsx_path), translate_many)
+
+
+def _load_table(xlsx_path: str) -> SupplierTable:
+    sig = _signature(xlsx_path)
+    with _lock:
+        hit = _loaded.get(xlsx_path)
+    if hit and hit[0] == sig:
+        return hit[1]
+
+    df = _read_fresh_cache(xlsx_path)
+    if df is None:
+        # גרסה ישנה בלי cache (או cache פגום / ישן). הקריאה והתרגום (רשת) מחוץ לנעילה;
+        # תחת הנעילה רק כתיבת ה-pickle — ואם worker אחר כבר בנה cache עדכני, משתמשים בו
+        fresh = _translated_xlsx(xlsx_path)
+        with version_store.locked():
+            df = _read_fresh_cache(xlsx_path)
+            if df is None:
+                if _signature(xlsx_path) != sig:
+                    fresh = _translated_xlsx(xlsx_path)     # the counter moved meanwhile; translations are cached now
+                df = build_cache(xlsx_path, fresh)
+    table = SupplierTable(df)
+    with _lock:
+        _loaded[xlsx_path] = (sig, table)
+    return table
+
+
+def load_suppliers(xlsx_path: str) -> pd.DataFrame:
+    """Lazily returns the typed supplier frame for a version (memory -> pickle -> xlsx)."""
+    return _load_table(xlsx_path).df
+
+
+def find_supplier(xlsx_path: str, supplier_id: str) -> Optional[pd.Series]:
+    return _load_table(xlsx_path).get(supplier_id)
+
+
+def validation(xlsx_path: str) -> dict:
+    """The version's validation report, read (or computed) once per loaded table."""
+    table = _load_table(xlsx_path)
+    if table.validation is None:
+        table.validation = ensure_validated(xlsx_path, table.df)["validation"]
+    return table.validation
+
+
+def has_duplicate_iban(xlsx_path: str, iban: str) -> bool:
+    """True if the version failed validation and this IBAN belongs to more than one supplier."""
+    if validation(xlsx_path)["valid"]:
+        return False
+    return iban.replace(" ", "") in _load_table(xlsx_path).duplicate_ibans()
+
+
+def is_loaded(xlsx_path: str) -> bool:
+    """True if this version is already parsed in this process (no disk read on the next lookup)."""
+    with _lock:
+        hit = _loaded.get(xlsx_path)
+    return bool(hit) and hit[0] == _signature(xlsx_path)
+
+
+def is_warm(xlsx_path: str) -> bool:
+    """True if the version is in memory or has an up-to-date on-disk cache."""
+    if is_loaded(xlsx_path):
+        return True
+    pkl = cache_path(xlsx_path)
+    return os.path.exists(pkl) and os.path.getmtime(pkl) >= os.path.getmtime(xlsx_path)
+
+
+def page_suppliers(xlsx_path: str, offset: int = 0, limit: int = 50,
+                   columns: Optional[list[str]] = None, q: Optional[str] = None,
+                   as_json: bool = False) -> dict:
+    """
+    One page of a supplier version. Warm versions are served from the cached
+    frame and its search index; cold versions are streamed with a read-only
+    openpyxl iterator that stops as soon as the page is full, so nothing is
+    converted or cached just for a preview.
+    With as_json, "data" is the rows already serialised as a JSON array
+    (straight from the frame, no per-row dicts) for responses.json_with_raw.
+    """
+    if is_warm(xlsx_path):
+        table = _load_table(xlsx_path)
+        available = [c for c in table.df.columns if c in SUPPLIER_COLUMNS]
+        _check_columns(columns, available)
+        rows, matched = table.page(offset, limit, columns or available, q)
+        return {
+            "columns": columns or available,
+            "rows": len(table.df),
+            "matched": matched,
+            "has_more": offset + len(rows) < matched,
+            "data": rows.to_json(orient="records", force_ascii=False).encode() if as_json else rows.to_dict(orient="records"),
+        }
+    page = _stream_page(xlsx_path, offset, limit, columns, q)
+    if as_json:
+        from responses import dumps
+        page["data"] = dumps(page["data"])
+    return page
+
+
+def _check_columns(columns: Optional[list[str]], available: list[str]) -> None:
+    unknown = [c for c in columns or [] if c not in available]
+    if unknown:
+        raise KeyError(", ".join(unknown))
+
+
+def _stream_page(xlsx_path: str, offset: int, limit: int,
+                 columns: Optional[list[str]], q: Optional[str]) -> dict:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        it = ws.iter_rows(values_only=True)
+        header = [str(c).strip() if c is not None else "" for c in next(it, ())]
+        keep = [(i, h) for i, h in enumerate(header) if h in SUPPLIER_COLUMNS]
+        available = [h for _, h in keep]
+        _check_columns(columns, available)
+        if columns:
+            keep = [(i, h) for i, h in keep if h in columns]
+        search = [i for i, h in enumerate(header) if h in SEARCH_COLUMNS]
+        iban_idx = header.index("IBAN") if "IBAN" in header else None
+        needle = q.strip().lower() if q else None
+
+        data, matched, has_more = [], 0, False
+        for values in it:
+            if values is None or all(v is None for v in values):
+                continue
+            if needle:
+                hay = "\n".join(_as_text(values[i]).lower() for i in search if i < len(values))
+                if iban_idx is not None and iban_idx < len(values):
+                    hay += "\n" + _as_text(values[iban_idx]).replace(" ", "").lower()
+                if needle not in hay and needle.replace(" ", "") not in hay:
+                    continue
+            matched += 1
+            if matched <= offset:
+                continue
+            if len(data) == limit:
+                has_more = True
+                break
+            data.append({h: _typed(h, values[i] if i < len(values) else None) for i, h in keep})
+        total = max((ws.max_row or 1) - 1, 0)
+    finally:
+        wb.close()
+    return {
+        "columns": columns or available,
+        "rows": total,
+        # בלי סריקה מלאה אי אפשר לדעת כמה תוצאות יש בסך הכל
+        "matched": None if has_more else matched,
+        "has_more": has_more,
+        "data": data,
+    }
+
+
+def _typed(col: str, v):
+    if col == COUNTER_COLUMN:
+        try:
+            return int(float(v))
+        except (TypeError, ValueError):
+            return 0
+    return _as_text(v)
+
+
+def set_last_invoice_number(xlsx_path: str, supplier_id: str, number: int) -> None:
+    """
+    Writes the counter back into the xlsx (all other columns and formatting
+    are preserved) and refreshes the cache to match. The value only ever
+    moves forward, and the write is serialised across workers.
+    """
+    _load_table(xlsx_path)          # a cold version is read (and translated) before the lock
+    with version_store.locked():
+        _write_counter(xlsx_path, str(supplier_id).strip(), int(number))
+
+
+def _write_counter(xlsx_path: str, sid: str, number: int) -> None:
+    from openpyxl import load_workbook
+
+    df = _load_table(xlsx_path).df.copy()
+
+    wb = load_workbook(xlsx_path)
+    ws = wb.active
+    header = [str(c.value).strip() if c.value is not None else "" for c in ws[1]]
+    if "SupplierCompanyID" not in header:
+        raise KeyError("SupplierCompanyID column missing")
+    id_col = header.index("SupplierCompanyID") + 1
+    if COUNTER_COLUMN in header:
+        num_col = header.index(COUNTER_COLUMN) + 1
+    else:
+        num_col = len(header) + 1
+        ws.cell(row=1, column=num_col, value=COUNTER_COLUMN)
+    for row in range(2, ws.max_row + 1):
+        if _as_text(ws.cell(row=row, column=id_col).value) == sid:
+            cell = ws.cell(row=row, column=num_col)
+            cell.value = max(_typed(COUNTER_COLUMN, cell.value), number)
+
+    if COUNTER_COLUMN not in df:
+        df[COUNTER_COLUMN] = 0
+    hit = df["SupplierCompanyID"] == sid
+    df.loc[hit, COUNTER_COLUMN] = df.loc[hit, COUNTER_COLUMN].clip(lower=number)
+
+    # קובץ זמני באותה תיקייה ו-rename: worker אחר לא קורא אף פעם xlsx חצי כתוב.
+    # ה-pickle נכתב לפני ה-rename, כך שה-mtime של ה-xlsx (של הקובץ הזמני) לא עולה עליו
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(xlsx_path)), suffix=".xlsx.tmp")
+    os.close(fd)
+    try:
+        shutil.copymode(xlsx_path, tmp)
+        wb.save(tmp)
+        _write_pickle(xlsx_path, df)
+        os.replace(tmp, xlsx_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    with _lock:
+        _loaded[xlsx_path] = (_signature(xlsx_path), SupplierTable(df))
+
+
+# ---------------------------
+# Upload-time validation / diff
+# ---------------------------
+def validate_suppliers(df: pd.DataFrame) -> dict:
+    """
+    Single vectorised pass over a typed supplier frame. Errors block the
+    version from becoming current; warnings are only reported.
+    """
+    errors: list[str] = []
+    warnings: list[str] = []
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        errors.append(f"Missing required columns: {', '.join(missing)}")
+
+    if "SupplierCompanyID" in df:
+        ids = df["SupplierCompanyID"]
+        empty = ids == ""
+        if empty.any():
+            errors.append(f"Missing SupplierCompanyID in {int(empty.sum())} row(s)")
+        dup = ids[ids.duplicated(keep=False) & ~empty].unique().tolist()
+        if dup:
+            errors.append(f"Duplicate SupplierCompanyID: {', '.join(dup)}")
+
+    if "IBAN" in df:
+        ibans = df["IBAN"].str.replace(" ", "", regex=False)
+        empty = ibans == ""
+        dup = df.loc[ibans.duplicated(keep=False) & ~empty, "IBAN"].unique().tolist()
+        if dup:
+            errors.append(f"Duplicate IBAN: {', '.join(dup)}")
+        if empty.any():
+            warnings.append(f"Missing IBAN in {int(empty.sum())} row(s)")
+
+    return {"valid": not errors, "errors": errors, "warnings": warnings}
+
+
+def diff_suppliers(old: Optional[pd.DataFrame], new: pd.DataFrame) -> dict:
+    """Added / removed / changed SupplierCompanyIDs between two versions (counter excluded)."""
+    if old is None or "SupplierCompanyID" not in old:
+        return {"added": new["SupplierCompanyID"].tolist(), "removed": [], "changed": []}
+    a = old.drop_duplicates("SupplierCompanyID").set_index("SupplierCompanyID")
+    b = new.drop_duplicates("SupplierCompanyID").set_index("SupplierCompanyID")
+    added = b.index.difference(a.index).tolist()
+    removed = a.index.difference(b.index).tolist()
+
+    common_cols = [c for c in b.columns if c in a.columns and c in SUPPLIER_COLUMNS and c != COUNTER_COLUMN]
+    common_ids = b.index.intersection(a.index)
+    ne = a.loc[common_ids, common_cols] != b.loc[common_ids, common_cols]
+    changed = [
+        {"SupplierCompanyID": sid, "fields": [c for c in common_cols if row[c]]}
+        for sid, row in ne[ne.any(axis=1)].iterrows()
+    ]
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def meta_path(xlsx_path: str) -> str:
+    return xlsx_path + META_SUFFIX
+
+
+def write_meta(xlsx_path: str, meta: dict) -> None:
+    tmp = meta_path(xlsx_path) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, meta_path(xlsx_path))
+
+
+def read_meta(xlsx_path: str) -> Optional[dict]:
+    try:
+        with open(meta_path(xlsx_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_validated(xlsx_path: str, df: Optional[pd.DataFrame] = None) -> dict:
+    """Validation stored with the version; computed (and stored) once for legacy versions."""
+    meta = read_meta(xlsx_path)
+    if meta is None or "validation" not in meta:
+        if df is None:
+            df = load_suppliers(xlsx_path)
+        meta = {**(meta or {}), "rows": len(df), "validation": validate_suppliers(df)}
+        write_meta(xlsx_path, meta)
+    return meta
@@ -1,95 +1,105 @@
 # suppliers_api.py
-import os, io, json, time
+import os, io, time
 from typing import Optional, List
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query
 from fastapi.responses import FileResponse
-import pandas as pd
 
-router = APIRouter(prefix="/suppliers", tags=["Suppliers"])
-
-SUPPLIERS_DIR = os.getenv("SUPPLIERS_DIR", "/app/data/suppliers")
-POINTER_FILE = os.path.join(SUPPLIERS_DIR, "current.json")
-os.makedirs(SUPPLIERS_DIR, exist_ok=True)
-
-def _list_versions() -> list[dict]:
-    items = []
-    for name in os.listdir(SUPPLIERS_DIR):
-        if name.endswith(".xlsx"):
-            path = os.path.join(SUPPLIERS_DIR, name)
-            items.append({
-                "version": name,
-                "path": path,
-                "mtime": os.path.getmtime(path)
-            })
-    items.sort(key=lambda x: x["mtime"], reverse=True)
-    return items
-
-def _get_current_path(default_fallback: Optional[str] = None) -> str:
-    if os.path.exists(POINTER_FILE):
-        try:
-            with open(POINTER_FILE, "r", encoding="utf-8") as f:
-                p = json.load(f).get("current")
-                if p and os.path.exists(p):
-                    return p
-        except Exception:
-            pass
-    if default_fallback and os.path.exists(default_fallback):
-        return default_fallback
-    # אם אין כלום עדיין — ניצור קובץ ריק מינימלי
-    empty = os.path.join(SUPPLIERS_DIR, "suppliers_empty.xlsx")
-    if not os.path.exists(empty):
-        pd.DataFrame(columns=["SupplierCompanyID"]).to_excel(empty, index=False)
-    return empty
+# supplier_registry (pandas/openpyxl) נטען רק ב-endpoints שקוראים את הקובץ
+from process import translate_many
+import version_store
+from pipeline import to_thread
+from responses import json_with_raw
 
-def _set_current_path(path: str) -> None:
-    with open(POINTER_FILE, "w", encoding="utf-8") as f:
-        json.dump({"current": path}, f, ensure_ascii=False, indent=2)
+router = APIRouter(prefix="/suppliers", tags=["Suppliers"])
 
 @router.post("/upload")
 async def upload_suppliers(file: UploadFile = File(...)):
     if not file.filename.lower().endswith(".xlsx"):
         raise HTTPException(400, "Please upload an .xlsx file")
-    version = time.strftime("%Y%m%d-%H%M%S") + "_" + file.filename.replace(" ", "_")
-    dst = os.path.join(SUPPLIERS_DIR, version)
     data = await file.read()
-    with open(dst, "wb") as f:
-        f.write(data)
-    # מעדכנים מצביע לגרסה הנוכחית
-    _set_current_path(dst)
-    # קוראים שורה-שתיים כדי להחזיר Preview בסיסי
+    # פרסור, תרגום (Google, עד כמה שניות) וכתיבה — ב-thread, לא על ה-event loop
+    return await to_thread(_store_version, file.filename, data)
+
+def _store_version(filename: str, data: bytes) -> dict:
+    from supplier_registry import (
+        add_translations, build_cache, diff_suppliers, load_suppliers, read_suppliers_xlsx,
+        validate_suppliers, write_meta,
+    )
+    version = time.strftime("%Y%m%d-%H%M%S") + "_" + filename.replace(" ", "_")
+    dst = version_store.version_path(version)
+    # פרסור + ולידציה לפני שנוגעים בדיסק — קובץ לא תקין לא הופך לגרסה נוכחית
     try:
-        df = pd.read_excel(dst)
-        preview = df.head(10).to_dict(orient="records")
-        columns = list(df.columns)
-        rows = len(df)
+        df = read_suppliers_xlsx(io.BytesIO(data))
     except Exception as e:
         raise HTTPException(422, f"Uploaded file is not a valid Excel: {e}")
+    validation = validate_suppliers(df)
+    if not validation["valid"]:
+        raise HTTPException(422, "Supplier file failed validation: " + "; ".join(validation["errors"]))
+
+    previous = version_store.current_path()
+    try:
+        prev_df = load_suppliers(previous) if previous else None
+    except Exception:
+        prev_df = None
+    diff = diff_suppliers(prev_df, df)
+
+    with open(dst, "wb") as f:
+        f.write(data)
+    # תרגום שדות הספק פעם אחת לגרסה — ה-hot path לא צריך לתרגם ספק מוכר
+    build_cache(dst, add_translations(df, translate_many))
+    write_meta(dst, {
+        "version": version,
+        "rows": len(df),
+        "columns": list(df.columns),
+        "validation": validation,
+        "base_version": os.path.basename(previous) if previous else None,
+        "diff": diff,
+    })
+    # מעדכנים מצביע לגרסה הנוכחית ומנקים גרסאות ישנות
+    version_store.set_current(dst)
+    pruned = version_store.prune_versions()
     return {
         "success": True,
-        "version": os.path.basename(dst),
-        "rows": rows,
-        "columns": columns,
-        "preview": preview
+        "version": version,
+        "rows": len(df),
+        "columns": list(df.columns),
+        "warnings": validation["warnings"],
+        "diff": {k: len(v) for k, v in diff.items()},
+        "pruned": pruned,
+        "preview": df.head(10).to_dict(orient="records")
     }
 
 @router.get("/preview")
-def preview(limit: int = Query(50, ge=1, le=200), version: Optional[str] = None):
-    path = _get_current_path() if not version else os.path.join(SUPPLIERS_DIR, version)
+def preview(
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    version: Optional[str] = None,
+    columns: Optional[str] = Query(None, description="Comma-separated column names"),
+    q: Optional[str] = Query(None, description="Search SupplierCompanyID / name / IBAN"),
+):
+    from supplier_registry import page_suppliers
+    path = version_store.current_path() if not version else version_store.version_path(version)
     if not os.path.exists(path):
         raise HTTPException(404, "Version not found")
-    df = pd.read_excel(path)
-    return {
+    cols = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    try:
+        page = page_suppliers(path, offset=offset, limit=limit, columns=cols, q=q, as_json=True)
+    except KeyError as e:
+        raise HTTPException(400, f"Unknown column(s): {e.args[0]}")
+    # השורות כבר JSON (DataFrame.to_json): לא עוברות שוב דרך ה-encoder של FastAPI
+    data = page.pop("data")
+    return json_with_raw({
         "success": True,
         "version": os.path.basename(path),
-        "columns": list(df.columns),
-        "rows": len(df),
-        "data": df.head(limit).to_dict(orient="records"),
-    }
+        "offset": offset,
+        "limit": limit,
+        **page,
+    }, "data", data)
 
 @router.get("/versions")
 def versions():
-    lst = _list_versions()
-    current = _get_current_path()
+    lst = version_store.list_versions()
+    current = version_store.current_path()
     return {
         "success": True,
         "current": os.path.basename(current) if current else None,
@@ -98,15 +108,28 @@ def versions():
 
 @router.post("/set-current")
 def set_current(version: str):
-    path = os.path.join(SUPPLIERS_DIR, version)
+    from supplier_registry import ensure_validated
+    path = version_store.version_path(version)
     if not os.path.exists(path):
         raise HTTPException(404, "Version not found")
-    _set_current_path(path)
+    validation = ensure_validated(path)["validation"]
+    if not validation["valid"]:
+        raise HTTPException(422, "Supplier file failed validation: " + "; ".join(validation["errors"]))
+    version_store.set_current(path)
     return {"success": True, "current": version}
 
+@router.get("/diff")
+def version_diff(version: Optional[str] = None):
+    from supplier_registry import ensure_validated
+    path = version_store.current_path() if not version else version_store.version_path(version)
+    if not os.path.exists(path):
+        raise HTTPException(404, "Version not found")
+    meta = ensure_validated(path)
+    return {"success": True, "version": os.path.basename(path), **meta}
+
 @router.get("/download")
 def download(version: Optional[str] = None):
-    path = _get_current_path() if not version else os.path.join(SUPPLIERS_DIR, version)
+    path = version_store.current_path() if not version else version_store.version_path(version)
     if not os.path.exists(path):
         raise HTTPException(404, "Version not found")
     return FileResponse(path, filename=os.path.basename(path), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import admission
+from admission import Scheduler
+from test_pdf_tables import _pdf
+
+
+pytestmark = pytest.mark.usefixtures("state_db")
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_per_client_quota_and_queue_limit():
+    async def scenario():
+        sched = Scheduler(slots=4, per_client=2, max_waiting=1, weights={"text": 1})
+        a1 = asyncio.ensure_future(sched.acquire("a", "text", 1))
+        a2 = asyncio.ensure_future(sched.acquire("a", "text", 1))
+        a3 = asyncio.ensure_future(sched.acquire("a", "text", 1))
+        b1 = asyncio.ensure_future(sched.acquire("b", "text", 1))
+        await _settle()
+        state = (a1.done(), a2.done(), a3.done(), b1.done())
+        with pytest.raises(HTTPException) as e:
+            await sched.acquire("a", "text", 1)          # one already waiting = max_waiting
+        sched.release("a")
+        await _settle()
+        return state, a3.done(), e.value.status_code
+
+    state, a3_after_release, status = asyncio.run(scenario())
+    assert state == (True, True, False, True)            # b isn't blocked by a's third job
+    assert a3_after_release and status == 429
+
+
+def test_weighted_fair_queueing_between_text_and_ocr():
+    async def scenario():
+        sched = Scheduler(slots=1, per_client=10, weights={"text": 4, "ocr": 1})
+        await sched.acquire("x", "text", 1)              # occupy the only slot
+        order = []
+
+        async def job(cls, cost):
+            await sched.acquire("y", cls, cost)
+            order.append(cls)
+
+        tasks = [asyncio.ensure_future(job("ocr", 1)) for _ in range(3)]
+        tasks += [asyncio.ensure_future(job("text", 1)) for _ in range(8)]
+        await _settle()
+        for _ in range(len(tasks) + 1):
+            sched.release("x" if not order else "y")
+            await _settle()
+        return order
+
+    order = asyncio.run(scenario())
+    assert len(order) == 11
+    # ocr gets 1 of every 5 slots while both classes wait, text doesn't starve it
+    assert order[:5].count("ocr") == 1 and order[:10].count("ocr") == 2
+
+
+def test_classify_uses_the_first_page_text_layer(tmp_path):
+    text = _pdf(tmp_path / "text.pdf", [[[(50, "Consulting services for January 2025, invoice 42, total 1000 EUR")]]])
+    scan = _pdf(tmp_path / "scan.pdf", [[], [], []])
+    assert admission.classify(open(text, "rb").read(), "text.pdf") == ("text", 1.0)
+    assert admission.classify(open(scan, "rb").read(), "scan.pdf") == ("ocr", 3.0)
+    assert admission.classify(b"not a pdf", "notes.docx") == ("text", 1.0)
+
+
+def test_client_identity_prefers_api_key_then_origin():
+    assert admission.client_id({"x-api-key": "secret", "origin": "https://a"}, "1.2.3.4").startswith("key:")
+    assert "secret" not in admission.client_id({"x-api-key": "secret"}, None)
+    assert admission.client_id({"origin": "https://a"}, "1.2.3.4") == "origin:https://a"
+    assert admission.client_id({}, "1.2.3.4") == "ip:1.2.3.4"
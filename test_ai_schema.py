@@ -0,0 +1,20 @@
+import pytest
+from pydantic import ValidationError
+
+from ai_schema import Invoice, ServiceLine
+
+
+def test_service_line_fills_tax_and_total():
+    line = ServiceLine(quantity=3, unit_price=0.335, tax_rate=20)
+    assert line.tax_amount == 0.2
+    assert line.line_total == 1.21
+    given = ServiceLine(quantity=1, unit_price=10, tax_amount=1.234, line_total=11.239)
+    assert (given.tax_amount, given.line_total) == (1.23, 11.24)
+
+
+def test_invoice_totals_currency_must_match_only_when_given():
+    assert Invoice(issue_date="2025-01-31", currency="USD").totals.currency == "EUR"
+    with pytest.raises(ValidationError):
+        Invoice(issue_date="2025-01-31", currency="USD", totals={"currency": "EUR"})
+    inv = Invoice.model_validate({"issue_date": "2025-01-31", "currency": "usd", "totals": {"currency": "USD"}})
+    assert inv.model_dump_json().startswith('{"source_file":null')
@@ -0,0 +1,67 @@
+import numpy as np
+
+from ai_schema import Invoice, run_basic_validation
+from batch_validation import bgn_amounts, cents, compute_totals, to_cents, validate_batch, validate_invoice
+
+
+def _invoice(lines, subtotal, tax_total, grand_total, **extra):
+    return {
+        "invoice_number": "INV-1",
+        "issue_date": "2025-01-31",
+        "supplier": {"name": "Alpha"},
+        "recipient": {"name": "Beta", "iban": "BG12"},
+        "service_lines": lines,
+        "totals": {"subtotal": subtotal, "tax_total": tax_total, "grand_total": grand_total, "currency": "EUR"},
+        **extra,
+    }
+
+
+def test_to_cents_is_decimal_half_up():
+    values = [1.005, 2.675, -1.005, 0.125, 1e7 + 0.005, 0.0, 0.3 * 3, 19.99 * 3]
+    assert to_cents(values).tolist()[:5] == [101, 268, -101, 13, 1000000001]
+    assert [cents(v) for v in values] == to_cents(values).tolist()
+
+
+def test_batch_matches_single_validation():
+    payloads = [
+        _invoice([{"quantity": 2, "unit_price": 10.0, "tax_rate": 20}], 20.0, 4.0, 24.0),
+        _invoice([{"quantity": 1, "unit_price": 100.0}], 90.0, 0.0, 100.0, invoice_number=""),
+        _invoice([], 0.0, 0.0, 5.0),
+    ]
+    models = [Invoice(**p) for p in payloads]
+
+    batch = validate_batch(models)
+    assert batch == [run_basic_validation(m) for m in models]
+    assert validate_batch(payloads) == batch == [validate_invoice(p) for p in payloads]
+
+    assert batch[0] == ([], ["recipient.iban looks too short"])
+    assert "Subtotal mismatch: model=90.0 computed=100.0" in batch[1][1]
+    assert batch[2][0] == ["Grand total mismatch: model=5.0 computed=0.0"]
+
+
+def test_compute_totals_groups_lines_per_invoice():
+    totals = compute_totals([
+        {"service_lines": [{"quantity": 3, "unit_price": 0.335, "tax_amount": 0.2}] * 3},
+        {"service_lines": []},
+    ])
+    assert totals["subtotal"].tolist() == [303, 0]
+    assert totals["grand_total"].tolist() == [363, 0]
+    assert totals["grand_total"].dtype == np.int64
+
+
+def test_bgn_amounts_total_is_base_plus_vat():
+    amounts = bgn_amounts([1000.0, 250.5], 1.95583, 20.0)
+    assert amounts["lines"] == [1955.83, 489.94]
+    assert amounts["base"] == 2445.77
+    assert amounts["vat"] == 489.15
+    assert amounts["total"] == 2934.92
+
+
+def test_single_invoice_validation_does_not_import_numpy():
+    import subprocess
+    import sys
+    code = ("import sys; from ai_schema import Invoice, run_basic_validation; "
+            "run_basic_validation(Invoice(invoice_number='1', issue_date='2025-01-31', "
+            "service_lines=[{'quantity': 1, 'unit_price': 1.005}])); print('numpy' in sys.modules)")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "False"
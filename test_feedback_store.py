@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import feedback_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DIR", str(tmp_path))
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DB", str(tmp_path / "feedback.db"))
+    monkeypatch.setattr(feedback_store, "_migrated", False)
+    return tmp_path
+
+
+def _payload(vat, source_hash, issue_date, number):
+    return {
+        "supplier": {"name": "Alpha", "vat_id": vat},
+        "invoice_number": number,
+        "issue_date": issue_date,
+        "source_file": f"{number}.pdf",
+        "source_hash": source_hash,
+    }
+
+
+def test_legacy_files_are_imported_once(store):
+    (store / "20250101-101500__old.pdf.json").write_text(
+        json.dumps(_payload("BG 203504721", "h0", "2024-12-30", "OLD-1")), encoding="utf-8"
+    )
+    items = feedback_store.query_feedback(supplier_vat="bg203504721")
+    assert [i["payload"]["invoice_number"] for i in items] == ["OLD-1"]
+    assert items[0]["created"] == "2025-01-01T10:15:00"
+
+    feedback_store._migrated = False
+    assert len(feedback_store.query_feedback()) == 1
+
+    # another worker (no per-process flag) on a database whose rows were all removed
+    feedback_store._db().execute("DELETE FROM feedback")
+    feedback_store._migrated = False
+    assert feedback_store.query_feedback() == []
+
+
+def test_old_unreferenced_sources_are_purged(store):
+    from datetime import datetime, timedelta
+
+    feedback_store.save_source("kept", "text of a corrected file")
+    feedback_store.save_source("orphan", "text nobody corrected")
+    feedback_store.add_feedback(_payload("BG111", "kept", "2025-01-10", "A-1"))
+
+    assert feedback_store.purge_sources() == 0          # both are still fresh
+    later = datetime.utcnow() + timedelta(days=feedback_store.SOURCES_TTL_DAYS + 1)
+    assert feedback_store.purge_sources(now=later) == 1
+    assert [p["invoice_number"] for p, _ in feedback_store.training_samples("BG111")] == ["A-1"]
+
+
+def test_query_and_export_filters(store):
+    feedback_store.add_feedback(_payload("BG111", "h1", "2025-01-10", "A-1"))
+    feedback_store.add_feedback(_payload("BG111", "h2", "2025-02-10", "A-2"))
+    feedback_store.add_feedback(_payload("BG222", "h3", "2025-02-11", "B-1"))
+
+    numbers = lambda items: [i["payload"]["invoice_number"] for i in items]
+    assert numbers(feedback_store.query_feedback(supplier_vat="BG111")) == ["A-2", "A-1"]
+    assert numbers(feedback_store.query_feedback(source_hash="h3")) == ["B-1"]
+    assert numbers(feedback_store.query_feedback(date_from="2025-02-01", date_to="2025-02-10")) == ["A-2"]
+
+    lines = list(feedback_store.iter_export(date_from="2025-02-01"))
+    assert [json.loads(l)["payload"]["invoice_number"] for l in lines] == ["A-2", "B-1"]
+
+
+def test_revalidate_checks_the_corpus_in_batches(store):
+    def invoice(number, grand_total):
+        return {**_payload("BG111", number, "2025-01-10", number),
+                "recipient": {"name": "Beta"},
+                "service_lines": [{"quantity": 2, "unit_price": 10.0}],
+                "totals": {"subtotal": 20.0, "tax_total": 0.0, "grand_total": grand_total}}
+
+    for i in range(5):
+        feedback_store.add_feedback(invoice(f"A-{i}", 20.0 if i % 2 else 25.0))
+    feedback_store.add_feedback({**invoice("BAD", 1.0), "_meta": {"_invalid_schema": True}})
+
+    report = feedback_store.revalidate(limit=2, chunk=2)
+    assert report["checked"] == 5 and report["with_errors"] == 3 and report["with_warnings"] == 0
+    assert [f["id"] for f in report["failing"]] == [1, 3]
+    assert report["failing"][0]["errors"] == ["Grand total mismatch: model=25.0 computed=20.0"]
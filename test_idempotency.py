@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+import shared_state
+from idempotency import IdempotencyConflict, run_once
+
+
+pytestmark = pytest.mark.usefixtures("state_db")
+
+
+def test_duplicates_coalesce_and_replay():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 200, {"success": True, "data": {"invoice_number": "0000000001"}}
+
+    async def scenario():
+        first, second = await asyncio.gather(
+            run_once("k1", "fp", work), run_once("k1", "fp", work)
+        )
+        third = await run_once("k1", "fp", work)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert first == ((200, {"success": True, "data": {"invoice_number": "0000000001"}}), False)
+    assert second[1] is True and third[1] is True
+    assert third[0] == first[0]
+
+
+def test_failures_are_not_stored_and_keys_bind_to_request():
+    results = iter([(500, {"success": False}), (200, {"success": True})])
+
+    async def work():
+        return next(results)
+
+    assert asyncio.run(run_once("k2", "fp", work)) == ((500, {"success": False}), False)
+    assert asyncio.run(run_once("k2", "fp", work)) == ((200, {"success": True}), False)
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(run_once("k2", "other-fp", work))
+
+
+def test_concurrent_reuse_with_a_different_request_conflicts():
+    async def work():
+        await asyncio.sleep(0.05)
+        return 200, {"success": True, "data": {"invoice_number": "0000000001"}}
+
+    async def scenario():
+        return await asyncio.gather(
+            run_once("key:K", "fpA", work), run_once("key:K", "fpB", work), return_exceptions=True
+        )
+
+    first, second = asyncio.run(scenario())
+    assert first[1] is False and first[0][0] == 200
+    assert isinstance(second, IdempotencyConflict)
+
+
+def test_old_records_are_purged():
+    import time
+    import idempotency
+
+    async def work():
+        return 200, {"success": True}
+
+    asyncio.run(run_once("old", "fp", work))
+    idempotency._claim("abandoned", "fp")                       # 'running', its worker died
+    conn = shared_state.connect()
+    assert idempotency.purge_expired(now=time.time() + 60) == 0
+    assert idempotency.purge_expired(now=time.time() + idempotency.IDEMPOTENCY_STALE_SEC + 1) == 1
+    assert idempotency.purge_expired(now=time.time() + idempotency.IDEMPOTENCY_TTL_SEC + 1) == 1
+    assert conn.execute("SELECT count(*) FROM idempotency").fetchone()[0] == 0
+
+
+def test_claim_waits_for_the_state_db_lock_off_the_event_loop():
+    import sqlite3
+    import threading
+    import time
+
+    shared_state.connect()                                      # create the schema
+    other = sqlite3.connect(shared_state.STATE_DB, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")                            # another worker holds the write lock
+    threading.Timer(0.3, lambda: other.execute("COMMIT")).start()
+
+    async def work():
+        return 200, {"success": True}
+
+    async def scenario():
+        gaps, done = [], asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0)
+        result = await run_once("busy", "fp", work)
+        done.set()
+        await tick
+        return result, max(gaps)
+
+    result, worst_gap = asyncio.run(scenario())
+    assert result == ((200, {"success": True}), False)
+    assert worst_gap < 0.15
+
+
+def test_retry_after_a_late_failure_reuses_the_invoice_number():
+    from idempotency import reserve_number
+    from pipeline import to_thread
+
+    allocated = []
+
+    def allocate():
+        allocated.append(len(allocated) + 1)
+        return allocated[-1]
+
+    def attempt(status):
+        async def work():
+            number = await to_thread(reserve_number, allocate)     # as the render stage does
+            return status, {"number": number}
+        return work
+
+    # the counter / archive stage failed after the number was allocated
+    assert asyncio.run(run_once("k3", "fp", attempt(500)))[0] == (500, {"number": 1})
+    assert asyncio.run(run_once("k3", "fp", attempt(200)))[0] == (200, {"number": 1})
+    assert asyncio.run(run_once("k3", "fp", attempt(200))) == ((200, {"number": 1}), True)
+    # another request gets a new number
+    assert asyncio.run(run_once("k4", "fp", attempt(200)))[0] == (200, {"number": 2})
+    assert allocated == [1, 2]
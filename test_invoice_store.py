@@ -0,0 +1,96 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import invoice_store
+from invoices_api import router
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(invoice_store, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(invoice_store, "INVOICE_DB", str(tmp_path / "invoices.db"))
+    return tmp_path
+
+
+def _invoice(supplier_id, number, issue_date, recipient_vat="BG203743737", **extra):
+    return {
+        "supplier_id": supplier_id, "number": number, "issue_date": issue_date,
+        "supplier_name": "Алфа ЕООД", "supplier_vat": f"BG{supplier_id}",
+        "recipient_name": "КУЕСТЕ ЛТД", "recipient_vat": recipient_vat,
+        "currency": "EUR", "amount": 100.0, "exchange_rate": 1.95583,
+        "base_bgn": 195.58, "vat_bgn": 39.12, "total_bgn": 234.70, **extra,
+    }
+
+
+def test_blobs_are_stored_once_by_content(store):
+    sha = invoice_store.save_blob(b"docx")
+    assert invoice_store.save_blob(b"docx") == sha
+    files = [p for p in store.rglob("*") if p.is_file() and p.suffix != ".db" and "-" not in p.name]
+    assert [p.name for p in files] == [sha]
+    assert open(invoice_store.blob_path(sha), "rb").read() == b"docx"
+
+
+def test_query_filters_and_pagination(store):
+    invoice_store.record_invoice(_invoice("111", "0000000001", "2025-01-10"))
+    invoice_store.record_invoice(_invoice("111", "0000000002", "2025-02-10"))
+    invoice_store.record_invoice(_invoice("222", "0000000001", "2025-02-20", recipient_vat="BG999"))
+
+    page = invoice_store.query_invoices(limit=2)
+    assert page["total"] == 3
+    assert [(i["supplier_id"], i["number"]) for i in page["items"]] == [("222", "0000000001"), ("111", "0000000002")]
+
+    assert invoice_store.query_invoices(supplier="BG111")["total"] == 2
+    assert invoice_store.query_invoices(recipient="BG999")["items"][0]["supplier_id"] == "222"
+    feb = invoice_store.query_invoices(date_from="2025-02-01", date_to="2025-02-15")["items"]
+    assert [i["number"] for i in feb] == ["0000000002"]
+
+    invoice_store.update_invoice("111", "0000000002", docx_link="https://drive/x")
+    assert invoice_store.find_invoices("0000000002")[0]["docx_link"] == "https://drive/x"
+    with pytest.raises(ValueError):
+        invoice_store.update_invoice("111", "0000000002", total_bgn=0)
+
+
+def test_download_serves_archived_file(store):
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    invoice_store.record_invoice(_invoice("111", "0000003958", "2025-01-10", docx_sha=invoice_store.save_blob(b"DOCX")))
+    invoice_store.record_invoice(_invoice("222", "0000003958", "2025-01-11"))
+
+    assert client.get("/invoices/3958/download").status_code == 409
+    r = client.get("/invoices/3958/download", params={"supplier": "111"})
+    assert r.status_code == 200 and r.content == b"DOCX"
+    assert "bulgarian_invoice_0000003958.docx" in r.headers["content-disposition"]
+    assert client.get("/invoices/3958/download", params={"supplier": "111", "format": "pdf"}).status_code == 404
+    assert client.get("/invoices/1/download").status_code == 404
+
+    listing = client.get("/invoices", params={"from": "2025-01-11"}).json()
+    assert listing["total"] == 1 and listing["items"][0]["supplier_id"] == "222"
+
+
+def test_register_report_streams_csv_and_xlsx(store):
+    import csv
+    import io
+    from openpyxl import load_workbook
+    from reports_api import router as reports_router
+
+    app = FastAPI()
+    app.include_router(reports_router)
+    client = TestClient(app)
+    invoice_store.record_invoice(_invoice("111", "0000000002", "2025-02-10"))
+    invoice_store.record_invoice(_invoice("111", "0000000001", "2025-02-03"))
+    invoice_store.record_invoice(_invoice("222", "0000000001", "2025-03-01"))
+
+    r = client.get("/reports/register", params={"from": "2025-02-01", "to": "2025-02-28"})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/csv")
+    assert 'filename="register_2025-02-01_2025-02-28.csv"' in r.headers["content-disposition"]
+    rows = list(csv.reader(io.StringIO(r.content.decode("utf-8-sig"))))
+    assert rows[0][:3] == ["Date", "Invoice number", "Supplier ID"]
+    assert [row[1] for row in rows[1:-1]] == ["0000000001", "0000000002"]
+    assert rows[-1][:2] == ["TOTAL", "2"] and rows[-1][-1] == "469.4"
+
+    r = client.get("/reports/register", params={"supplier": "222", "format": "xlsx"})
+    ws = load_workbook(io.BytesIO(r.content), read_only=True)["Register"]
+    values = list(ws.values)
+    assert len(values) == 3 and values[1][2] == "222" and values[2][-1] == 234.7
@@ -0,0 +1,46 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+import ocr
+
+
+def _page(size=(1200, 1600), bg=(250, 248, 240)):
+    img = Image.new("RGB", size, bg)
+    draw = ImageDraw.Draw(img)
+    for i in range(5):
+        draw.rectangle((300, 400 + i * 150, 900, 400 + i * 150 + 90), fill=(20, 20, 60))
+    return img
+
+
+def test_preprocess_binarises_crops_and_downsamples(monkeypatch):
+    monkeypatch.setattr(ocr, "OCR_ADAPTIVE_DPI", False)
+    out = ocr.preprocess(_page())
+    assert out.mode == "L"
+    assert set(np.unique(np.asarray(out))) == {0, 255}
+    assert out.size == (601 + 2 * ocr.CROP_MARGIN_PX, 691 + 2 * ocr.CROP_MARGIN_PX)
+
+    # 91 px "lines" are way above the 40 px target → scaled down (but never below half size)
+    monkeypatch.setattr(ocr, "OCR_ADAPTIVE_DPI", True)
+    small = ocr.preprocess(_page())
+    assert small.size == (round(out.width * 0.5), round(out.height * 0.5))
+
+    assert ocr.preprocess(Image.new("RGB", (300, 300), "white")) is None
+
+
+def test_ocr_page_is_cached_by_image_hash(state_db, monkeypatch):
+    calls = []
+
+    def fake_tesseract(img, lang=None, config=None):
+        calls.append((img.size, lang, config))
+        return "Фактура 42"
+
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", fake_tesseract)
+    page = _page()
+
+    assert ocr.ocr_page(page) == "Фактура 42"
+    assert ocr.ocr_page(page.copy()) == "Фактура 42"
+    assert len(calls) == 1 and calls[0][1:] == ("bul+eng", "--psm 6")
+
+    # blank pages never reach tesseract
+    assert ocr.ocr_page(Image.new("L", (200, 200), 255)) == ""
+    assert len(calls) == 1
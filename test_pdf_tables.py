@@ -0,0 +1,88 @@
+from pdf_tables import extract_table_lines, to_float
+
+COLS = (50, 300, 360, 450)
+
+
+def _pdf(path, pages):
+    """Minimal text PDF; every page is a list of rows, every row a list of (x, text) cells."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None]
+    kids = []
+    for rows in pages:
+        ops = []
+        for i, row in enumerate(rows):
+            for x, text in row:
+                ops.append(f"BT /F1 10 Tf {x} {780 - 16 * i} Td ({text}) Tj ET")
+        content = "\n".join(ops)
+        objs.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objs.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Contents {len(objs)} 0 R /Resources << /Font << /F1 {{font}} 0 R >> >> >>"
+        )
+        kids.append(len(objs))
+    objs.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    font = len(objs)
+    objs = [o.replace("{font}", str(font)) if o else o for o in objs]
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, o in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{o}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+    return str(path)
+
+
+def _row(*cells):
+    return [(x, t) for x, t in zip(COLS, cells) if t]
+
+
+def test_rows_and_columns_from_glyph_positions(tmp_path):
+    header = _row("Description", "Qty", "Unit price", "Amount")
+    path = _pdf(tmp_path / "inv.pdf", [
+        [
+            [(50, "Alpha Consulting EOOD")],
+            [(50, "Invoice No: 42"), (360, "Date: 31.01.2025")],
+            header,
+            _row("Consulting services 2025", "2", "EUR 500.00", "EUR 1,000.00"),
+            _row("Design work for the", "1", "250.50", "250.50"),
+            _row("new web shop"),
+        ],
+        [
+            [(50, "Alpha Consulting EOOD - page 2")],
+            header,
+            _row("Hosting", "12", "10,00", "120,00"),
+            _row("Subtotal", "", "", "1370.50"),
+        ],
+    ])
+
+    items = extract_table_lines(path, default_currency="BGN")
+
+    assert [(i["description"], i["quantity"], i["unit_price"], i["line_total"], i["currency"]) for i in items] == [
+        ("Consulting services 2025", 2, 500.0, 1000.0, "EUR"),
+        ("Design work for the new web shop", 1, 250.5, 250.5, "BGN"),
+        ("Hosting", 12, 10.0, 120.0, "BGN"),
+    ]
+
+
+def test_no_header_or_over_budget_gives_nothing(tmp_path):
+    path = _pdf(tmp_path / "plain.pdf", [[[(50, "Consulting 2 500.00 1000.00")]]])
+    assert extract_table_lines(path) == []
+
+    path = _pdf(tmp_path / "big.pdf", [[_row("Description", "Qty", "Price", "Total"), _row("X", "1", "2.00", "2.00")]])
+    assert len(extract_table_lines(path)) == 1
+    assert extract_table_lines(path, max_chars=10) == []
+    assert extract_table_lines(str(tmp_path / "missing.pdf")) == []
+
+
+def test_to_float_separators():
+    assert to_float("1 234,56") == 1234.56
+    assert to_float("1,234.56") == 1234.56
+    assert to_float("1.234,56") == 1234.56
+    assert to_float("1,234") == 1234.0
+    assert to_float("120.00") == 120.0
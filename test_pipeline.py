@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest
+
+from pipeline import run_stages
+
+
+def test_independent_stages_overlap_and_get_dependency_results():
+    def slow(value):
+        def fn(**_):
+            time.sleep(0.2)
+            return value
+        return fn
+
+    timings = {}
+    start = time.perf_counter()
+    r = asyncio.run(run_stages({
+        "text": ((), lambda: "invoice text"),
+        "fx": (("text",), slow(1.95583)),
+        "translations": (("text",), slow("София")),
+        "total": (("fx", "translations"), lambda fx, translations: (fx, translations)),
+    }, timings))
+    elapsed = time.perf_counter() - start
+
+    assert r["total"] == (1.95583, "София")
+    assert elapsed < 0.35                       # max(fx, translations), not their sum
+    assert set(timings) == {"text", "fx", "translations", "total"}
+    assert timings["total"]["start_ms"] >= timings["fx"]["start_ms"] + timings["fx"]["ms"] - 1
+
+
+def test_failure_propagates_and_order_is_checked():
+    async def boom():
+        raise KeyError("supplier")
+
+    with pytest.raises(KeyError):
+        asyncio.run(run_stages({"a": ((), boom), "b": (("a",), lambda a: a)}))
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_stages({"b": (("a",), lambda a: a), "a": ((), lambda: 1)}))
+
+
+def test_stages_run_in_the_pool_that_ready_reports_on():
+    import threading
+    import anyio.to_thread
+    from pipeline import executor_stats
+
+    gate = threading.Event()
+
+    async def scenario():
+        anyio.to_thread.current_default_thread_limiter().total_tokens = 1
+        graph = asyncio.ensure_future(run_stages({
+            "a": ((), gate.wait),
+            "b": ((), gate.wait),
+        }))
+        await asyncio.sleep(0.1)
+        stats = executor_stats()
+        gate.set()
+        await graph
+        return stats
+
+    assert asyncio.run(scenario()) == {"busy": 1, "limit": 1, "waiting": 1}
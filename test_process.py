@@ -11,7 +11,9 @@ from process import (
     extract_invoice_date,
     extract_recipient_details,
     extract_service_lines,
-    get_template_path_by_rows
+    get_template_path_by_rows,
+    transliterate_to_bulgarian,
+    supplier_field_bg,
 )
 
 # עוזר קטן לבדוק אם יש אותיות קיריליות
@@ -20,6 +22,21 @@ def is_cyrillic(text):
         return False
     return bool(re.search(r'[А-Яа-я]', text))
 
+@pytest.fixture(autouse=True)
+def isolated_state(state_db, tmp_path, monkeypatch):
+    """SQLite stores and the archive in tmp_path — the pipeline writes to all of them."""
+    import feedback_store
+    import invoice_store
+    import recipient_registry
+    monkeypatch.setattr(invoice_store, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(invoice_store, "INVOICE_DB", str(tmp_path / "invoices.db"))
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DIR", str(tmp_path))
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DB", str(tmp_path / "feedback.db"))
+    monkeypatch.setattr(feedback_store, "_migrated", False)
+    monkeypatch.setattr(recipient_registry, "RECIPIENT_DB", str(tmp_path / "recipients.db"))
+    monkeypatch.setattr(recipient_registry, "_migrated", False)
+    monkeypatch.setattr(recipient_registry, "_cache", (None, None))
+
 # --- בדיקות ליבה ---
 
 def test_auto_translate():
@@ -36,6 +53,18 @@ def test_number_to_bulgarian_words():
     assert "четиристотин" in number_to_bulgarian_words(469.4)
     assert "седемстотин лева и 00 стотинки" in number_to_bulgarian_words(700)
 
+def test_transliterate_to_bulgarian():
+    assert transliterate_to_bulgarian("  Queste Ltd ") == "Кюуесте ЛТД"
+    assert transliterate_to_bulgarian("Alpha EOOD") == "Алпха ЕООД"
+    assert transliterate_to_bulgarian("Jax OOD") == "Джакс ООД"
+    assert transliterate_to_bulgarian("") == ""
+
+def test_supplier_field_bg_prefers_precomputed_column():
+    supplier = pd.Series({"SupplierCity": "Sofia", "SupplierCity_bg": "София", "SupplierName": "Фирма"})
+    assert supplier_field_bg(supplier, "SupplierCity") == "София"
+    # Cyrillic values need no translation call at all
+    assert supplier_field_bg(supplier, "SupplierName") == "Фирма"
+
 def test_extract_invoice_date():
     # The function now returns only a datetime object or None
     date_obj = extract_invoice_date("Invoice date: 18/08/2021")
@@ -96,3 +125,173 @@ def test_get_template_path_by_rows():
     assert get_template_path_by_rows(5).endswith(os.path.join("templates", "BulTrans_Template_5row.docx"))
     assert get_template_path_by_rows(6).endswith(os.path.join("templates", "BulTrans_Template_5row.docx"))
     assert get_template_path_by_rows(0).endswith(os.path.join("templates", "BulTrans_Template_1row.docx"))
+
+def test_supplier_fields_bg_translates_missing_fields_in_one_batch(monkeypatch):
+    import process
+    calls = []
+
+    def fake_translate(texts, target_lang="bg"):
+        calls.append(list(texts))
+        return [{"Sofia": "София", "Main St 1": "ул. Главна 1"}.get(t) for t in texts]
+
+    monkeypatch.setattr(process, "translate_many", fake_translate)
+    supplier = pd.Series({"SupplierName": "Alpha", "SupplierName_bg": "Алфа", "SupplierCity": "Sofia", "Bankname": "DSK"})
+    values, (address,) = process.supplier_fields_bg(supplier, ["SupplierName", "SupplierCity", "Bankname"], extra=["Main St 1"])
+
+    assert calls == [["Sofia", "DSK", "Main St 1"]]
+    assert values == {"SupplierName": "Алфа", "SupplierCity": "София", "Bankname": "DSK"}
+    assert address == "ул. Главна 1"
+
+def test_docx_to_pdf_works_on_bytes_and_cleans_up(monkeypatch, tmp_path):
+    import process
+    # soffice מזויף: "ממיר" על ידי העתקת הקלט לקובץ ה-PDF שליד --outdir
+    bin_dir, work = tmp_path / "bin", tmp_path / "convert"
+    bin_dir.mkdir(); work.mkdir()
+    fake = bin_dir / "soffice"
+    fake.write_text('#!/bin/sh\nfor a; do last="$a"; done\ncp "$last" "${last%.docx}.pdf"\n')
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(process, "CONVERT_DIR", str(work))
+
+    assert process.docx_to_pdf(b"docx-bytes") == b"docx-bytes"
+    assert list(work.iterdir()) == []
+
+def test_dry_run_previews_without_side_effects_and_reuses_extraction(monkeypatch, tmp_path):
+    import asyncio
+    import base64
+    import shutil
+    import process
+
+    suppliers = shutil.copy("suppliers.xlsx", tmp_path / "suppliers.xlsx")
+    monkeypatch.setattr(process, "current_suppliers_path", lambda: str(suppliers))
+    monkeypatch.setattr(process, "translate_many", lambda texts, target_lang="bg": [None] * len(texts))
+    extracted = []
+    text = ("Date: 31.01.2025\nBill To: QUESTE LTD\nID No: 203743737\nVAT: BG203743737\n"
+            "Address: Aleksandar Stamboliiski 134\n")
+    monkeypatch.setattr(process, "extract_text_from_file", lambda data, filename: extracted.append(filename) or text)
+    line = {"description": "Consulting services", "quantity": 2, "unit_price": 500.0,
+            "line_total": 1000.0, "currency": "EUR", "service_date": None}
+    monkeypatch.setattr(process, "extract_service_lines", lambda t: extracted.append("lines") or [line])
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError("dry run must not number, upload or convert")
+
+    for name in ("next_counter", "upload_to_drive", "docx_to_pdf"):
+        monkeypatch.setattr(process, name, forbidden)
+    before = os.path.getmtime(suppliers)
+
+    status, body = asyncio.run(process._process_invoice("203504721", "inv.txt", b"same file", dry_run=True))
+    assert status == 200 and body["dry_run"] is True, body
+    ctx = body["data"]["context"]
+    assert ctx["InvoiceNumber"] == "PREVIEW" and ctx["Amount1"] == "1000.00" and ctx["RecipientVAT"] == "BG203743737"
+    assert body["data"]["amounts_bgn"]["base"] == 1955.83
+    assert "docx_base64" not in body["data"]
+    assert os.path.getmtime(suppliers) == before
+
+    # טמפלט משלנו: test_get_template_path_by_rows דורס את הקבצים ב-templates/
+    from docx import Document
+    doc = Document()
+    doc.add_paragraph("{{ InvoiceNumber }} {{ RecipientName }}")
+    doc.save(tmp_path / "template.docx")
+    monkeypatch.setattr(process, "get_template_path_by_rows", lambda rows: str(tmp_path / "template.docx"))
+    status, body = asyncio.run(process._process_invoice("203504721", "inv.txt", b"same file",
+                                                        dry_run=True, include_docx=True))
+    assert base64.b64decode(body["data"]["docx_base64"])[:2] == b"PK"
+    assert extracted == ["inv.txt", "lines"]      # second run used the cached extraction
+
+def test_table_lines_without_a_currency_use_the_one_in_the_text(monkeypatch, tmp_path):
+    import asyncio
+    import shutil
+    import process
+    from test_pdf_tables import _pdf, _row
+
+    suppliers = shutil.copy("suppliers.xlsx", tmp_path / "suppliers.xlsx")
+    monkeypatch.setattr(process, "current_suppliers_path", lambda: str(suppliers))
+    monkeypatch.setattr(process, "translate_many", lambda texts, target_lang="bg": [None] * len(texts))
+    monkeypatch.setattr(process, "get_exchange_rate_for_date", lambda date, currency: {"USD": 1.8}[currency])
+    path = _pdf(tmp_path / "inv.pdf", [[
+        _row("Description", "Qty", "Unit price", "Amount"),
+        _row("Consulting services", "2", "500.00", "1000.00"),
+    ]])
+    text = "Date: 31.01.2025\nBill To: QUESTE LTD\nVAT: BG203743737\nTotal due: 1000.00 USD\n"
+    monkeypatch.setattr(process, "extract_text_from_file", lambda data, filename: text)
+    with open(path, "rb") as f:
+        data = f.read()
+
+    status, body = asyncio.run(process._process_invoice("203504721", "inv.pdf", data, dry_run=True))
+    assert status == 200, body
+    assert body["data"]["context"]["Cur1"] == "USD"
+    assert body["data"]["amounts_bgn"]["base"] == 1800.0
+
+
+def test_duplicate_iban_in_a_legacy_version_is_rejected(monkeypatch, tmp_path):
+    import asyncio
+    import process
+
+    suppliers = str(tmp_path / "suppliers_legacy.xlsx")       # no .meta.json: never validated
+    pd.DataFrame({
+        "SupplierName": ["Alpha EOOD", "Beta OOD"],
+        "SupplierCompanyID": [203504721, 206756775],
+        "IBAN": ["BG43STSA93000022594884", "BG43STSA93000022594884"],
+    }).to_excel(suppliers, index=False)
+    monkeypatch.setattr(process, "current_suppliers_path", lambda: suppliers)
+    monkeypatch.setattr(process, "extract_text_from_file", lambda data, filename: "Date: 31.01.2025\n")
+    line = {"description": "Consulting", "quantity": 1, "unit_price": 100.0,
+            "line_total": 100.0, "currency": "EUR", "service_date": None}
+    monkeypatch.setattr(process, "extract_service_lines", lambda t: [line])
+
+    status, body = asyncio.run(process._process_invoice("203504721", "inv.txt", b"dup iban", dry_run=True))
+    assert status == 400 and "Duplicate IBAN" in body["error"], body
+
+
+def test_post_processing_does_not_block_the_event_loop(monkeypatch, tmp_path):
+    import asyncio
+    import shutil
+    import time
+    import process
+    import supplier_registry
+
+    suppliers = shutil.copy("suppliers.xlsx", tmp_path / "suppliers.xlsx")
+    monkeypatch.setattr(process, "current_suppliers_path", lambda: str(suppliers))
+    monkeypatch.setattr(process, "translate_many", lambda texts, target_lang="bg": [None] * len(texts))
+    text = "Date: 31.01.2025\nBill To: QUESTE LTD\nID No: 203743737\nVAT: BG203743737\n"
+    monkeypatch.setattr(process, "extract_text_from_file", lambda data, filename: text)
+    line = {"description": "Consulting", "quantity": 1, "unit_price": 1000.0,
+            "line_total": 1000.0, "currency": "EUR", "service_date": None}
+    monkeypatch.setattr(process, "extract_service_lines", lambda t: [line])
+    from docx import Document
+    doc = Document()
+    doc.add_paragraph("{{ InvoiceNumber }}")
+    doc.save(tmp_path / "template.docx")
+    monkeypatch.setattr(process, "get_template_path_by_rows", lambda rows: str(tmp_path / "template.docx"))
+
+    # Drive, soffice and the xlsx counter write are slow, blocking calls
+    def slow(result):
+        return lambda *args, **kwargs: time.sleep(0.3) or result
+    monkeypatch.setattr(process, "upload_to_drive", slow("https://drive/link"))
+    monkeypatch.setattr(process, "docx_to_pdf", slow(b"%PDF-1.4"))
+    monkeypatch.setattr(supplier_registry, "set_last_invoice_number", slow(None))
+
+    async def scenario():
+        gaps, done = [], asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0)
+        try:
+            result = await process._process_invoice("203504721", "inv.txt", b"post-processing")
+        finally:
+            done.set()
+            await tick
+        return result, max(gaps)
+
+    (status, body), worst_gap = asyncio.run(scenario())
+    assert status == 200 and body["data"]["pdf_link"] == "https://drive/link", body
+    assert worst_gap < 0.15
@@ -0,0 +1,55 @@
+import asyncio
+import pstats
+
+import pytest
+from fastapi.testclient import TestClient
+
+import profiling
+from pipeline import run_stages
+
+
+@pytest.fixture(autouse=True)
+def admin_token(state_db, monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "s3cret")
+
+
+def _busy_stage():
+    return sum(i * i for i in range(20000))
+
+
+def test_pipeline_stages_are_profiled_only_inside_a_profiled_request():
+    stages = {"a": ((), _busy_stage), "b": ((), _busy_stage)}
+    asyncio.run(run_stages(stages))                          # not profiled: nothing stored
+
+    async def request():
+        with profiling.profiled("req-1", "/process-invoice/") as profile:
+            await run_stages(stages)
+        return profile
+
+    profile = asyncio.run(request())
+    assert profile.threads == 3                              # two stage threads + the loop thread
+    record = profiling.load("req-1")
+    assert record["path"] == "/process-invoice/" and record["tracemalloc_peak_kb"] >= 0
+    assert any("_busy_stage" in row["function"] for row in record["top"])
+    assert profiling.load("req-0") is None
+
+
+def test_profile_header_requires_admin_token_and_profile_is_served(tmp_path):
+    from main import app
+    client = TestClient(app)
+
+    assert "X-Profile-Id" not in client.get("/ping", headers={"X-Profile": "1"}).headers
+    r = client.get("/ping", headers={"X-Profile": "1", "X-Admin-Token": "s3cret"})
+    request_id = r.headers["X-Profile-Id"]
+    assert request_id == r.headers["X-Request-ID"]
+
+    url = f"/admin/profiles/{request_id}"
+    assert client.get(url, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    summary = client.get(url, headers={"X-Admin-Token": "s3cret"}).json()
+    assert summary["wall_ms"] > 0 and "pstats" not in summary
+
+    dump = client.get(url, params={"format": "pstats"}, headers={"X-Admin-Token": "s3cret"}).content
+    (tmp_path / "p.pstats").write_bytes(dump)
+    assert pstats.Stats(str(tmp_path / "p.pstats")).total_calls > 0
+    text = client.get(url, params={"format": "text"}, headers={"X-Admin-Token": "s3cret"}).text
+    assert "cumulative" in text
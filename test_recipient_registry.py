@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+import feedback_store
+import invoice_store
+import recipient_registry
+from process import extract_recipient_details
+
+SUPPLIER = pd.Series({"SupplierCompanyVAT": "BG111111111", "SupplierCompanyID": "111111111", "SupplierName": "Alpha"})
+
+
+@pytest.fixture(autouse=True)
+def registry(state_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(invoice_store, "INVOICE_DB", str(tmp_path / "invoices.db"))
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DIR", str(tmp_path))
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DB", str(tmp_path / "feedback.db"))
+    monkeypatch.setattr(feedback_store, "_migrated", False)
+    monkeypatch.setattr(recipient_registry, "RECIPIENT_DB", str(tmp_path / "recipients.db"))
+    monkeypatch.setattr(recipient_registry, "_migrated", False)
+    monkeypatch.setattr(recipient_registry, "_cache", (None, None))
+
+
+def test_known_vat_fills_the_whole_block_from_history():
+    feedback_store.add_feedback({
+        "supplier": {"vat_id": "BG111111111"}, "issue_date": "2025-01-10",
+        "recipient": {"name": "Queste Ltd", "vat_id": "BG 203743737", "address": "Aleksandar Stamboliiski 134"},
+    })
+    invoice_store.record_invoice({"supplier_id": "111111111", "number": "0000000001", "recipient_name": "КУЕСТЕ ЛТД",
+                                  "recipient_id": "203743737", "recipient_vat": "BG203743737"})
+    # no "Bill To:" keyword, the supplier's own VAT comes first
+    text = "Alpha\nVAT: BG111111111\n\nQueste\nVAT No BG 203 743 737\nTotal 100 EUR\n"
+    details = extract_recipient_details(text, SUPPLIER)
+    assert details == {"name": "Queste Ltd", "vat": "BG203743737", "id": "203743737",
+                       "address": "Aleksandar Stamboliiski 134", "name_bg": "КУЕСТЕ ЛТД", "address_bg": ""}
+    assert extract_recipient_details("EIK 203743737", SUPPLIER)["name_bg"] == "КУЕСТЕ ЛТД"
+    # the supplier is never its own recipient
+    recipient_registry.record("Alpha", vat="BG111111111")
+    assert extract_recipient_details("VAT: BG111111111", SUPPLIER)["name"] == ""
+
+
+def test_fuzzy_name_completes_missing_identifiers():
+    recipient_registry.record("Queste Ltd", vat="BG203743737", address="Aleksandar Stamboliiski 134",
+                              name_bg="КУЕСТЕ ЛТД", address_bg="бул. Александър Стамболийски 134")
+    empty = {"vat": "", "id": "", "address": ""}
+
+    filled = recipient_registry.complete({"name": "QUESTE LTD.", **empty})
+    assert filled["vat"] == "BG203743737" and filled["id"] == "203743737"
+    assert filled["name"] == "QUESTE LTD." and filled["address_bg"].startswith("бул.")
+    assert recipient_registry.complete({"name": "Totally Different GmbH", **empty})["vat"] == ""
+    # a VAT in the text that disagrees means another company with a similar name
+    assert recipient_registry.complete({"name": "Queste Ltd", "vat": "BG999999999", "id": "", "address": ""})["id"] == ""
+    # a different address drops the known translation
+    assert recipient_registry.complete({"name": "Queste", "vat": "", "id": "", "address": "Vitosha 1"})["address_bg"] == ""
+
+
+def test_record_merges_by_vat_or_eik():
+    assert not recipient_registry.record("No Identifiers Ltd")
+    recipient_registry.record("Queste Ltd", eik="203743737")
+    recipient_registry.record("Queste Ltd", vat="BG203743737", address="Sofia")
+    recipient_registry.record("QUESTE LTD", vat="BG203743737", name_bg="КУЕСТЕ ЛТД")
+    rows = recipient_registry.index().rows
+    assert len(rows) == 1
+    assert rows[0] == {"name": "QUESTE LTD", "name_bg": "КУЕСТЕ ЛТД", "vat": "BG203743737", "eik": "203743737",
+                       "address": "Sofia", "address_bg": None}
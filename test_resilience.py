@@ -0,0 +1,87 @@
+import asyncio
+import datetime
+import threading
+import time
+
+import pytest
+
+import resilience
+import shared_state
+from resilience import CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture(autouse=True)
+def breakers(state_db, monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKERS", {})
+
+
+def _fail():
+    raise TimeoutError("slow dependency")
+
+
+def test_breaker_opens_fails_fast_and_recovers_through_a_probe():
+    b = CircuitBreaker("dep", failures=2, reset_after=0.05)
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            b.call(_fail)
+    assert b.state == "open"
+    with pytest.raises(CircuitOpen):
+        b.call(lambda: "not called")
+
+    time.sleep(0.06)
+    assert b.state == "half_open"
+    with pytest.raises(TimeoutError):
+        b.call(_fail)                      # failed probe → open again
+    assert b.state == "open"
+
+    time.sleep(0.06)
+    assert b.call(lambda: "ok") == "ok"
+    assert b.snapshot()["state"] == "closed"
+
+
+def test_hedged_request_after_p95_delay(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_SAMPLES", 3)
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY_MS", 1)
+    b = CircuitBreaker("fx")
+    for _ in range(3):
+        b.call(time.sleep, 0.01)
+    calls, release = [], threading.Event()
+
+    def get():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(1)                # the first request hangs
+            return "slow"
+        return "fast"
+
+    t0 = time.perf_counter()
+    assert b.hedged(get) == "fast"
+    assert time.perf_counter() - t0 < 0.5 and len(calls) == 2
+    release.set()
+
+
+def test_degraded_notes_are_collected_from_stage_threads():
+    async def request():
+        with resilience.collect() as notes:
+            await asyncio.to_thread(resilience.degraded, "FX service unavailable")
+            await asyncio.to_thread(resilience.degraded, "FX service unavailable")
+        return notes
+
+    assert asyncio.run(request()) == ["FX service unavailable"]
+    resilience.degraded("outside a request")      # no collector: ignored
+
+
+def test_fx_falls_back_to_a_cached_rate_when_the_service_is_down(monkeypatch):
+    import process
+
+    class Down:
+        def get(self, url, timeout):
+            raise ConnectionError("exchangerate.host down")
+
+    monkeypatch.setattr(process, "http_session", lambda: Down())
+    shared_state.cache_set("fx", "USD:2025-01-29", 1.87)
+
+    with resilience.collect() as notes:
+        assert process.get_exchange_rate_for_date(datetime.datetime(2025, 1, 31), "USD") == 1.87
+    assert resilience.breaker("fx").state == "open"
+    assert notes == ["FX service unavailable: using the cached USD→BGN rate of 2025-01-29"]
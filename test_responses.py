@@ -0,0 +1,70 @@
+import json
+import math
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from responses import CompressionMiddleware, FastJSONResponse, json_with_raw
+
+ROWS = [{"SupplierCompanyID": str(200000000 + i), "SupplierName": f"Supplier {i} EOOD", "Last invoice number": i}
+        for i in range(200)]
+
+
+def _app():
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    @app.get("/big")
+    def big():
+        return {"success": True, "data": ROWS}
+
+    @app.get("/small")
+    def small():
+        return {"success": True}
+
+    @app.get("/csv")
+    def csv():
+        return StreamingResponse((f"{r['SupplierCompanyID']},{r['SupplierName']}\n" for r in ROWS), media_type="text/csv")
+
+    @app.get("/pdf")
+    def pdf():
+        return Response(b"%PDF-1.4" + b"0" * 5000, media_type="application/pdf")
+
+    return app
+
+
+def test_fast_json_handles_nan_and_numpy():
+    body = FastJSONResponse({"a": math.nan, "b": np.int64(7), "c": np.float64(1.5)}).body
+    assert json.loads(body) == {"a": None, "b": 7, "c": 1.5}
+
+
+def test_json_with_raw_splices_serialised_rows():
+    raw = json.dumps(ROWS[:2]).encode()
+    assert json.loads(json_with_raw({"success": True, "rows": 2}, "data", raw).body) == \
+        {"success": True, "rows": 2, "data": ROWS[:2]}
+    assert json.loads(json_with_raw({}, "data", b"[]").body) == {"data": []}
+
+
+def test_compression_prefers_br_then_gzip_above_the_threshold():
+    client = TestClient(_app())
+    br = client.get("/big", headers={"Accept-Encoding": "gzip, br"})
+    assert br.headers["content-encoding"] == "br" and br.json()["data"] == ROWS
+    assert int(br.headers["content-length"]) < len(json.dumps(ROWS)) / 4
+
+    gz = client.get("/big", headers={"Accept-Encoding": "gzip, br;q=0"})
+    assert gz.headers["content-encoding"] == "gzip" and gz.json()["data"] == ROWS
+
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "br"}).headers
+    assert "content-encoding" not in client.get("/pdf", headers={"Accept-Encoding": "br, gzip"}).headers
+    assert "content-encoding" not in client.get("/big", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_streamed_responses_are_compressed_chunk_by_chunk():
+    client = TestClient(_app())
+    expected = "".join(f"{r['SupplierCompanyID']},{r['SupplierName']}\n" for r in ROWS)
+    for accept, coding in (("br", "br"), ("gzip", "gzip")):
+        res = client.get("/csv", headers={"Accept-Encoding": accept})
+        assert res.headers["content-encoding"] == coding and res.headers["vary"] == "Accept-Encoding"
+        assert "content-length" not in res.headers and res.text == expected
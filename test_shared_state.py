@@ -0,0 +1,52 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import shared_state
+
+
+def _allocate(args):
+    path, n = args
+    shared_state.STATE_DB = path
+    return [shared_state.next_counter("invoice:1") for _ in range(n)]
+
+
+def test_counters_are_unique_across_processes(state_db):
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(_allocate, [(state_db, 25)] * 4))
+    values = sorted(v for chunk in results for v in chunk)
+    assert values == list(range(1, 101))
+
+
+def test_counter_floor_and_release(state_db):
+    assert shared_state.next_counter("invoice:2", floor=3957) == 3958
+    assert shared_state.next_counter("invoice:2", floor=10) == 3959
+    assert shared_state.release_counter("invoice:2", 3959)
+    assert not shared_state.release_counter("invoice:2", 3959)
+    assert shared_state.counter_value("invoice:2") == 3958
+
+
+def test_cache_roundtrip_and_ttl(state_db):
+    shared_state.cache_set("fx", "USD:2025-01-02", 1.87)
+    shared_state.cache_set("fx", "GBP:2025-01-02", 2.3, ttl=-1)
+    assert shared_state.cache_get("fx", "USD:2025-01-02") == 1.87
+    assert shared_state.cache_get("fx", "GBP:2025-01-02") is None
+    shared_state.cache_clear("fx")
+    assert shared_state.cache_get("fx", "USD:2025-01-02") is None
+
+
+def test_expired_cache_rows_are_deleted(state_db, monkeypatch):
+    shared_state.cache_set("fx", "USD:2025-01-02", 1.87)                  # no TTL: kept
+    shared_state.cache_set("ocr", "old", "text", ttl=60)
+    shared_state.cache_set("ocr", "new", "text", ttl=3600)
+    rows = lambda: shared_state.connect().execute("SELECT ns, key FROM cache ORDER BY key").fetchall()
+    assert shared_state.purge_expired(now=time.time() + 120) == 1
+    assert rows() == [("fx", "USD:2025-01-02"), ("ocr", "new")]
+
+    # writes purge opportunistically, at most every STATE_PURGE_SEC
+    monkeypatch.setattr(shared_state, "_last_purge", 0.0)
+    shared_state.cache_set("ocr", "gone", "text", ttl=-1)                 # first purge of this worker
+    assert ("ocr", "gone") not in rows()
+    shared_state.cache_set("ocr", "gone", "text", ttl=-1)                 # throttled: still there
+    assert ("ocr", "gone") in rows()
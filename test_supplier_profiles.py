@@ -0,0 +1,82 @@
+import pytest
+
+import feedback_store
+import metrics
+import supplier_profiles
+
+
+@pytest.fixture
+def store(state_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DIR", str(tmp_path))
+    monkeypatch.setattr(feedback_store, "FEEDBACK_DB", str(tmp_path / "feedback.db"))
+    monkeypatch.setattr(feedback_store, "_migrated", False)
+    monkeypatch.setattr(supplier_profiles, "_cache", (None, []))
+    return tmp_path
+
+
+def _text(number, day, lines):
+    rows = "\n".join(f"{d} {q} {p:.2f} {q * p:.2f}" for d, q, p in lines)
+    subtotal = sum(q * p for _, q, p in lines)
+    return (
+        "ALPHA EOOD\nДДС № BG 203504721\nIBAN: BG43 STSA 9300 0022 5948 84\n"
+        f"Фактура № {number}\nДата: {day}\n"
+        "Описание Кол. Цена Сума\n"
+        f"{rows}\n"
+        f"Данъчна основа: {subtotal:.2f}\nДДС 20%: {subtotal * 0.2:.2f}\n"
+        f"Общо за плащане: {subtotal * 1.2:.2f} EUR\n"
+        "Получател: Beta OOD, ДДС № BG206756775\n"
+    )
+
+
+def _correction(number, iso_date, lines, source_hash):
+    subtotal = sum(q * p for _, q, p in lines)
+    return {
+        "supplier": {"name": "Alpha EOOD", "vat_id": "BG203504721", "iban": "BG43STSA93000022594884"},
+        "invoice_number": number,
+        "issue_date": iso_date,
+        "currency": "EUR",
+        "service_lines": [
+            {"description": d, "quantity": q, "unit_price": p, "tax_rate": 20.0, "line_total": round(q * p, 2)}
+            for d, q, p in lines
+        ],
+        "totals": {"subtotal": subtotal, "tax_total": round(subtotal * 0.2, 2),
+                   "grand_total": round(subtotal * 1.2, 2), "currency": "EUR"},
+        "source_hash": source_hash,
+    }
+
+
+def _teach(number, day, iso_date, lines, h):
+    feedback_store.save_source(h, _text(number, day, lines))
+    feedback_store.add_feedback(_correction(number, iso_date, lines, h))
+
+
+def test_profile_is_learned_from_feedback_and_applied(store):
+    _teach("0000004101", "03.02.2025", "2025-02-03", [("Транспорт", 2, 150.0)], "h1")
+    assert supplier_profiles.learn("BG203504721") is None      # one sample is not a layout yet
+    _teach("0000004188", "04.03.2025", "2025-03-04", [("Транспорт", 1, 90.0), ("Склад", 3, 10.0)], "h2")
+    assert supplier_profiles.learn("bg 203504721") is not None
+
+    text = _text("0000004250", "07.04.2025", [("Спедиция", 4, 25.5), ("Склад", 1, 10.0)])
+    payload = supplier_profiles.apply(text)
+
+    assert payload["extractor"] == "profile"
+    assert payload["invoice_number"] == "0000004250"
+    assert payload["issue_date"] == "2025-04-07"
+    assert payload["totals"] == {"subtotal": 112.0, "tax_total": 22.4, "grand_total": 134.4, "currency": "EUR"}
+    assert [(l["description"], l["quantity"], l["unit_price"]) for l in payload["service_lines"]] == [
+        ("Спедиция", 4.0, 25.5), ("Склад", 1.0, 10.0)
+    ]
+    assert payload["supplier"]["name"] == "Alpha EOOD"
+
+    # unknown supplier / broken totals fall through to the model
+    assert supplier_profiles.apply(text.replace("BG 203504721", "BG 999").replace("BG43", "XX00")) is None
+    assert supplier_profiles.apply(text.replace("134.40", "999.00")) is None
+
+
+def test_metrics_hit_rate(store):
+    metrics.incr("profile_hit")
+    metrics.incr("profile_hit")
+    metrics.incr("profile_miss")
+    snap = metrics.snapshot()
+    assert snap["profile_hit"] == 2 and snap["profile_miss"] == 1
+    assert snap["profile_hit_rate"] == 0.6667
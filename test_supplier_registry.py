@@ -0,0 +1,209 @@
+import os
+import json
+import pandas as pd
+
+from supplier_registry import (
+    add_translations,
+    build_cache,
+    cache_path,
+    diff_suppliers,
+    find_supplier,
+    has_duplicate_iban,
+    load_suppliers,
+    meta_path,
+    page_suppliers,
+    set_last_invoice_number,
+    validate_suppliers,
+)
+
+
+def _write_suppliers(path):
+    pd.DataFrame({
+        "SupplierName": ["Alpha EOOD", "Beta OOD"],
+        "SupplierCompanyID": [203504721, 206756775],
+        "SupplierCompanyVAT": ["BG203504721", "BG206756775"],
+        "IBAN": ["BG43STSA93000022594884", None],
+        "Last invoice number": [3957, None],
+        "Notes": ["not used by the pipeline", "x"],
+    }).to_excel(path, index=False)
+
+
+def test_build_cache_projects_and_types_columns(tmp_path):
+    xlsx = str(tmp_path / "suppliers.xlsx")
+    _write_suppliers(xlsx)
+
+    df = build_cache(xlsx)
+    assert os.path.exists(cache_path(xlsx))
+    assert "Notes" not in df.columns
+    assert df["SupplierCompanyID"].tolist() == ["203504721", "206756775"]
+    assert df["IBAN"].tolist()[1] == ""
+    assert df["Last invoice number"].tolist() == [3957, 0]
+
+    supplier = find_supplier(xlsx, "203504721")
+    assert supplier is not None and supplier["SupplierName"] == "Alpha EOOD"
+    assert find_supplier(xlsx, "999") is None
+
+
+def test_set_last_invoice_number_keeps_other_columns(tmp_path):
+    xlsx = str(tmp_path / "suppliers.xlsx")
+    _write_suppliers(xlsx)
+    load_suppliers(xlsx)
+
+    set_last_invoice_number(xlsx, "206756775", 16)
+
+    raw = pd.read_excel(xlsx)
+    assert "Notes" in raw.columns
+    assert raw.loc[raw["SupplierCompanyID"] == 206756775, "Last invoice number"].iloc[0] == 16
+    assert find_supplier(xlsx, "206756775")["Last invoice number"] == 16
+
+
+def test_counter_write_replaces_the_xlsx_atomically(tmp_path, monkeypatch):
+    from openpyxl.workbook.workbook import Workbook
+
+    xlsx = str(tmp_path / "suppliers.xlsx")
+    _write_suppliers(xlsx)
+    load_suppliers(xlsx)
+    before = open(xlsx, "rb").read()
+
+    def crash(self, filename):
+        with open(filename, "wb") as f:
+            f.write(b"PK\x03\x04 half a workbook")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Workbook, "save", crash)
+    try:
+        set_last_invoice_number(xlsx, "206756775", 16)
+    except OSError:
+        pass
+    # the live file is untouched and no temp file is left behind
+    assert open(xlsx, "rb").read() == before
+    assert sorted(os.listdir(tmp_path)) == ["suppliers.xlsx", "suppliers.xlsx.pkl"]
+
+    monkeypatch.undo()
+    set_last_invoice_number(xlsx, "206756775", 16)
+    assert pd.read_excel(xlsx)["Last invoice number"].tolist()[1] == 16
+    assert os.path.getmtime(cache_path(xlsx)) >= os.path.getmtime(xlsx)
+
+
+def test_stale_cache_is_rebuilt_once_under_the_lock_with_translations(tmp_path, monkeypatch):
+    import process
+    import supplier_registry
+    import version_store
+
+    def translate(texts, target_lang="bg"):
+        assert version_store._depth == 0, "network call while other workers wait on the lock"
+        return [f"bg:{t}" for t in texts]
+
+    monkeypatch.setattr(version_store, "LOCK_FILE", str(tmp_path / ".lock"))
+    monkeypatch.setattr(process, "translate_many", translate)
+    reads = []
+    real_read = supplier_registry.read_suppliers_xlsx
+    monkeypatch.setattr(supplier_registry, "read_suppliers_xlsx", lambda src: reads.append(src) or real_read(src))
+
+    xlsx = str(tmp_path / "suppliers.xlsx")
+    _write_suppliers(xlsx)
+    pkl_time = os.path.getmtime(xlsx) - 10
+    build_cache(xlsx)
+    os.utime(cache_path(xlsx), (pkl_time, pkl_time))           # e.g. the xlsx was edited after the upload
+    reads.clear()
+
+    supplier_registry._loaded.clear()
+    assert find_supplier(xlsx, "203504721")["SupplierName_bg"] == "bg:Alpha EOOD"
+    supplier_registry._loaded.clear()                           # another worker: the fresh pickle is reused
+    assert find_supplier(xlsx, "203504721")["SupplierName_bg"] == "bg:Alpha EOOD"
+    assert len(reads) == 1
+
+    # the counter write loads a stale version before it takes the lock
+    os.utime(cache_path(xlsx), (pkl_time, pkl_time))
+    supplier_registry._loaded.clear()
+    set_last_invoice_number(xlsx, "203504721", 3960)
+    assert find_supplier(xlsx, "203504721")["Last invoice number"] == 3960
+    assert find_supplier(xlsx, "203504721")["SupplierName_bg"] == "bg:Alpha EOOD"
+
+
+def test_page_suppliers_warm_and_cold_agree(tmp_path):
+    warm = str(tmp_path / "warm.xlsx")
+    cold = str(tmp_path / "cold.xlsx")
+    _write_suppliers(warm)
+    _write_suppliers(cold)
+    build_cache(warm)
+
+    for path in (warm, cold):
+        page = page_suppliers(path, offset=0, limit=1, columns=["SupplierCompanyID", "IBAN"], q="bg43 stsa")
+        assert page["columns"] == ["SupplierCompanyID", "IBAN"]
+        assert page["data"] == [{"SupplierCompanyID": "203504721", "IBAN": "BG43STSA93000022594884"}]
+
+        page = page_suppliers(path, offset=1, limit=5)
+        assert page["rows"] == 2
+        assert [r["SupplierName"] for r in page["data"]] == ["Beta OOD"]
+        assert page["has_more"] is False
+        # serialised straight from the frame / row list: same rows as the dicts
+        assert json.loads(page_suppliers(path, offset=1, limit=5, as_json=True)["data"]) == page["data"]
+
+    assert not os.path.exists(cache_path(cold))
+
+
+def test_validate_and_diff_suppliers():
+    old = pd.DataFrame({
+        "SupplierCompanyID": ["1", "2", "3"],
+        "SupplierName": ["A", "B", "C"],
+        "IBAN": ["BG01", "BG02", "BG03"],
+        "Last invoice number": [5, 6, 7],
+    })
+    new = pd.DataFrame({
+        "SupplierCompanyID": ["1", "2", "4", "4"],
+        "SupplierName": ["A", "B2", "D", "D"],
+        "IBAN": ["BG01", "BG02", "BG 01", ""],
+        "Last invoice number": [9, 6, 0, 0],
+    })
+
+    report = validate_suppliers(new)
+    assert not report["valid"]
+    assert any(e.startswith("Missing required columns") for e in report["errors"])
+    assert "Duplicate SupplierCompanyID: 4" in report["errors"]
+    assert any(e.startswith("Duplicate IBAN") for e in report["errors"])
+    assert report["warnings"] == ["Missing IBAN in 1 row(s)"]
+
+    diff = diff_suppliers(old, new)
+    assert diff["added"] == ["4"]
+    assert diff["removed"] == ["3"]
+    assert diff["changed"] == [{"SupplierCompanyID": "2", "fields": ["SupplierName"]}]
+
+
+def test_legacy_version_is_validated_once_on_first_load(tmp_path):
+    xlsx = str(tmp_path / "suppliers_legacy.xlsx")
+    pd.DataFrame({
+        "SupplierName": ["Alpha EOOD", "Beta OOD", "Gamma AD"],
+        "SupplierCompanyID": [203504721, 206756775, 175074752],
+        "IBAN": ["BG43STSA93000022594884", "BG43 STSA 9300 0022 5948 84", "BG80BNBG96611020345678"],
+    }).to_excel(xlsx, index=False)
+    assert not os.path.exists(meta_path(xlsx))          # uploaded before validation existed
+
+    assert has_duplicate_iban(xlsx, "BG43STSA93000022594884")
+    assert not has_duplicate_iban(xlsx, "BG80BNBG96611020345678")
+    with open(meta_path(xlsx), encoding="utf-8") as f:
+        assert not json.load(f)["validation"]["valid"]
+
+    # the report is kept with the loaded table, not re-read per invoice
+    os.remove(meta_path(xlsx))
+    assert has_duplicate_iban(xlsx, "BG43 STSA 9300 0022 5948 84")
+    assert not os.path.exists(meta_path(xlsx))
+
+
+def test_add_translations_batches_unique_values():
+    df = pd.DataFrame({
+        "SupplierCompanyID": ["1", "2"],
+        "SupplierName": ["Alpha", "Бета"],
+        "SupplierCity": ["Sofia", "Sofia"],
+    })
+    calls = []
+
+    def fake_translate(texts):
+        calls.append(list(texts))
+        return [{"Alpha": "Алфа", "Sofia": "София"}.get(t, t) for t in texts]
+
+    out = add_translations(df, fake_translate)
+    assert calls == [["Alpha", "Бета", "Sofia"]]
+    assert out["SupplierName_bg"].tolist() == ["Алфа", "Бета"]
+    assert out["SupplierCity_bg"].tolist() == ["София", "София"]
+    assert "SupplierName_bg" not in df
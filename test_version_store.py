@@ -0,0 +1,75 @@
+import os
+import json
+import pytest
+
+import version_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    d = str(tmp_path)
+    monkeypatch.setattr(version_store, "SUPPLIERS_DIR", d)
+    monkeypatch.setattr(version_store, "POINTER_FILE", os.path.join(d, "current.json"))
+    monkeypatch.setattr(version_store, "LOCK_FILE", os.path.join(d, ".lock"))
+    monkeypatch.setattr(version_store, "EMPTY_VERSION", os.path.join(d, "suppliers_empty.xlsx"))
+    monkeypatch.setattr(version_store, "SUPPLIERS_PATH", os.path.join(d, "missing.xlsx"))
+    monkeypatch.setattr(version_store, "_pointer", (None, None))
+    monkeypatch.setattr(version_store, "_manifest", (None, []))
+    return tmp_path
+
+
+def _touch(path, mtime):
+    path.write_bytes(b"x")
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_pointer_flip_is_atomic_and_seen_by_readers(store):
+    a = _touch(store / "a.xlsx", 1000)
+    b = _touch(store / "b.xlsx", 2000)
+
+    version_store.set_current(a)
+    assert version_store.current_path() == a
+    assert not [n for n in os.listdir(store) if n.endswith(".tmp")]
+
+    # another worker rewrites current.json: the in-memory copy must refresh
+    with open(version_store.POINTER_FILE, "w", encoding="utf-8") as f:
+        json.dump({"current": b}, f)
+    os.utime(version_store.POINTER_FILE, (3000, 3000))
+    assert version_store.current_path() == b
+
+
+def test_prune_keeps_current_and_newest(store):
+    paths = [_touch(store / f"v{i}.xlsx", 1000 + i) for i in range(5)]
+    (store / "v0.xlsx.pkl").write_bytes(b"cache")
+    version_store.set_current(paths[0])
+
+    removed = version_store.prune_versions(keep=3)
+
+    assert sorted(removed) == ["v1.xlsx", "v2.xlsx"]
+    assert os.path.exists(paths[0]) and os.path.exists(store / "v0.xlsx.pkl")
+    names = [v["version"] for v in version_store.list_versions()]
+    assert names == ["v4.xlsx", "v3.xlsx", "v0.xlsx"]
+
+
+def test_changes_within_one_timestamp_tick_are_seen(store):
+    a = _touch(store / "a.xlsx", 1000)
+    b = _touch(store / "b.xlsx", 2000)
+    version_store.set_current(a)
+    assert version_store.current_path() == a
+    assert [v["version"] for v in version_store.list_versions()] == ["b.xlsx", "a.xlsx"]
+    pointer_mtime = os.stat(version_store.POINTER_FILE).st_mtime_ns
+    dir_mtime = os.stat(store).st_mtime_ns
+
+    # another worker flips the pointer and uploads a version in the same tick
+    tmp = version_store.POINTER_FILE + ".other.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"current": b}, f)
+    os.replace(tmp, version_store.POINTER_FILE)
+    c = _touch(store / "c.xlsx", 3000)
+    version_store._mark_changed()
+    os.utime(version_store.POINTER_FILE, ns=(pointer_mtime, pointer_mtime))
+    os.utime(store, ns=(dir_mtime, dir_mtime))
+
+    assert version_store.current_path() == b
+    assert c in [v["path"] for v in version_store.list_versions()]
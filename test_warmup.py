@@ -0,0 +1,128 @@
+import sys
+
+import warmup
+
+
+def test_run_records_each_step(monkeypatch):
+    calls = []
+    monkeypatch.setattr(warmup, "STEPS", {
+        "ok": lambda: calls.append("ok"),
+        "broken": lambda: 1 / 0,
+    })
+    monkeypatch.setattr(warmup, "status", {})
+
+    status = warmup.run()
+
+    assert calls == ["ok"]
+    assert status["ok"]["ready"] and status["ok"]["error"] is None
+    assert not status["broken"]["ready"] and "division by zero" in status["broken"]["error"]
+
+
+def test_background_warmup_does_not_block(monkeypatch):
+    import threading
+    gate = threading.Event()
+    monkeypatch.setattr(warmup, "STEPS", {"slow": gate.wait})
+    monkeypatch.setattr(warmup, "status", {})
+
+    assert warmup.start_background() is True
+    assert warmup.start_background() is False      # already running
+    gate.set()
+    warmup._thread.join(5)
+    assert warmup.status["slow"]["ready"]
+
+
+def test_api_import_does_not_load_heavy_dependencies(tmp_path):
+    import os
+    import subprocess
+    code = (
+        "import sys, main; "
+        "print(','.join(m for m in ('pandas', 'numpy', 'docxtpl', 'PyPDF2', 'googleapiclient', 'pytesseract') "
+        "if m in sys.modules))"
+    )
+    env = {**os.environ, "STATE_DB": str(tmp_path / "state.db"), "SUPPLIERS_DIR": str(tmp_path / "suppliers"),
+           "FEEDBACK_DIR": str(tmp_path / "feedback")}
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env)
+    assert out.stdout.strip() == ""
+
+
+def test_report_ready_only_when_configured_subsystems_are_warm(state_db, monkeypatch):
+    import shared_state
+    from datetime import date
+
+    monkeypatch.setattr(warmup, "status", {})
+    monkeypatch.setattr(warmup, "WARMUP_FX_CURRENCIES", ["USD"])
+    monkeypatch.setattr(warmup, "conversion_configured", lambda: False)
+    monkeypatch.setattr(warmup, "drive_configured", lambda: False)
+    monkeypatch.setattr(warmup, "_check_suppliers", lambda: {"ready": True})
+    monkeypatch.setattr(warmup, "_check_templates", lambda: {"ready": True})
+    monkeypatch.setattr(warmup, "MODULES", ("os",))
+
+    monkeypatch.setattr(warmup, "_fx_refresh_at", 0.0)
+    monkeypatch.setitem(warmup.STEPS, "fx", lambda: None)
+
+    rep = warmup.report(executor={"busy": 1, "limit": 40, "waiting": 0})
+    assert not rep["ready"]
+    assert rep["subsystems"]["fx"] == {"ready": False, "missing": ["USD"], "stale": {}}
+    assert warmup.not_ready_steps(rep) == ["fx"]
+
+    shared_state.cache_set("fx", f"USD:{date.today().isoformat()}", 1.8)
+    assert warmup.report(executor={"busy": 1, "limit": 40, "waiting": 0})["ready"]
+    # a long queue means the instance is saturated
+    assert not warmup.report(executor={"busy": 40, "limit": 40, "waiting": 100})["ready"]
+    assert not warmup.report(executor={"busy": 0, "limit": 40, "waiting": 0, "queued": 100})["ready"]
+
+
+def test_fx_stays_ready_on_a_recent_cached_rate_and_refreshes_in_background(state_db, tmp_path, monkeypatch):
+    import threading
+    import shared_state
+    from datetime import date, timedelta
+
+    monkeypatch.setattr(warmup, "status", {})
+    monkeypatch.setattr(warmup, "WARMUP_FX_CURRENCIES", ["USD"])
+    monkeypatch.setattr(warmup, "_fx_refresh_at", 0.0)
+    refreshed = threading.Event()
+    monkeypatch.setitem(warmup.STEPS, "fx", refreshed.set)
+
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    shared_state.cache_set("fx", f"USD:{yesterday}", 1.8)       # e.g. just after midnight, or the FX API is down
+    assert warmup._check_fx() == {"ready": True, "missing": [], "stale": {"USD": yesterday}}
+    assert refreshed.wait(5)
+    warmup._thread.join(5)
+
+    refreshed.clear()
+    warmup._check_fx()                                          # throttled: no second refresh right away
+    assert not refreshed.wait(0.2)
+
+    old = (date.today() - timedelta(days=30)).isoformat()
+    monkeypatch.setattr(shared_state, "STATE_DB", str(tmp_path / "other.db"))
+    shared_state.cache_set("fx", f"USD:{old}", 1.8)
+    assert warmup._check_fx()["missing"] == ["USD"]
+
+
+def test_ready_is_503_while_invoices_queue_up_after_warmup(monkeypatch):
+    import asyncio
+    import json
+    import admission
+    import main
+
+    for check in ("_check_suppliers", "_check_templates", "_check_fx", "_check_conversion", "_check_drive"):
+        monkeypatch.setattr(warmup, check, lambda: {"ready": True})
+    monkeypatch.setattr(warmup, "MODULES", ("os",))
+    monkeypatch.setattr(warmup, "READY_MAX_QUEUE", 2)
+    monkeypatch.setattr(admission, "_scheduler", admission.Scheduler(slots=1, per_client=1))
+
+    async def scenario():
+        statuses = [(await main.ready()).status_code]
+        sched = admission.scheduler()
+        await sched.acquire("a", "text", 1)                      # the one slot is busy ...
+        waiters = [asyncio.ensure_future(sched.acquire(c, "text", 1)) for c in "bcd"]
+        await asyncio.sleep(0)                                   # ... and three invoices wait for it
+        res = await main.ready()
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return statuses + [res.status_code], json.loads(res.body)["subsystems"]["executor"]
+
+    statuses, executor = asyncio.run(scenario())
+    assert statuses == [200, 503]
+    assert executor["queued"] == 3 and not executor["ready"]
@@ -0,0 +1,170 @@
+# version_store.py
+import os
+import json
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    import fcntl  # POSIX only; on other platforms we fall back to the in-process lock
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+SUPPLIERS_PATH = os.getenv("SUPPLIERS_PATH", "suppliers.xlsx")
+SUPPLIERS_DIR = os.getenv("SUPPLIERS_DIR", "/app/data/suppliers")
+POINTER_FILE = os.path.join(SUPPLIERS_DIR, "current.json")
+LOCK_FILE = os.path.join(SUPPLIERS_DIR, ".lock")
+EMPTY_VERSION = os.path.join(SUPPLIERS_DIR, "suppliers_empty.xlsx")
+KEEP_VERSIONS = int(os.getenv("SUPPLIERS_KEEP_VERSIONS", "20"))
+# קבצים נלווים לכל גרסה (cache / metadata) — נמחקים יחד איתה
+SIDECAR_SUFFIXES = (".pkl", ".meta.json")
+
+os.makedirs(SUPPLIERS_DIR, exist_ok=True)
+
+_lock = threading.RLock()
+_depth = 0          # nesting of locked() in the thread that holds _lock
+_pointer: tuple[Optional[tuple], Optional[str]] = (None, None)   # (current.json signature, path)
+_manifest: tuple[Optional[tuple], list[dict]] = (None, [])        # (dir + .changes signatures, versions)
+
+
+@contextmanager
+def locked():
+    """
+    Serialises pointer/manifest/cache writes across threads and worker
+    processes. Re-entrant within a thread (flock on a second descriptor would
+    wait for ourselves).
+    """
+    global _depth
+    with _lock:
+        if fcntl is None or _depth:
+            _depth += 1
+            try:
+                yield
+            finally:
+                _depth -= 1
+            return
+        with open(LOCK_FILE, "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            _depth = 1
+            try:
+                yield
+            finally:
+                _depth = 0
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def _signature(path: str) -> Optional[tuple]:
+    """
+    (inode, size, mtime_ns). mtime alone misses two changes inside one
+    timestamp tick; os.replace always brings a new inode.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _changes_file() -> str:
+    return os.path.join(SUPPLIERS_DIR, ".changes")
+
+
+def _mark_changed() -> None:
+    """
+    Replaces .changes (a new inode every time) after the version list changed:
+    a directory's own stat can stay the same when a file is added or removed
+    within one timestamp tick.
+    """
+    tmp = _changes_file() + f".{os.getpid()}.tmp"
+    open(tmp, "w").close()
+    os.replace(tmp, _changes_file())
+
+
+def _read_pointer() -> Optional[str]:
+    try:
+        with open(POINTER_FILE, "r", encoding="utf-8") as f:
+            p = json.load(f).get("current")
+    except (OSError, ValueError):
+        return None
+    return p if p and os.path.exists(p) else None
+
+
+def current_path() -> str:
+    """
+    The current supplier version. The parsed pointer is kept in memory and only
+    re-read when current.json's signature changes (one stat per call), so every
+    worker sees a flip made by any other worker.
+    """
+    global _pointer
+    sig = _signature(POINTER_FILE)
+    cached_sig, cached = _pointer
+    if sig is None or sig != cached_sig:
+        cached = _read_pointer() if sig is not None else None
+        _pointer = (sig, cached)
+    if cached:
+        return cached
+    if os.path.exists(SUPPLIERS_PATH):
+        return SUPPLIERS_PATH
+    # אם אין כלום עדיין — ניצור קובץ ריק מינימלי
+    if not os.path.exists(EMPTY_VERSION):
+        import pandas as pd
+        pd.DataFrame(columns=["SupplierCompanyID"]).to_excel(EMPTY_VERSION, index=False)
+    return EMPTY_VERSION
+
+
+def set_current(path: str) -> None:
+    """Atomically flips current.json (write temp file + fsync + rename)."""
+    global _pointer
+    with locked():
+        tmp = POINTER_FILE + f".{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"current": path}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, POINTER_FILE)
+        _pointer = (_signature(POINTER_FILE), path)
+        _mark_changed()         # a new version is uploaded right before it becomes current
+
+
+def version_path(version: str) -> str:
+    return os.path.join(SUPPLIERS_DIR, os.path.basename(version))
+
+
+def list_versions() -> list[dict]:
+    """
+    Versions (newest first). Cached in memory and rebuilt with a single
+    scandir only when the directory or its .changes marker changes.
+    """
+    global _manifest
+    sig = (_signature(SUPPLIERS_DIR), _signature(_changes_file()))
+    cached_sig, items = _manifest
+    if sig[0] is not None and sig == cached_sig:
+        return items
+    items = []
+    with os.scandir(SUPPLIERS_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(".xlsx") and entry.is_file():
+                items.append({"version": entry.name, "path": entry.path, "mtime": entry.stat().st_mtime})
+    items.sort(key=lambda x: x["mtime"], reverse=True)
+    _manifest = (sig, items)
+    return items
+
+
+def prune_versions(keep: int = KEEP_VERSIONS) -> list[str]:
+    """Deletes the oldest versions (and their sidecars) beyond `keep`; never the current one."""
+    if keep <= 0:
+        return []
+    removed = []
+    with locked():
+        current = current_path()
+        versions = [v for v in list_versions() if v["path"] != current and v["path"] != EMPTY_VERSION]
+        for v in versions[max(keep - 1, 0):]:
+            for p in [v["path"]] + [v["path"] + s for s in SIDECAR_SUFFIXES]:
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+            removed.append(v["version"])
+        if removed:
+            _mark_changed()
+    return removed
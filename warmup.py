@@ -0,0 +1,207 @@
+# warmup.py
+"""
+Background warm-up and readiness. The API starts without its heavy
+dependencies (see the lazy imports in process.py / suppliers_api.py); when
+WARMUP_ON_START=1 a daemon thread preloads them, together with the current
+supplier registry, the Word templates, today's FX rates, a first LibreOffice
+conversion and the Drive client, after the server is already accepting
+requests. report() tells /ready whether each of them is warm right now.
+"""
+import os
+import sys
+import time
+import shutil
+import importlib
+import threading
+from datetime import date, timedelta
+from typing import Callable, Iterable, Optional
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+# מטבעות שכדאי שיהיה להם שער של היום ב-cache (EUR/BGN קבועים)
+WARMUP_FX_CURRENCIES = [c.strip().upper() for c in os.getenv("WARMUP_FX_CURRENCIES", "USD").split(",") if c.strip()]
+# כל כמה זמן /ready מנסה לרענן ברקע שער של היום שעוד חסר
+FX_REFRESH_SEC = float(os.getenv("FX_REFRESH_SEC", "300"))
+# מעל כמה בקשות שמחכות (לתור ה-admission או ל-thread) המופע מדווח not ready
+READY_MAX_QUEUE = int(os.getenv("READY_MAX_QUEUE", "8"))
+MODULES = ("pandas", "numpy", "openpyxl", "docxtpl", "PyPDF2", "requests",
+           "googleapiclient.discovery", "googleapiclient.http", "batch_validation", "supplier_registry")
+
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_fx_refresh_at = 0.0
+status: dict[str, dict] = {}
+
+
+def _modules() -> None:
+    for name in MODULES:
+        importlib.import_module(name)
+
+
+def _suppliers() -> None:
+    from supplier_registry import load_suppliers
+    from version_store import current_path
+    load_suppliers(current_path())
+
+
+def _templates() -> None:
+    from process import load_template, template_files
+    for path in template_files():
+        load_template(path).init_docx()
+
+
+def _fx() -> None:
+    import datetime
+    from process import get_exchange_rate_for_date
+    for c in WARMUP_FX_CURRENCIES:
+        get_exchange_rate_for_date(datetime.datetime.now(), c)
+
+
+def _conversion() -> None:
+    # ההמרה הראשונה של LibreOffice יוצרת את ה-profile ואיטית פי כמה — עדיף שתקרה כאן
+    from process import docx_to_pdf, template_files
+    if not conversion_configured():
+        return
+    with open(template_files()[0], "rb") as f:
+        docx_to_pdf(f.read())
+
+
+def _drive() -> None:
+    from process import get_drive_service
+    if drive_configured():
+        get_drive_service()
+
+
+STEPS: dict[str, Callable[[], None]] = {
+    "modules": _modules,
+    "suppliers": _suppliers,
+    "templates": _templates,
+    "fx": _fx,
+    "conversion": _conversion,
+    "drive": _drive,
+}
+
+
+def run(steps: Optional[Iterable[str]] = None) -> dict:
+    """Runs the given steps (all by default) in order; a failing step doesn't stop the others."""
+    for name in steps or STEPS:
+        t0 = time.perf_counter()
+        try:
+            STEPS[name]()
+            error = None
+        except Exception as e:
+            error = str(e)
+        status[name] = {"ready": error is None, "ms": round((time.perf_counter() - t0) * 1000, 1), "error": error}
+    return status
+
+
+def start_background(steps: Optional[Iterable[str]] = None) -> bool:
+    """Starts run() in a daemon thread; False if a warm-up is already running."""
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        _thread = threading.Thread(target=run, args=(list(steps) if steps else None,), name="warmup", daemon=True)
+        _thread.start()
+    return True
+
+
+def running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+
+# ---------------------------
+# Readiness
+# ---------------------------
+def conversion_configured() -> bool:
+    return shutil.which("soffice") is not None
+
+
+def drive_configured() -> bool:
+    return bool(os.getenv("GOOGLE_CREDS_JSON"))
+
+
+def _check_suppliers() -> dict:
+    if "supplier_registry" not in sys.modules:      # לא נטען אפילו המודול
+        return {"ready": False}
+    from supplier_registry import is_loaded
+    from version_store import current_path
+    path = current_path()
+    return {"ready": is_loaded(path), "version": os.path.basename(path)}
+
+
+def _check_templates() -> dict:
+    if "process" not in sys.modules:
+        return {"ready": False}
+    from process import is_template_loaded, template_files
+    files = template_files()
+    loaded = sum(is_template_loaded(p) for p in files)
+    return {"ready": bool(files) and loaded == len(files), "loaded": loaded, "total": len(files)}
+
+
+def _check_fx() -> dict:
+    """
+    Ready with a cached rate of the last FX_STALE_DAYS days — the same rates
+    get_exchange_rate_for_date falls back to — so midnight or an FX outage
+    doesn't take the instance out of rotation. A missing rate for today is
+    refreshed in the background (at most every FX_REFRESH_SEC).
+    """
+    from process import FX_STALE_DAYS
+    from shared_state import cache_get
+    today = date.today()
+    missing, stale = [], {}
+    for c in WARMUP_FX_CURRENCIES:
+        for delta in range(FX_STALE_DAYS + 1):
+            day = (today - timedelta(days=delta)).isoformat()
+            if cache_get("fx", f"{c}:{day}") is not None:
+                if delta:
+                    stale[c] = day
+                break
+        else:
+            missing.append(c)
+    if missing or stale:
+        _refresh_fx()
+    return {"ready": not missing, "missing": missing, "stale": stale}
+
+
+def _refresh_fx() -> None:
+    global _fx_refresh_at
+    now = time.monotonic()
+    if now - _fx_refresh_at < FX_REFRESH_SEC or running():
+        return
+    _fx_refresh_at = now
+    start_background(["fx"])
+
+
+def _check_conversion() -> dict:
+    step = status.get("conversion") or {}
+    return {"ready": bool(step.get("ready")), "configured": conversion_configured(), "error": step.get("error")}
+
+
+def _check_drive() -> dict:
+    process = sys.modules.get("process")
+    return {"ready": getattr(process, "_drive_service", None) is not None, "configured": drive_configured()}
+
+
+def report(executor: Optional[dict] = None) -> dict:
+    """
+    Current state of every subsystem. The instance is ready when every
+    configured subsystem is warm and the request queue is short.
+    """
+    subsystems = {
+        "modules": {"ready": all(m in sys.modules for m in MODULES)},
+        "suppliers": _check_suppliers(),
+        "templates": _check_templates(),
+        "fx": _check_fx(),
+        "conversion": _check_conversion(),
+        "drive": _check_drive(),
+    }
+    if executor is not None:
+        backlog = executor.get("waiting", 0) + executor.get("queued", 0)
+        subsystems["executor"] = {**executor, "ready": backlog <= READY_MAX_QUEUE}
+    ready = all(s["ready"] for s in subsystems.values() if s.get("configured", True))
+    return {"ready": ready, "warming": running(), "subsystems": subsystems}
+
+
+def not_ready_steps(rep: dict) -> list[str]:
+    return [name for name, s in rep["subsystems"].items()
+            if name in STEPS and not s["ready"] and s.get("configured", True)]